@@ -0,0 +1,175 @@
+import os
+from dataclasses import dataclass
+
+import ffmpeg
+
+from back_end import runner
+from back_end.media_info import probe, get_stream
+from back_end.scheduler import ffmpeg_threads
+
+# default arguments of each effect, in the order of the chain syntax "name=a:b:c"
+EFFECTS = {
+    "reverb": (1000.0, 0.6),  # delay (ms), decay
+    "deep_voice": (0.8,),  # pitch factor, the audio is slowed down with it
+    "pitch": (0.8,),  # pitch factor, the duration is kept
+    "tempo": (1.0,),  # speed factor, the pitch is kept
+    "eq": (1000.0, 0.0, 1.0),  # frequency (Hz), gain (dB), width (octaves)
+    "gain": (0.0,),  # dB
+    "fade_in": (1.0,),  # seconds
+    "fade_out": (1.0,),  # seconds
+}
+# effects changing the duration, not applicable when the video stream is copied
+DURATION_EFFECTS = ("deep_voice", "tempo")
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac', '.m4a', '.aac', '.opus')
+# atempo only accepts factors in this range
+ATEMPO_RANGE = (0.5, 2.0)
+
+
+@dataclass
+class Effect:
+    name: str
+    args: tuple[float, ...] = ()
+
+    def values(self) -> tuple[float, ...]:
+        """
+        :return: the arguments, completed with the defaults of the effect
+        """
+        defaults = EFFECTS[self.name]
+        return tuple(self.args) + defaults[len(self.args):]
+
+
+def parse_effects(chain: str) -> list[Effect]:
+    """
+    :param chain: effects separated by commas, with their arguments separated by colons,
+        ex: "reverb, pitch=0.8, eq=100:-3, fade_out=2"
+    :raise ValueError: on an unknown effect or invalid arguments
+    """
+    effects = []
+    for item in chain.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, args = item.partition('=')
+        name = name.strip()
+        if name not in EFFECTS:
+            raise ValueError(f"unknown effect {name}, expected one of {', '.join(EFFECTS)}")
+        values = tuple(float(arg) for arg in args.split(':')) if args.strip() else ()
+        if len(values) > len(EFFECTS[name]):
+            raise ValueError(f"{name} takes at most {len(EFFECTS[name])} arguments")
+        effects.append(Effect(name, values))
+    if not effects:
+        raise ValueError("no effect given")
+    return effects
+
+
+def _atempo(factor: float) -> list[tuple[str, dict]]:
+    """
+    atempo filters whose product is factor
+    """
+    if factor <= 0:
+        raise ValueError(f"invalid tempo factor: {factor}")
+    low, high = ATEMPO_RANGE
+    filters = []
+    while factor > high:
+        filters.append(('atempo', {'tempo': high}))
+        factor /= high
+    while factor < low:
+        filters.append(('atempo', {'tempo': low}))
+        factor /= low
+    if factor != 1:
+        filters.append(('atempo', {'tempo': factor}))
+    return filters
+
+
+def effect_filters(effects: list[Effect], sample_rate: int,
+                   duration: float | None) -> tuple[list[tuple[str, dict]], float | None]:
+    """
+    Compile an effect chain into audio filters, applied in one pass
+    :param sample_rate: sample rate of the input, kept by the pitch effects
+    :param duration: duration of the input, needed by fade_out
+    :return: (filters as (name, kwargs), duration of the output)
+    """
+    filters = []
+    for effect in effects:
+        values = effect.values()
+        if effect.name == "reverb":
+            delay, decay = values
+            filters.append(('aecho', {'in_gain': 0.8, 'out_gain': 0.9, 'delays': delay, 'decays': decay}))
+        elif effect.name in ("deep_voice", "pitch"):
+            factor, = values
+            if factor <= 0:
+                raise ValueError(f"invalid pitch factor: {factor}")
+            # played at factor x the real rate, then resampled back to it
+            filters.append(('asetrate', {'r': round(sample_rate * factor)}))
+            filters.append(('aresample', {'osr': sample_rate}))
+            if effect.name == "pitch":
+                filters += _atempo(1 / factor)
+            elif duration is not None:
+                duration /= factor
+        elif effect.name == "tempo":
+            factor, = values
+            filters += _atempo(factor)
+            if duration is not None:
+                duration /= factor
+        elif effect.name == "eq":
+            frequency, gain, width = values
+            filters.append(('equalizer', {'f': frequency, 't': 'o', 'w': width, 'g': gain}))
+        elif effect.name == "gain":
+            filters.append(('volume', {'volume': f"{values[0]}dB"}))
+        elif effect.name == "fade_in":
+            filters.append(('afade', {'t': 'in', 'st': 0, 'd': values[0]}))
+        elif effect.name == "fade_out":
+            if duration is None:
+                raise ValueError("fade_out needs the duration of the input")
+            filters.append(('afade', {'t': 'out', 'st': max(0.0, duration - values[0]), 'd': values[0]}))
+    return filters, duration
+
+
+def apply_effects(input_path: str, effects: str | list[Effect], output_path: str = "") -> str:
+    """
+    Apply an effect chain in a single ffmpeg pass: the audio is decoded and encoded once.
+    The video stream of a video is copied.
+    :param effects: list of effects, or chain of effects (see parse_effects)
+    :param output_path: default: input path with the suffix __fx
+    :return: path to output file
+    """
+    if not os.path.exists(input_path):
+        raise Exception(f"{input_path} doesn't exist")
+    if isinstance(effects, str):
+        effects = parse_effects(effects)
+
+    info = probe(input_path)
+    audio_stream = get_stream(info, 'audio')
+    if audio_stream is None:
+        raise Exception(f"{input_path} has no audio stream")
+    sample_rate = int(audio_stream.get('sample_rate') or 44100)
+    duration = float(info['format']['duration']) if 'duration' in info.get('format', {}) else None
+
+    if not output_path:
+        base, ext = os.path.splitext(input_path)
+        output_path = base + "__fx" + ext
+    output_ext = os.path.splitext(output_path)[1].lower()
+    keep_video = get_stream(info, 'video') is not None and output_ext not in AUDIO_EXTENSIONS
+    if keep_video:
+        changing = [effect.name for effect in effects if effect.name in DURATION_EFFECTS]
+        if changing:
+            raise Exception(f"{', '.join(changing)} would desynchronize the audio and the video of {input_path}")
+
+    input_stream = ffmpeg.input(input_path)
+    audio = input_stream.audio
+    for name, kwargs in effect_filters(effects, sample_rate, duration)[0]:
+        audio = audio.filter(name, **kwargs)
+
+    output_args = {**ffmpeg_threads()}
+    if output_ext == '.mp3':
+        output_args.update({'acodec': 'libmp3lame', 'aq': 2})
+    elif output_ext in ('.mp4', '.mov', '.m4a'):
+        output_args.update({'acodec': 'aac', 'audio_bitrate': '192k'})
+    if keep_video:
+        # the reverb tail doesn't lengthen the video
+        output = ffmpeg.output(input_stream.video, audio, output_path, vcodec='copy', shortest=None, **output_args)
+    else:
+        output = ffmpeg.output(audio, output_path, **output_args)
+
+    runner.run(output.overwrite_output())
+    return output_path
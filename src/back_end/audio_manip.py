@@ -4,10 +4,18 @@ import tempfile
 import ffmpeg
 import os
 import json
-import subprocess
 
+from dataclasses import asdict
 from math import ceil
+from back_end import runner
+from back_end.pcm_analysis import analyze, Analysis
+from back_end.pcm_mix import stream_mix, mix_gain, MIX_RATE, MIX_CHANNELS
+from back_end.audio_effects import apply_effects, Effect
+from back_end.encoders import resolve_encoder
+from back_end.media_info import probe, get_stream, content_key, get_table
+from back_end.scheduler import ffmpeg_threads
 from back_end.video_manip import get_video_duration
+from toolbox.Parameters import Params
 
 
 def is_audio(path: str):
@@ -23,8 +31,8 @@ def get_audio_duration(audio_path: str) -> float | str:
     if not is_audio(audio_path):
         return f"Error: Not a audio file"
     try:
-        probe = ffmpeg.probe(audio_path)
-        duration = float(probe['format']['duration'])
+        info = probe(audio_path)
+        duration = float(info['format']['duration'])
         return duration
     except ffmpeg.Error as e:
         return f"ffmpeg error: {e.stderr}"
@@ -34,15 +42,22 @@ def get_audio_duration(audio_path: str) -> float | str:
         return f"Unexpected error: {str(e)}"
 
 
-def get_loudness(file_path):
-    """Get the integrated loudness of an audio file"""
+LOUDNESS_KEYS = ['input_i', 'input_lra', 'input_tp', 'input_thresh', 'target_offset']
+
+
+def measure_loudness(file_path: str, i: float = -16, tp: float = -1.5, lra: float = 11) -> dict[str, float] | None:
+    """
+    Decode the whole file through loudnorm (first pass)
+    :param i, tp, lra: targets of the second pass, the offset is computed for them
+    :return: integrated loudness, LRA, true peak, threshold and offset, None if measurement fails
+    """
     json_text = ""
     try:
         # loudnorm filter
         args = (
             ffmpeg
             .input(file_path)
-            .filter_('loudnorm', print_format='json', i=-24, lra=7, tp=-2)
+            .filter_('loudnorm', print_format='json', i=i, lra=lra, tp=tp)
             .output('-', format='null')
             .compile()
         )
@@ -50,87 +65,142 @@ def get_loudness(file_path):
         # reduce output noise
         args.insert(1, '-hide_banner')
 
-        process = subprocess.run(
-            args,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        _, stderr = runner.run(args, capture_stderr=True)
 
         # Extract JSON from stderr after "[Parsed_loudnorm_0 @ ...]"
-        stderr = process.stderr
+        stderr = stderr.decode('utf-8', errors='replace')
         json_match_start = stderr.rfind('{\n')
         json_match_end = stderr.rfind('}\n')
         if 0 <= json_match_start < json_match_end:
             json_text = stderr[json_match_start:json_match_end + 1]
             loudness_info = json.loads(json_text)
-            return float(loudness_info.get('input_i', -24.0))
+            return {key: float(loudness_info[key]) for key in LOUDNESS_KEYS}
 
-        logging.error("Error: get_loudness -> returning default value")
+        logging.error("Error: measure_loudness -> no loudnorm output")
 
     except ffmpeg.Error as e:
-        logging.error(f"Error(get_loudness): ffmpeg: {e}")
+        logging.error(f"Error(measure_loudness): ffmpeg: {e}")
     except json.JSONDecodeError as e:
-        logging.error(f"Error(get_loudness): json: {e}\n{json_text}\n")
-    except (ValueError, IndexError) as e:
-        logging.error(f"Error(get_loudness): ValueError or IndexError: {e}\n{json_text}\n")
-    return -24.0
+        logging.error(f"Error(measure_loudness): json: {e}\n{json_text}\n")
+    except (ValueError, IndexError, KeyError) as e:
+        logging.error(f"Error(measure_loudness): ValueError, IndexError or KeyError: {e}\n{json_text}\n")
+    return None
 
 
-def apply_reverb(input_path: str) -> str:
+def get_loudness_stats(file_path: str, i: float = -16, tp: float = -1.5, lra: float = 11) -> dict[str, float] | None:
     """
-    add reverb to a copy of input file
+    Loudness measurements of a file, cached on disk by content identity and targets:
+    the same track is only decoded once, whatever its path
+    :return: see measure_loudness
     """
-    if not os.path.exists(input_path):
-        raise Exception(f"{input_path} doesn't exist")
+    try:
+        key = f"{content_key(file_path)}:{i}:{tp}:{lra}"
+    except OSError as e:
+        logging.error(f"Error(get_loudness_stats): {e}")
+        return None
 
-    # format: "in_gain:out_gain:delays:decays"
-    reverb_parameters = "0.8:0.9:1000:0.6"
-    output_path = os.path.splitext(input_path)[0] + "__reverb.mp3"
+    cache = get_table("loudness")
+    stats = cache.get(key)
+    if stats is None:
+        stats = measure_loudness(file_path, i, tp, lra)
+        if stats is not None:
+            cache.set(key, stats)
+    return stats
 
-    input_stream = ffmpeg.input(input_path)
 
-    audio = input_stream.audio.filter("aecho", reverb_parameters)
+def get_analysis(file_path: str) -> Analysis | None:
+    """
+    Loudness, true peak, RMS and silences of a file (see pcm_analysis.analyze), cached on disk by content identity
+    :return: None if the file can't be analysed
+    """
+    try:
+        key = content_key(file_path)
+    except OSError as e:
+        logging.error(f"Error(get_analysis): {e}")
+        return None
+
+    cache = get_table("analysis")
+    stored = cache.get(key)
+    if stored is not None:
+        return Analysis(**{**stored, 'silences': [tuple(region) for region in stored['silences']]})
+    try:
+        analysis = analyze(file_path)
+    except ffmpeg.Error as e:
+        logging.error(f"Error(get_analysis): ffmpeg: {e.stderr.decode(errors='replace') if e.stderr else e}")
+        return None
+    cache.set(key, asdict(analysis))
+    return analysis
 
-    output = ffmpeg.output(
-        audio,
-        output_path,
-        acodec='libmp3lame',
-        aq=2
-    )
 
-    output = output.overwrite_output()
-    ffmpeg.run(output)
+def get_loudness(file_path: str) -> float | None:
+    """
+    Get the integrated loudness (LUFS) of an audio file, from the PCM analysis engine
+    :return: None if the file can't be analysed
+    """
+    analysis = get_analysis(file_path)
+    return analysis.integrated if analysis is not None else None
 
-    return output_path
+
+def loudnorm_linear(stats: dict[str, float], i: float = -16, tp: float = -1.5, lra: float = 11) -> dict:
+    """
+    Arguments of a second pass loudnorm filter, in linear mode
+    :param stats: measurements of the first pass (see get_loudness_stats)
+    :param i: target integrated loudness
+    :param tp: target true peak
+    :param lra: target loudness range
+    :return: kwargs for the loudnorm filter
+    """
+    return {
+        'i': i,
+        'tp': tp,
+        'lra': lra,
+        'measured_i': stats['input_i'],
+        'measured_lra': stats['input_lra'],
+        'measured_tp': stats['input_tp'],
+        'measured_thresh': stats['input_thresh'],
+        'offset': stats['target_offset'],
+        'linear': 'true'
+    }
 
 
-def apply_deep_voice(input_path: str, sampling_rate: float = 0.8) -> str:
+def normalize_audio(input_path: str, output_path: str, i: float = -16, tp: float = -1.5, lra: float = 11) -> str:
     """
-    add deep effect to a copy of input file
+    Two-pass loudness normalization, the first pass is read from the loudness cache
+    :param input_path: path to input audio file
+    :param output_path: path to output audio file
+    :return: path to output audio file
     """
     if not os.path.exists(input_path):
         raise Exception(f"{input_path} doesn't exist")
-    if sampling_rate <= 0 or sampling_rate > 1:
-        raise Exception(f"invalid sampling rate: {sampling_rate}")
 
-    output_path = os.path.splitext(input_path)[0] + f"__deep{sampling_rate}.mp3"
+    stats = get_loudness_stats(input_path, i, tp, lra)
+    if stats is None:
+        raise Exception(f"Could not measure loudness of {input_path}")
 
-    input_stream = ffmpeg.input(input_path)
+    runner.run(
+        ffmpeg.input(input_path)
+        .filter('loudnorm', **loudnorm_linear(stats, i, tp, lra))
+        .output(output_path)
+        .overwrite_output()
+    )
+    return output_path
 
-    # asetrate filter to lower the pitch
-    audio = input_stream.audio.filter("asetrate", f"{sampling_rate}*44100")
 
-    output = ffmpeg.output(
-        audio,
-        output_path,
-        acodec='libmp3lame',
-        aq=2
-    )
+def apply_reverb(input_path: str) -> str:
+    """
+    add reverb to a copy of input file
+    """
+    return apply_effects(input_path, [Effect("reverb")], os.path.splitext(input_path)[0] + "__reverb.mp3")
 
-    output = output.overwrite_output()
-    ffmpeg.run(output)
 
-    return output_path
+def apply_deep_voice(input_path: str, sampling_rate: float = 0.8) -> str:
+    """
+    add deep effect to a copy of input file, the sample rate of the input is kept
+    """
+    if sampling_rate <= 0 or sampling_rate > 1:
+        raise Exception(f"invalid sampling rate: {sampling_rate}")
+    return apply_effects(input_path, [Effect("deep_voice", (sampling_rate,))],
+                         os.path.splitext(input_path)[0] + f"__deep{sampling_rate}.mp3")
 
 
 def multiply_audio(input_audio_path: str, output_audio_path: str, multiplier: int) -> None:
@@ -168,58 +238,68 @@ def multiply_audio(input_audio_path: str, output_audio_path: str, multiplier: in
 
     try:
         # concat demuxer
-        (ffmpeg
-         .input(temp_file_path, format='concat', safe=0)
-         .output(output_audio_path, c='copy')
-         .overwrite_output()
-         .run())
+        runner.run(
+            ffmpeg.input(temp_file_path, format='concat', safe=0)
+            .output(output_audio_path, c='copy')
+            .overwrite_output()
+        )
     finally:
         os.unlink(temp_file_path)
         if temp_input_path:
             os.unlink(temp_input_path)
 
 
-def merge_audio(audio1_path: str, audio2_path: str, output_mp3_path: str) -> None:
+def merge_audio(audio1_path: str, audio2_path: str, output_mp3_path: str, two_pass: bool = False) -> None:
     """
     Only merge two audio files with automatic normalization
+    :param two_pass: normalize both files to the same loudness with a linear loudnorm
+    instead of lowering the loudest one
     """
     if not os.path.exists(audio1_path):
         raise Exception(f"{audio1_path} doesn't exist")
     if not os.path.exists(audio2_path):
         raise Exception(f"{audio2_path} doesn't exist")
 
-    loudness1 = get_loudness(audio1_path)
-    loudness2 = get_loudness(audio2_path)
+    audio1 = ffmpeg.input(audio1_path).audio
+    audio2 = ffmpeg.input(audio2_path).audio
 
-    # Calculate volume adjustment
-    if loudness1 > loudness2:
-        vol1 = (loudness1 - loudness2) / 1.5
-        vol2 = 0
+    stats1 = get_loudness_stats(audio1_path) if two_pass else None
+    stats2 = get_loudness_stats(audio2_path) if two_pass else None
+    if stats1 is not None and stats2 is not None:
+        audio1 = audio1.filter('loudnorm', **loudnorm_linear(stats1))
+        audio2 = audio2.filter('loudnorm', **loudnorm_linear(stats2))
     else:
-        vol1 = 0
-        vol2 = (loudness2 - loudness1) / 1.5
-
-    filter_complex = (
-        f"[0:a]volume={-vol1}dB[a1];"
-        f"[1:a]volume={-vol2}dB[a2];"
-        f"[a1][a2]amix=inputs=2:duration=longest"
+        loudness1 = get_loudness(audio1_path)
+        loudness2 = get_loudness(audio2_path)
+        for path, loudness in ((audio1_path, loudness1), (audio2_path, loudness2)):
+            if loudness is None:
+                raise Exception(f"Could not measure loudness of {path}")
+
+        # Calculate volume adjustment
+        if loudness1 > loudness2:
+            vol1 = (loudness1 - loudness2) / 1.5
+            vol2 = 0
+        else:
+            vol1 = 0
+            vol2 = (loudness2 - loudness1) / 1.5
+
+        audio1 = audio1.filter('volume', f"{-vol1}dB")
+        audio2 = audio2.filter('volume', f"{-vol2}dB")
+
+    runner.run(
+        ffmpeg.filter([audio1, audio2], 'amix', inputs=2, duration='longest')
+        .output(output_mp3_path, acodec='libmp3lame')
+        .overwrite_output()
     )
 
-    input1 = ffmpeg.input(audio1_path)
-    input2 = ffmpeg.input(audio2_path)
 
-    ffmpeg.output(input1, input2,
-                  output_mp3_path,
-                  acodec='libmp3lame',
-                  filter_complex=filter_complex
-                  ).overwrite_output().run()
-
-
-def mix_audio_and_export(video_path: str, audio_path: str) -> str:
+def mix_audio_and_export(video_path: str, audio_path: str, fused: bool = True) -> str:
     """
     Merge audio in video using ffmpeg
     :param video_path: path to video file
     :param audio_path: path to audio file
+    :param fused: mix in a single ffmpeg pass without temporary files,
+    falls back to the temporary files pipeline if ffmpeg fails
     :return: path to output mixed audio file
     """
     output_mp3_path = os.path.splitext(video_path)[0] + "__mix_sound.mp3"
@@ -233,22 +313,63 @@ def mix_audio_and_export(video_path: str, audio_path: str) -> str:
     if isinstance(audio_duration, str):
         raise Exception(f"Audio duration error: {audio_duration}")
 
+    if fused:
+        try:
+            return _mix_audio_fused(video_path, audio_path, output_mp3_path, video_duration)
+        except ffmpeg.Error as e:
+            logging.error(f"Error(mix_audio_and_export): fused mix failed, using temporary files: {e}")
+
+    return _mix_audio_with_temp_files(video_path, audio_path, output_mp3_path, video_duration, audio_duration)
+
+
+def _mix_audio_fused(video_path: str, audio_path: str, output_mp3_path: str, video_duration: float) -> str:
+    """
+    One filter graph: the music is looped at demux time, both inputs are resampled,
+    mixed, normalized and trimmed to the video duration
+    """
+    video_audio = (
+        ffmpeg.input(video_path).audio
+        .filter('aresample', 44100)
+        .filter('aformat', sample_fmts='fltp', channel_layouts='stereo')
+    )
+    music = (
+        ffmpeg.input(audio_path, stream_loop=-1).audio
+        .filter('aresample', 44100)
+        .filter('aformat', sample_fmts='fltp', channel_layouts='stereo')
+    )
+
+    # I: Target integrated loudness
+    # TP: True peak limit
+    # LRA=11: Loudness range target
+    runner.run(
+        ffmpeg.filter([video_audio, music], 'amix', inputs=2, duration='first')
+        .filter('loudnorm', I=-16, TP=-1.5, LRA=11)
+        .filter('atrim', duration=video_duration)
+        .output(output_mp3_path, acodec='libmp3lame', ar=44100, ac=2, audio_bitrate='192k', **ffmpeg_threads())
+        .overwrite_output()
+    )
+    return output_mp3_path
+
+
+def _mix_audio_with_temp_files(video_path: str, audio_path: str, output_mp3_path: str,
+                               video_duration: float, audio_duration: float) -> str:
+    """
+    Fallback of mix_audio_and_export: WAV intermediates next to the source files
+    """
     # Extract audio from video and convert to consistent format
     video_audio_path = os.path.splitext(video_path)[0] + "__video_audio.wav"
-    (
+    runner.run(
         ffmpeg.input(video_path)
         .output(video_audio_path, acodec='pcm_s16le', ar=44100, ac=2)
         .overwrite_output()
-        .run()
     )
 
     # Convert input audio to same format if needed
     converted_audio_path = os.path.splitext(audio_path)[0] + "__converted.wav"
-    (
+    runner.run(
         ffmpeg.input(audio_path)
         .output(converted_audio_path, acodec='pcm_s16le', ar=44100, ac=2)
         .overwrite_output()
-        .run()
     )
     audio_path = converted_audio_path
 
@@ -265,7 +386,7 @@ def mix_audio_and_export(video_path: str, audio_path: str) -> str:
         # I: Target integrated loudness
         # TP: True peak limit
         # LRA=11: Loudness range target
-        (
+        runner.run(
             ffmpeg.filter([
                 ffmpeg.input(video_audio_path),
                 ffmpeg.input(audio_path)
@@ -273,18 +394,16 @@ def mix_audio_and_export(video_path: str, audio_path: str) -> str:
             .filter('loudnorm', I=-16, TP=-1.5, LRA=11)
             .output(output_mp3_path, acodec='libmp3lame', ar=44100, ac=2, audio_bitrate='192k')
             .overwrite_output()
-            .run()
         )
 
         # Ensure the mixed audio matches video duration
         mixed_duration = get_audio_duration(output_mp3_path)
         if mixed_duration > video_duration:
             temp_output = output_mp3_path + ".tmp.mp3"
-            (
+            runner.run(
                 ffmpeg.input(output_mp3_path)
                 .output(temp_output, acodec='libmp3lame', t=video_duration)
                 .overwrite_output()
-                .run()
             )
             os.replace(temp_output, output_mp3_path)
 
@@ -300,59 +419,136 @@ def mix_audio_and_export(video_path: str, audio_path: str) -> str:
     return output_mp3_path
 
 
+# audio codecs that can be copied as is in a mp4 container
+MP4_AUDIO_CODECS = ['aac', 'mp3', 'ac3', 'eac3', 'alac', 'opus', 'flac']
+
+
+def _video_args(compress: bool) -> tuple[dict, dict]:
+    """
+    :return: (input arguments, output arguments) of the video stream, copied unless compress is True
+    """
+    if not compress:
+        return {}, {'c:v': 'copy'}
+    encoder = resolve_encoder("hevc")
+    return encoder.input_args(), {**encoder.output_args(), 'b:v': '8000k'}
+
+
 def audio_replace(video_path: str, audio_path: str, name_add: str = "__replace.mp4", compress: bool = False) -> str:
     """
     replace audio, compress possible
+    The video stream is copied unless compress is True, the audio is looped at demux time
+    if it is shorter than the video. The audio is copied if the container accepts it, unless compress is True.
     :param video_path: path to input video file
     :param audio_path: path to input audio file
     :param name_add: suffix to add to output filename
     :param compress: whether to compress the output video
     :return: path to output video file
     """
-    audio_duration = get_audio_duration(audio_path)
     video_duration = get_video_duration(video_path)
     if type(video_duration) == str:
         return video_duration
 
-    # need audio duration -gt video
-    if audio_duration < video_duration:
-        multiply_audio(audio_path, audio_path, ceil(video_duration / audio_duration))
-
     output_path = os.path.splitext(video_path)[0] + name_add
 
-    video_input = ffmpeg.input(video_path, hwaccel='cuda')
-    audio_input = ffmpeg.input(audio_path)
+    input_args, video_args = _video_args(compress)
+    video_input = ffmpeg.input(video_path, **input_args)
+    # need audio duration -gt video: loop it until the end of the video
+    audio_input = ffmpeg.input(audio_path, stream_loop=-1)
 
     video_stream = video_input.video
     audio_stream = audio_input.audio
 
     output_args = {
-        'c:v': 'hevc_nvenc',
-        'c:a': 'copy',
+        **video_args,
         'strict': 'experimental',
-        'shortest': None
+        'shortest': None,
+        't': video_duration,
+        **ffmpeg_threads()
     }
 
+    # a bitrate can't be set on a copied stream: the audio is re-encoded when compressing
     if compress:
-        output_args.update({
-            'b:v': '8000k',
-            'b:a': '192k'
-        })
+        output_args.update({'c:a': 'aac', 'b:a': '192k'})
+    else:
+        output_args['c:a'] = 'copy' if _get_audio_codec(audio_path) in MP4_AUDIO_CODECS else 'aac'
 
-    ffmpeg.output(
+    runner.run(ffmpeg.output(
         video_stream,
         audio_stream,
         output_path,
         **output_args
-    ).overwrite_output().run()
+    ).overwrite_output())
+
+    return output_path
+
+
+def _get_audio_codec(audio_path: str) -> str:
+    try:
+        audio_stream = get_stream(probe(audio_path), 'audio')
+    except ffmpeg.Error:
+        return ""
+    return audio_stream['codec_name'] if audio_stream else ""
+
+
+def _combine_pcm(video_path: str, audio_path: str, compress: bool) -> str:
+    """
+    audio_combine without intermediate file: both audios are decoded to PCM pipes and mixed in process,
+    the mix is piped to the ffmpeg process muxing it with the video
+    """
+    video_duration = get_video_duration(video_path)
+    if isinstance(video_duration, str):
+        raise Exception(f"Video duration error: {video_duration}")
+    audio_duration = get_audio_duration(audio_path)
+    if isinstance(audio_duration, str):
+        raise Exception(f"Audio duration error: {audio_duration}")
 
+    # both inputs at the same loudness, the limiter catches the peaks of the sum
+    video_has_audio = get_stream(probe(video_path), 'audio') is not None
+    video_gain = mix_gain(get_loudness(video_path)) if video_has_audio else 1.0
+    music_gain = mix_gain(get_loudness(audio_path))
+
+    output_path = os.path.splitext(video_path)[0] + "__combine.mp4"
+    input_args, video_args = _video_args(compress)
+    mix = ffmpeg.input('pipe:', format='f32le', ar=MIX_RATE, ac=MIX_CHANNELS)
+    output_args = {**video_args, 'c:a': 'aac', 'b:a': '192k', 't': video_duration, **ffmpeg_threads()}
+    output = (
+        ffmpeg.output(ffmpeg.input(video_path, **input_args).video, mix.audio, output_path, **output_args)
+        .global_args('-loglevel', 'error', '-nostats')
+        .overwrite_output()
+    )
+    process = runner.run_async(output, pipe_stdin=True, pipe_stderr=True)
+    try:
+        try:
+            stream_mix(video_path, audio_path, process.stdin, video_duration, audio_duration,
+                       video_gain, music_gain, video_has_audio)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+    except BrokenPipeError:
+        # the muxer stopped, its error is read below
+        pass
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    err = process.stderr.read()
+    if process.wait() != 0:
+        scope = runner.current_scope()
+        if scope is not None and scope.cancelled:
+            raise runner.JobCancelled()
+        raise ffmpeg.Error('ffmpeg', None, err)
     return output_path
 
 
 def audio_combine(video_path: str, audio_path: str, compress: bool = True) -> str:
     """
     combine video file with audio file
+    the mix is done by ffmpeg, or in process if the mix backend option is numpy
     """
+    if Params().get_mix_backend() == "numpy":
+        return _combine_pcm(video_path, audio_path, compress)
     new_audio_path = mix_audio_and_export(video_path, audio_path)
     output_path = audio_replace(video_path, new_audio_path, "__combine.mp4", compress)
     os.remove(new_audio_path)
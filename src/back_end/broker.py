@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from back_end.journal import RUNNING, DONE, FAILED
+
+QUEUED = "queued"
+
+# operations a worker can run, by name of the back end function (see worker.OPERATIONS)
+REMOTE_OPERATIONS = ("video_compress", "convert_media", "audio_replace")
+
+DEFAULT_PORT = 8765
+# a running job without news of its worker for LEASE_TIMEOUT seconds goes back to the queue
+LEASE_TIMEOUT = 120
+REQUEST_TIMEOUT = 30
+
+logger = logging.getLogger("broker")
+
+
+class JobQueue:
+    """
+    Persistent queue of the broker, in a SQLite file: jobs survive a restart of the broker,
+    the jobs of a worker that stopped answering are given to another one.
+    """
+
+    def __init__(self, db_path: str, lease_timeout: float = LEASE_TIMEOUT):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lease_timeout = lease_timeout
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, batch TEXT NOT NULL, "
+            "operation TEXT NOT NULL, args TEXT NOT NULL, kwargs TEXT NOT NULL, status TEXT NOT NULL, "
+            "worker TEXT, progress REAL NOT NULL DEFAULT 0, result TEXT, updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        job_id, batch, operation, args, kwargs, status, worker, progress, result, updated = row
+        return {"id": job_id, "batch": batch, "operation": operation, "args": json.loads(args),
+                "kwargs": json.loads(kwargs), "status": status, "worker": worker, "progress": progress,
+                "result": result, "updated": updated}
+
+    def submit(self, batch: str, jobs: list[dict]) -> list[int]:
+        """
+        :param jobs: list of {"operation", "args", "kwargs"}, run in this order
+        :return: ids of the jobs
+        """
+        now = time.time()
+        with self._lock:
+            ids = [self._conn.execute(
+                "INSERT INTO jobs (batch, operation, args, kwargs, status, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (batch, job["operation"], json.dumps(job.get("args", [])), json.dumps(job.get("kwargs", {})),
+                 QUEUED, now)).lastrowid for job in jobs]
+            self._conn.commit()
+        return ids
+
+    def claim(self, worker: str, operations: list[str]) -> dict | None:
+        """
+        give the oldest queued job of one of the operations to the worker
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, worker = NULL, progress = 0 "
+                               "WHERE status = ? AND updated < ?", (QUEUED, RUNNING, now - self.lease_timeout))
+            placeholders = ",".join("?" * len(operations))
+            row = self._conn.execute(f"SELECT id FROM jobs WHERE status = ? AND operation IN ({placeholders}) "
+                                     f"ORDER BY id LIMIT 1", (QUEUED, *operations)).fetchone()
+            if row is None:
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE jobs SET status = ?, worker = ?, updated = ? WHERE id = ?",
+                               (RUNNING, worker, now, row[0]))
+            self._conn.commit()
+        return self.get(row[0])
+
+    def progress(self, job_id: int, worker: str, progress: float) -> bool:
+        """
+        :return: False if the job isn't running on this worker anymore (lease expired)
+        """
+        with self._lock:
+            updated = self._conn.execute("UPDATE jobs SET progress = ?, updated = ? "
+                                         "WHERE id = ? AND worker = ? AND status = ?",
+                                         (progress, time.time(), job_id, worker, RUNNING)).rowcount
+            self._conn.commit()
+        return updated == 1
+
+    def finish(self, job_id: int, worker: str, result: str, status: str) -> bool:
+        """
+        :param status: DONE or FAILED
+        :return: False if the job isn't running on this worker anymore (lease expired)
+        """
+        with self._lock:
+            updated = self._conn.execute("UPDATE jobs SET status = ?, result = ?, progress = 1, updated = ? "
+                                         "WHERE id = ? AND worker = ? AND status = ?",
+                                         (status, result, time.time(), job_id, worker, RUNNING)).rowcount
+            self._conn.commit()
+        return updated == 1
+
+    def get(self, job_id: int) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else self._to_dict(row)
+
+    def batch(self, batch: str) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE batch = ? ORDER BY id", (batch,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP:
+        POST /batches/<batch>              {"jobs": [...]} -> {"ids": [...]}
+        GET  /batches/<batch>              -> {"jobs": [...]}
+        POST /claim                        {"worker", "operations"} -> {"job": job or null}
+        POST /jobs/<id>/progress           {"worker", "progress"} -> {"ok": bool}
+        POST /jobs/<id>/finish             {"worker", "result", "status"} -> {"ok": bool}
+        GET  /jobs/<id>                    -> job
+    """
+    server: "BrokerServer"
+
+    def log_message(self, format, *args) -> None:
+        logger.debug(format % args)
+
+    def _reply(self, code: int, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self) -> None:
+        parts = self.path.strip("/").split("/")
+        queue = self.server.queue
+        if len(parts) == 2 and parts[0] == "batches":
+            return self._reply(200, {"jobs": queue.batch(parts[1])})
+        if len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            job = queue.get(int(parts[1]))
+            return self._reply(200, job) if job is not None else self._reply(404, {"error": "unknown job"})
+        self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        parts = self.path.strip("/").split("/")
+        queue = self.server.queue
+        try:
+            body = self._read_body()
+            if len(parts) == 2 and parts[0] == "batches":
+                return self._reply(200, {"ids": queue.submit(parts[1], body["jobs"])})
+            if parts == ["claim"]:
+                return self._reply(200, {"job": queue.claim(body["worker"], body["operations"])})
+            if len(parts) == 3 and parts[0] == "jobs" and parts[1].isdigit():
+                if parts[2] == "progress":
+                    return self._reply(200, {"ok": queue.progress(int(parts[1]), body["worker"],
+                                                                  float(body["progress"]))})
+                if parts[2] == "finish":
+                    return self._reply(200, {"ok": queue.finish(int(parts[1]), body["worker"], body["result"],
+                                                                body["status"])})
+        except (ValueError, KeyError) as e:
+            return self._reply(400, {"error": f"bad request: {str(e)}"})
+        self._reply(404, {"error": f"unknown path {self.path}"})
+
+
+class BrokerServer(ThreadingHTTPServer):
+    """
+    Local job broker: the UI or the CLI submit batches, the workers of every machine pull the jobs.
+    Inputs and outputs are paths on a storage shared by every machine, mounted at the same place.
+    """
+    daemon_threads = True
+
+    def __init__(self, db_path: str, host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                 lease_timeout: float = LEASE_TIMEOUT):
+        self.queue = JobQueue(db_path, lease_timeout)
+        super().__init__((host, port), _Handler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.queue.close()
+
+
+class BrokerClient:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def _request(self, path: str, body: dict | None = None):
+        """
+        :raise OSError: if the broker can't be reached or refuses the request
+        """
+        data = None if body is None else json.dumps(body).encode()
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise OSError(f"broker error {e.code}: {e.read().decode(errors='replace')}") from e
+        except urllib.error.URLError as e:
+            raise OSError(f"broker {self.url} unreachable: {e.reason}") from e
+
+    def submit(self, jobs: list[dict], batch: str | None = None) -> tuple[str, list[int]]:
+        """
+        :param jobs: list of {"operation", "args", "kwargs"}
+        :return: (batch, ids of the jobs)
+        """
+        batch = batch or uuid.uuid4().hex
+        return batch, self._request(f"/batches/{batch}", {"jobs": jobs})["ids"]
+
+    def batch(self, batch: str) -> list[dict]:
+        return self._request(f"/batches/{batch}")["jobs"]
+
+    def claim(self, worker: str, operations: list[str]) -> dict | None:
+        return self._request("/claim", {"worker": worker, "operations": operations})["job"]
+
+    def progress(self, job_id: int, worker: str, progress: float) -> bool:
+        return self._request(f"/jobs/{job_id}/progress", {"worker": worker, "progress": progress})["ok"]
+
+    def finish(self, job_id: int, worker: str, result: str, status: str) -> bool:
+        return self._request(f"/jobs/{job_id}/finish", {"worker": worker, "result": result, "status": status})["ok"]
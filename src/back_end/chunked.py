@@ -0,0 +1,170 @@
+import bisect
+import contextvars
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+
+from back_end import runner
+from back_end.encoders import Encoder
+from back_end.media_info import probe, get_stream, get_keyframes
+from back_end.scheduler import ffmpeg_threads
+from toolbox.Parameters import Params
+from toolbox.ProgressBar import ProgressHub, ProgressEvent, read_progress_events
+from toolbox.utils import write_concat_list
+
+# software encoders don't scale well past a few threads: one segment per THREADS_PER_SEGMENT cores
+THREADS_PER_SEGMENT = 4
+# shorter videos are encoded in one process, splitting them isn't worth the stitching
+MIN_CHUNKED_DURATION = 300
+MIN_SEGMENT_DURATION = 30
+# a segment starts just before its keyframe: the frame before the keyframe is never encoded twice,
+# the keyframe is never dropped by a rounded timestamp
+SEEK_MARGIN = 0.001
+
+
+def plan_segments(keyframes: list[float], duration: float, count: int,
+                  min_duration: float = MIN_SEGMENT_DURATION) -> list[tuple[float, float]]:
+    """
+    Split a video in at most count segments of about the same duration, each one starting on a keyframe
+    :param keyframes: sorted keyframe times (see get_keyframes)
+    :param duration: duration of the video
+    :param count: number of segments wanted
+    :param min_duration: minimum duration of a segment
+    :return: list of (start, end) in seconds covering the whole video
+    """
+    count = min(count, int(duration // min_duration))
+    starts = [0.0]
+    for i in range(1, count):
+        target = duration * i / count
+        j = bisect.bisect_left(keyframes, target)
+        nearest = min(keyframes[max(0, j - 1):j + 1], key=lambda keyframe: abs(keyframe - target), default=None)
+        if nearest is not None and starts[-1] + min_duration <= nearest <= duration - min_duration:
+            starts.append(nearest)
+    return list(zip(starts, starts[1:] + [duration]))
+
+
+def _available_cores() -> int:
+    """
+    share of the cores given by the batch scheduler, every core outside of it
+    """
+    return ffmpeg_threads().get('threads') or os.cpu_count() or 1
+
+
+def chunked_segments(video_path: str, duration: float, encoder: Encoder) -> list[tuple[float, float]] | None:
+    """
+    :return: segments of a segment-parallel encoding of the video, None if it should be encoded in one process:
+        short video, hardware encoder, not enough cores, keyframes unknown, or disabled in the options
+    """
+    if not Params().get_chunked_encoding() or encoder.is_hardware or duration < MIN_CHUNKED_DURATION:
+        return None
+    count = _available_cores() // THREADS_PER_SEGMENT
+    if count < 2:
+        return None
+    try:
+        keyframes = get_keyframes(video_path)
+    except ffmpeg.Error:
+        return None
+    segments = plan_segments(keyframes, duration, count)
+    return segments if len(segments) > 1 else None
+
+
+class _SegmentsProgress:
+    """
+    progress of the segments of one video, reported as a single job
+    """
+
+    def __init__(self, name: str, duration: float, count: int):
+        self.hub = ProgressHub()
+        self.job = self.hub.start_job(name, duration)
+        self.events = [ProgressEvent() for _ in range(count)]
+        self._lock = threading.Lock()
+
+    def update(self, index: int, event: ProgressEvent) -> None:
+        with self._lock:
+            self.events[index] = event
+            total = ProgressEvent(out_time=sum(event.out_time for event in self.events),
+                                  fps=sum(event.fps for event in self.events),
+                                  speed=sum(event.speed for event in self.events))
+        self.hub.update(self.job, total)
+
+    def finish(self) -> None:
+        self.hub.finish_job(self.job)
+
+
+def encode_in_segments(video_path: str, output_path: str, duration: float, segments: list[tuple[float, float]],
+                       video_args: dict, audio_args: dict, input_args: dict | None = None,
+                       filters: list[tuple] = ()) -> None:
+    """
+    Encode the video stream of a video as segments in parallel ffmpeg processes with the same settings,
+    then stitch them without re-encoding with the concat demuxer.
+    The audio isn't split: it is encoded (or copied) in one pass while stitching, so it has no gap.
+    :param segments: list of (start, end) starting on keyframes, see chunked_segments
+    :param video_args: output arguments of the video stream (vcodec, bitrate, pix_fmt...)
+    :param audio_args: output arguments of the audio stream (acodec...)
+    :param input_args: input arguments of the segments (hwaccel...)
+    :param filters: video filters, (name, *args) applied in order
+    :raise ffmpeg.Error: if a segment or the stitching fails
+    """
+    # next to the output: the segments of a long video don't fit in every temp directory
+    segments_dir = tempfile.mkdtemp(prefix=".segments_", dir=os.path.dirname(os.path.abspath(output_path)))
+    threads = max(1, _available_cores() // len(segments))
+    progress = _SegmentsProgress(os.path.basename(video_path), duration, len(segments))
+    processes = []
+    processes_lock = threading.Lock()
+    failed = threading.Event()
+
+    def encode_segment(index: int, start: float, end: float) -> str:
+        # "__" in the name: the tool's outputs are skipped by the directory walks
+        segment_path = os.path.join(segments_dir, f"part__{index:04d}.mkv")
+        seek = max(0.0, start - SEEK_MARGIN) if index else 0.0
+        # the last segment runs to the end of the video
+        limit = {'t': end - SEEK_MARGIN - seek} if index < len(segments) - 1 else {}
+        stream = ffmpeg.input(video_path, ss=seek, **limit, **(input_args or {})).video
+        for name, *args in filters:
+            stream = stream.filter(name, *args)
+        output = (ffmpeg.output(stream, segment_path, an=None, threads=threads, progress='pipe:1', **video_args)
+                  .global_args('-nostats', '-loglevel', 'error')
+                  .overwrite_output())
+        with processes_lock:
+            if failed.is_set():
+                raise ffmpeg.Error('ffmpeg', b'', b'cancelled')
+            process = runner.run_async(output, pipe_stdout=True, pipe_stderr=True)
+            processes.append(process)
+        for event in read_progress_events(process.stdout):
+            progress.update(index, event)
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise ffmpeg.Error('ffmpeg', b'', stderr)
+        return segment_path
+
+    list_path = None
+    try:
+        with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, encode_segment, index, start, end)
+                       for index, (start, end) in enumerate(segments)]
+            try:
+                parts = [future.result() for future in futures]
+            except Exception:
+                # the other segments are useless now
+                with processes_lock:
+                    failed.set()
+                    for process in processes:
+                        if process.poll() is None:
+                            process.kill()
+                raise
+
+        list_path = write_concat_list([(part, None, None) for part in parts])
+        streams = [ffmpeg.input(list_path, format='concat', safe=0).video]
+        if get_stream(probe(video_path), 'audio') is not None:
+            streams.append(ffmpeg.input(video_path).audio)
+        output = ffmpeg.output(*streams, output_path, vcodec='copy', **audio_args, **ffmpeg_threads())
+        runner.run(output.overwrite_output(), quiet=True)
+    finally:
+        progress.finish()
+        if list_path is not None:
+            os.unlink(list_path)
+        shutil.rmtree(segments_dir, ignore_errors=True)
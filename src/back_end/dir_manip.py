@@ -1,137 +1,149 @@
 import os
 import random
-from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Iterator
 
+from back_end.audio_effects import apply_effects, parse_effects
 from back_end.audio_manip import audio_combine, audio_replace, is_audio
-from back_end.video_manip import video_compress, is_video
+from back_end.video_manip import video_compress, plan_compression, is_video
 from back_end.media_converter import convert_media
+from back_end.discovery import discover, mirror_path
+from back_end.scheduler import BatchScheduler, Job, audio_jobs
+from back_end.thumbnails import contact_sheet
 from toolbox.Parameters import Params
 
-params = Params()
 
+OUTPUT_DIR = "output"
+SHEETS_DIR = "contact_sheets"
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.webm')
 
-def dir_compress_videos(dir_path: str, bitrate: int = 8000, min_res: int = 1080, vcodec: str = "hevc_nvenc") -> str:
+
+def _discover(dir_path: str, file_filter, recursive: bool, include: list[str] | None,
+              exclude: list[str] | None) -> Iterator[str]:
+    return discover(dir_path, file_filter, include, exclude, max_depth=None if recursive else 0)
+
+
+def dir_compress_videos(dir_path: str, bitrate: int = 8000, min_res: int = 1080, vcodec: str = "hevc",
+                        recursive: bool = False, include: list[str] | None = None,
+                        exclude: list[str] | None = None, speed_tier: str | None = None,
+                        quality: int | None = None) -> str:
     """
-    compress all videos in a subdir output
+    compress all videos in a subdir output, the subdirectories are mirrored in output
     :param dir_path: chemin absolue du dossier
     :param bitrate: bitrate in kbps (default: 8000)
     :param min_res: minimum resolution
     :param vcodec: video codec
+    :param recursive: also compress the videos of the subdirectories
+    :param include: glob patterns of the files to compress
+    :param exclude: glob patterns of the files and directories to skip
+    :param speed_tier: fast, balanced or archive (default: Params)
+    :param quality: constant quality instead of the bitrate
     """
-    output_folder = os.path.join(dir_path, "output")
+    speed_tier = speed_tier or Params().get_speed_tier()
+    output_folder = os.path.join(dir_path, OUTPUT_DIR)
     os.makedirs(output_folder, exist_ok=True)
-    video_files = []
-    for fichier in os.listdir(dir_path):
-        video_path = os.path.join(dir_path, fichier)
-        if is_video(video_path):
-            video_files.append(video_path)
-
-    res = []
+    video_files = _discover(dir_path, is_video, recursive, include, [OUTPUT_DIR] + (exclude or []))
 
-    def process_file(file):
-        output_file = os.path.join(output_folder, os.path.basename(file))
-        res.append(video_compress(file, output_file, bitrate, min_res, vcodec))
+    jobs = (Job(video_compress, (file, mirror_path(file, dir_path, output_folder), bitrate, min_res, vcodec,
+                                 speed_tier, quality), path=file, operation="compress", describe=plan_compression)
+            for file in video_files)
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, video_files)
-
-    return '\n'.join(res)
+    return '\n'.join(BatchScheduler().run(jobs))
 
 
-def compress_videos_dossier_parent(parent_dir: str):
+def compress_videos_dossier_parent(parent_dir: str) -> str:
     """
-    use convertir_videos_dossier sur ses sous-dossiers
+    compresse les vidéos de tous les sous-dossiers, récursivement, chacun dans son dossier output
+    all the subdirectories feed the same batch
     :param parent_dir: chemin abs dossier parent
     """
-    try:
-        # Just subdir, no recursive
-        for child_dir in os.listdir(parent_dir):
-            child_dir_path = os.path.join(parent_dir, child_dir)
+    def jobs():
+        for file in discover(parent_dir, is_video, exclude=[OUTPUT_DIR], min_depth=1):
+            child_dir = os.path.join(parent_dir, os.path.relpath(file, parent_dir).split(os.sep)[0])
+            output = mirror_path(file, child_dir, os.path.join(child_dir, OUTPUT_DIR))
+            yield Job(video_compress, (file, output), path=file, operation="compress", describe=plan_compression)
 
-            if os.path.isdir(child_dir_path):
-                dir_compress_videos(child_dir_path)
+    try:
+        return '\n'.join(BatchScheduler().run(jobs()))
     except Exception as e:
         print(f"Error : {str(e)}")
+        return f"Error : {str(e)}"
 
 
-def dir_convert_media(videos_dir: str, ext: str) -> str:
+def dir_convert_media(videos_dir: str, ext: str, recursive: bool = False, include: list[str] | None = None,
+                      exclude: list[str] | None = None) -> str:
     """
     extrait les audios des vidéos
     :param videos_dir: dossier contenant les vidéos
     :param ext: file extension
     """
-    res = []
+    files = _discover(videos_dir, lambda file: file.lower().endswith(".mp4"), recursive, include, exclude)
 
-    def process_file(file):
-        path_mp4 = os.path.join(videos_dir, file)
-        res.append(convert_media(path_mp4, ext))
-
-    files = [file for file in os.listdir(videos_dir) if file.lower().endswith(".mp4")]
+    jobs = (Job(convert_media, (file, ext), path=file, operation="convert") for file in files)
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, files)
-
-    return '\n'.join(res)
+    return '\n'.join(BatchScheduler().run(jobs))
 
 
-def dir_audio_combine(videos_dir: str, audio_dir: str, randomize: bool) -> str:
+def dir_audio_combine(videos_dir: str, audio_dir: str, randomize: bool, recursive: bool = False) -> str:
     """
     combine les vidéos et leurs audios avec les audios d'un autre dossier
     :param videos_dir: dossier contenant les vidéos
     :param audio_dir: dossier contenant les audios à superposer
     """
-    res = []
     audio_list = [os.path.join(audio_dir, file) for file in os.listdir(audio_dir) if is_audio(file)]
-    n_audios = len(audio_list)
-    i = 0
-
-    def process_file(file):
-        nonlocal i
-        if randomize:
-            audio_to_combine = random.choice(audio_list)
-        else:
-            audio_to_combine = audio_list[i]
-            i = (i + 1) % n_audios
-        path_mp4 = os.path.join(videos_dir, file)
-        res.append(audio_combine(path_mp4, audio_to_combine))
+    files = _discover(videos_dir, is_video, recursive, None, None)
 
-    files = [file for file in os.listdir(videos_dir) if is_video(file)]
+    jobs = audio_jobs(audio_combine, "combine", files, audio_list, randomize)
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, files)
-
-    return '\n'.join(res)
+    return '\n'.join(BatchScheduler().run(jobs))
 
 
-def dir_audio_replace(videos_dir: str, audio_dir: str, randomize: bool) -> str:
+def dir_audio_replace(videos_dir: str, audio_dir: str, randomize: bool, recursive: bool = False) -> str:
     """
-    combine les vidéos et leurs audios avec les audios d'un autre dossier
-    replace audio with compression
+    remplace l'audio des vidéos par les audios d'un autre dossier
+    the video streams are copied, no re-encoding
     :param videos_dir: dossier contenant les vidéos
     :param audio_dir: dossier contenant les audios à superposer
     """
-    res = []
-    i = 0
     audio_list = [os.path.join(audio_dir, file) for file in os.listdir(audio_dir) if is_audio(file)]
-    n_audios = len(audio_list)
+    files = _discover(videos_dir, is_video, recursive, None, None)
 
-    def process_file(file):
-        nonlocal i
-        if randomize:
-            audio_to_combine = random.choice(audio_list)
-        else:
-            audio_to_combine = audio_list[i]
-            i = (i + 1) % n_audios
+    jobs = audio_jobs(audio_replace, "replace", files, audio_list, randomize)
 
-        path_mp4 = os.path.join(videos_dir, file)
-        res.append(audio_replace(path_mp4, audio_to_combine))
+    return '\n'.join(BatchScheduler().run(jobs))
 
-    files = [file for file in os.listdir(videos_dir) if is_video(file)]
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, files)
+def dir_contact_sheets(dir_path: str, columns: int = 4, rows: int = 4, recursive: bool = False) -> str:
+    """
+    contact sheet of every video in a subdir contact_sheets, the subdirectories are mirrored
+    :param dir_path: chemin absolue du dossier
+    :param columns: number of thumbnails per row
+    :param rows: number of rows
+    :param recursive: also the videos of the subdirectories
+    """
+    sheets_folder = os.path.join(dir_path, SHEETS_DIR)
+    video_files = _discover(dir_path, is_video, recursive, None, [SHEETS_DIR])
 
-    return '\n'.join(res)
+    jobs = (Job(contact_sheet, (file, os.path.splitext(mirror_path(file, dir_path, sheets_folder))[0] + ".jpg",
+                                columns, rows), path=file, operation="sheet") for file in video_files)
+
+    return '\n'.join(BatchScheduler().run(jobs))
+
+
+def dir_apply_effects(dir_path: str, effects: str, recursive: bool = False, include: list[str] | None = None,
+                      exclude: list[str] | None = None) -> str:
+    """
+    apply an effect chain to the audios and videos, in a subdir output, the subdirectories are mirrored
+    :param effects: chain of effects, see audio_effects.parse_effects
+    """
+    parse_effects(effects)
+    output_folder = os.path.join(dir_path, OUTPUT_DIR)
+    files = _discover(dir_path, lambda file: is_audio(file) or is_video(file), recursive, include,
+                      [OUTPUT_DIR] + (exclude or []))
+
+    jobs = (Job(apply_effects, (file, effects, mirror_path(file, dir_path, output_folder)), path=file,
+                operation="effects") for file in files)
+
+    return '\n'.join(BatchScheduler().run(jobs))
 
 
 def dir_audio_replace_no_thread(videos_dir, audio_dir) -> str:
@@ -175,15 +187,10 @@ def rename_files(input_dir: str):
             os.rename(old_path, new_path)
 
 
-def dir_convert_video_to_video(videos_dir: str, ext: str) -> str:
-    res = []
-    files = [os.path.join(videos_dir, file) for file in os.listdir(videos_dir) if
-             file.lower().endswith(('.mp4', '.avi', '.mkv', '.mov', '.webm'))]
-
-    def process_file(file):
-        res.append(convert_media(file, ext))
+def dir_convert_video_to_video(videos_dir: str, ext: str, recursive: bool = False, include: list[str] | None = None,
+                               exclude: list[str] | None = None) -> str:
+    files = _discover(videos_dir, lambda file: file.lower().endswith(VIDEO_EXTENSIONS), recursive, include, exclude)
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, files)
+    jobs = (Job(convert_media, (file, ext), path=file, operation="convert") for file in files)
 
-    return '\n'.join(res)
+    return '\n'.join(BatchScheduler().run(jobs))
@@ -0,0 +1,86 @@
+import fnmatch
+import os
+import re
+from collections.abc import Callable, Iterator
+
+# suffixes the operations add to the name of their outputs
+OUTPUT_SUFFIXES = re.compile(r"__(compressed|replace|combine|cut|cut_concat|concat|normalized|fx|reverb|"
+                             r"deep[\d.]+|up\d+|sheet|mix_sound)$")
+
+
+def is_output(path: str) -> bool:
+    """
+    :return: whether the file was written by the tool (a__compressed.mp4), other names containing "__" are inputs
+    """
+    return OUTPUT_SUFFIXES.search(os.path.splitext(os.path.basename(path))[0]) is not None
+
+
+def _matches(patterns: list[str], name: str, rel_path: str) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern) for pattern in patterns)
+
+
+def discover(root: str, file_filter: Callable[[str], bool] | None = None, include: list[str] | None = None,
+             exclude: list[str] | None = None, max_depth: int | None = None, min_depth: int = 0,
+             skip_outputs: bool = True) -> Iterator[str]:
+    """
+    Walk root with os.scandir and yield the matching files as soon as they are found,
+    so that the processing can start before the end of the walk
+    :param root: directory to walk
+    :param file_filter: function telling if a path is wanted (is_video, is_audio...), every file if None
+    :param include: glob patterns, on the name or the path relative to root; a file must match one of them
+    :param exclude: glob patterns, on the name or the path relative to root; matching files and directories
+        are skipped
+    :param max_depth: 0 for the files of root only, None for no limit
+    :param min_depth: files in shallower directories are skipped (1 for the subdirectories only)
+    :param skip_outputs: skip the files written by the tool, see is_output
+    """
+    exclude = exclude or []
+    # depth first, with an explicit stack: no recursion limit on deep trees
+    stack = [(root, 0)]
+    while stack:
+        directory, depth = stack.pop()
+        try:
+            # one directory is listed at once: outputs written next to their input while the files
+            # of the directory are processed are not discovered
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            rel_path = os.path.relpath(entry.path, root).replace(os.sep, "/")
+            if exclude and _matches(exclude, entry.name, rel_path):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if max_depth is None or depth < max_depth:
+                        subdirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if depth < min_depth or (skip_outputs and is_output(entry.name)):
+                continue
+            if include and not _matches(include, entry.name, rel_path):
+                continue
+            if file_filter is None or file_filter(entry.path):
+                yield entry.path
+        # reversed, so that the subdirectories are walked in the listing order
+        stack.extend((subdir, depth + 1) for subdir in reversed(subdirs))
+
+
+def mirror_path(path: str, src_root: str, dst_root: str) -> str:
+    """
+    path of the output of path in dst_root, same relative path as in src_root, parent directories created
+    """
+    output = os.path.join(dst_root, os.path.relpath(path, src_root))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    return output
+
+
+def parse_patterns(patterns: str) -> list[str]:
+    """
+    "*.mp4, clips/*" -> ["*.mp4", "clips/*"]
+    """
+    return [pattern.strip() for pattern in patterns.split(",") if pattern.strip()]
@@ -0,0 +1,248 @@
+import json
+import shutil
+import subprocess
+import threading
+from dataclasses import dataclass, field
+
+from back_end.media_info import file_key, get_table
+from toolbox.Singleton import SingletonMeta
+
+# candidates of each codec family, fastest first: (encoder, output options, decoding hwaccel)
+# an encoder can appear with several presets, older ffmpeg builds don't know the nvenc p1-p7 presets
+ENCODER_CANDIDATES = {
+    "hevc": [
+        ("hevc_nvenc", {"preset": "p4"}, "cuda"),
+        ("hevc_nvenc", {"preset": "fast"}, "cuda"),
+        ("hevc_qsv", {"preset": "veryfast"}, "qsv"),
+        ("hevc_videotoolbox", {}, "videotoolbox"),
+        ("hevc_amf", {"quality": "speed"}, None),
+        ("libx265", {"preset": "fast"}, None),
+    ],
+    "h264": [
+        ("h264_nvenc", {"preset": "p4"}, "cuda"),
+        ("h264_nvenc", {"preset": "fast"}, "cuda"),
+        ("h264_qsv", {"preset": "veryfast"}, "qsv"),
+        ("h264_videotoolbox", {}, "videotoolbox"),
+        ("h264_amf", {"quality": "speed"}, None),
+        ("libx264", {"preset": "veryfast"}, None),
+    ],
+    "vp9": [
+        ("vp9_qsv", {"preset": "veryfast"}, "qsv"),
+        ("libvpx-vp9", {"deadline": "good", "cpu-used": 4, "row-mt": 1}, None),
+    ],
+}
+# family of the encoders that can be requested by name
+ENCODER_FAMILIES = {name: family for family, candidates in ENCODER_CANDIDATES.items() for name, _, _ in candidates}
+# family used when no encoder of a family works, only between families the same containers accept
+FALLBACK_FAMILIES = {"hevc": "h264"}
+
+SPEED_TIERS = ["fast", "balanced", "archive"]
+# options of each speed tier: fast = maximum fps, archive = maximum compression
+TIER_OPTIONS = {
+    "libx264": {"fast": {"preset": "veryfast"}, "balanced": {"preset": "medium"}, "archive": {"preset": "slower"}},
+    "libx265": {"fast": {"preset": "veryfast"}, "balanced": {"preset": "medium"}, "archive": {"preset": "slow"}},
+    "libvpx-vp9": {"fast": {"deadline": "realtime", "cpu-used": 8, "row-mt": 1},
+                   "balanced": {"deadline": "good", "cpu-used": 4, "row-mt": 1},
+                   "archive": {"deadline": "good", "cpu-used": 1, "row-mt": 1}},
+    "nvenc": {"fast": {"preset": "p1"}, "balanced": {"preset": "p4"}, "archive": {"preset": "p7"}},
+    # ffmpeg builds older than the p1-p7 presets
+    "nvenc_legacy": {"fast": {"preset": "fast"}, "balanced": {"preset": "medium"}, "archive": {"preset": "slow"}},
+    "qsv": {"fast": {"preset": "veryfast"}, "balanced": {"preset": "medium"}, "archive": {"preset": "veryslow"}},
+    "amf": {"fast": {"quality": "speed"}, "balanced": {"quality": "balanced"}, "archive": {"quality": "quality"}},
+}
+
+# encoders running on a GPU or a media engine, the others run on the cores
+HARDWARE_SUFFIXES = ("_nvenc", "_qsv", "_videotoolbox", "_amf")
+
+TEST_TIMEOUT = 30
+
+
+@dataclass
+class Encoder:
+    name: str
+    family: str
+    options: dict = field(default_factory=dict)
+    hwaccel: str | None = None
+
+    @property
+    def is_hardware(self) -> bool:
+        return self.name.endswith(HARDWARE_SUFFIXES)
+
+    def input_args(self) -> dict:
+        """
+        arguments of ffmpeg.input decoding on the same hardware as the encoder
+        """
+        return {'hwaccel': self.hwaccel} if self.hwaccel else {}
+
+    def _tier_key(self) -> str:
+        if self.name.endswith("_nvenc"):
+            return "nvenc" if str(self.options.get("preset", "")).startswith("p") else "nvenc_legacy"
+        if self.name.endswith(("_qsv", "_amf")):
+            return self.name.rsplit("_", 1)[1]
+        return self.name
+
+    def output_args(self, tier: str | None = None) -> dict:
+        """
+        :param tier: speed tier (fast, balanced, archive), the detected options if None or unknown
+        """
+        options = TIER_OPTIONS.get(self._tier_key(), {}).get(tier, self.options)
+        return {'vcodec': self.name, **options}
+
+    def quality_args(self, quality: int) -> dict:
+        """
+        constant quality instead of a target bitrate
+        :param quality: CRF scale, 0 (lossless) to 51 (worst), 23 is the x264 default
+        """
+        key = self._tier_key()
+        if key in ("libx264", "libx265"):
+            return {'crf': quality}
+        if key == "libvpx-vp9":
+            # vp9 constant quality needs a zero bitrate, its scale goes up to 63
+            return {'crf': min(63, round(quality * 63 / 51)), 'b:v': 0}
+        if key.startswith("nvenc"):
+            return {'rc': 'vbr', 'cq': quality, 'b:v': 0}
+        if key == "qsv":
+            return {'global_quality': quality}
+        if key == "amf":
+            return {'rc': 'cqp', 'qp_i': quality, 'qp_p': quality}
+        if self.name.endswith("_videotoolbox"):
+            # 1-100 scale, higher is better
+            return {'q:v': max(1, 100 - 2 * quality)}
+        return {'q:v': quality}
+
+    def describe(self) -> str:
+        details = [f"{key} {value}" for key, value in self.options.items()]
+        if self.hwaccel:
+            details.append(f"hwaccel {self.hwaccel}")
+        return f"{self.name} ({', '.join(details)})" if details else self.name
+
+
+def _candidate_id(name: str, options: dict) -> str:
+    return json.dumps([name, options], sort_keys=True)
+
+
+def list_encoders(ffmpeg_path: str) -> list[str]:
+    """
+    :return: names of the encoders compiled in ffmpeg, from 'ffmpeg -encoders'
+    """
+    out = subprocess.run([ffmpeg_path, "-hide_banner", "-encoders"], capture_output=True, text=True).stdout
+    names = []
+    started = False
+    for line in out.splitlines():
+        if line.strip().startswith("------"):
+            started = True
+        elif started and len(line.split()) >= 2:
+            names.append(line.split()[1])
+    return names
+
+
+def list_hwaccels(ffmpeg_path: str) -> list[str]:
+    """
+    :return: hardware acceleration methods of ffmpeg, from 'ffmpeg -hwaccels'
+    """
+    out = subprocess.run([ffmpeg_path, "-hide_banner", "-hwaccels"], capture_output=True, text=True).stdout
+    lines = out.splitlines()
+    return [line.strip() for line in lines[1:] if line.strip()]
+
+
+def test_encode(ffmpeg_path: str, name: str, options: dict) -> bool:
+    """
+    encode a few black frames: an encoder can be compiled in ffmpeg without the hardware or driver it needs
+    """
+    cmd = [ffmpeg_path, "-hide_banner", "-v", "error", "-f", "lavfi", "-i", "color=c=black:s=256x256:r=25:d=0.2",
+           "-frames:v", "5", "-pix_fmt", "yuv420p", "-c:v", name]
+    for key, value in options.items():
+        cmd += [f"-{key}", str(value)]
+    cmd += ["-f", "null", "-"]
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=TEST_TIMEOUT).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+class EncoderRegistry(metaclass=SingletonMeta):
+    """
+    Encoders usable on this machine: those listed by 'ffmpeg -encoders' that pass a test encode.
+    Detected once per ffmpeg binary, the result is kept in the on-disk index.
+    """
+
+    def __init__(self):
+        self._capabilities = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _detect(ffmpeg_path: str) -> dict:
+        encoders = list_encoders(ffmpeg_path)
+        working = {}
+        for candidates in ENCODER_CANDIDATES.values():
+            for name, options, _ in candidates:
+                candidate = _candidate_id(name, options)
+                if candidate not in working:
+                    working[candidate] = name in encoders and test_encode(ffmpeg_path, name, options)
+        return {"encoders": encoders, "hwaccels": list_hwaccels(ffmpeg_path), "working": working}
+
+    def capabilities(self, refresh: bool = False) -> dict:
+        """
+        :param refresh: detect again, after a driver or hardware change
+        :return: {"encoders": [...], "hwaccels": [...], "working": {candidate: bool}}
+        """
+        with self._lock:
+            if self._capabilities is not None and not refresh:
+                return self._capabilities
+            ffmpeg_path = shutil.which("ffmpeg")
+            if ffmpeg_path is None:
+                self._capabilities = {"encoders": [], "hwaccels": [], "working": {}}
+                return self._capabilities
+            key = repr(file_key(ffmpeg_path))
+            cached = None if refresh else get_table("encoders").get(key)
+            if cached is None:
+                cached = self._detect(ffmpeg_path)
+                get_table("encoders").set(key, cached)
+            self._capabilities = cached
+            return self._capabilities
+
+    def resolve(self, vcodec: str) -> Encoder:
+        """
+        :param vcodec: codec family (hevc, h264, vp9) or encoder name (hevc_nvenc, libx264...)
+        :return: the requested encoder if it works, the fastest working encoder of its family otherwise,
+            then of its fallback family; an encoder unknown to the registry is returned as is.
+            The decoding hwaccel is dropped if ffmpeg doesn't list it.
+        :raise Exception: if no encoder of the family nor of its fallback family works
+        """
+        family = vcodec if vcodec in ENCODER_CANDIDATES else ENCODER_FAMILIES.get(vcodec)
+        if family is None:
+            return Encoder(vcodec, vcodec)
+        capabilities = self.capabilities()
+        working = capabilities["working"]
+        candidates = ENCODER_CANDIDATES[family]
+        requested = [candidate for candidate in candidates if candidate[0] == vcodec]
+        for name, options, hwaccel in requested + candidates:
+            if working.get(_candidate_id(name, options)):
+                if hwaccel not in capabilities["hwaccels"]:
+                    hwaccel = None
+                return Encoder(name, family, dict(options), hwaccel)
+        if not any(working.values()):
+            # nothing detected (no ffmpeg in the PATH?): the software encoder, ffmpeg will tell what is wrong
+            name, options, _ = candidates[-1]
+            return Encoder(name, family, dict(options))
+        if family in FALLBACK_FAMILIES:
+            return self.resolve(FALLBACK_FAMILIES[family])
+        raise Exception(f"No working {family} encoder, tested: {', '.join(dict.fromkeys(c[0] for c in candidates))}")
+
+    def summary(self) -> str:
+        """
+        encoder chosen for each family, for the Options tab
+        """
+        capabilities = self.capabilities()
+        lines = []
+        for family in ENCODER_CANDIDATES:
+            try:
+                lines.append(f"{family}: {self.resolve(family).describe()}")
+            except Exception as e:
+                lines.append(f"{family}: {e}")
+        lines.append(f"hwaccels: {', '.join(capabilities['hwaccels']) or 'none'}")
+        return '\n'.join(lines)
+
+
+def resolve_encoder(vcodec: str) -> Encoder:
+    return EncoderRegistry().resolve(vcodec)
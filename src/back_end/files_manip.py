@@ -1,97 +1,74 @@
-import random
-from concurrent.futures import ThreadPoolExecutor
-
+from back_end.audio_effects import apply_effects, parse_effects
 from back_end.audio_manip import audio_combine, audio_replace
-from back_end.video_manip import video_compress
+from back_end.video_manip import video_compress, plan_compression
 from back_end.media_converter import convert_media
+from back_end.scheduler import BatchScheduler, Job, audio_jobs
+from back_end.thumbnails import contact_sheet
 
 from toolbox.Parameters import Params
 
-params = Params()
 
-def files_compress_videos(files: list[str], bitrate, min_res, vcodec) -> str:
+def files_compress_videos(files: list[str], bitrate, min_res, vcodec, speed_tier: str | None = None,
+                          quality: int | None = None) -> str:
     """
     compress all videos in a subdir output
     """
-    res = []
-
-    def process_file(file):
-        res.append(video_compress(file, target_bitrate=bitrate, min_resolution=min_res, vcodec=vcodec))
+    speed_tier = speed_tier or Params().get_speed_tier()
+    jobs = [Job(video_compress, (file,), {'target_bitrate': bitrate, 'min_resolution': min_res, 'vcodec': vcodec,
+                                          'speed_tier': speed_tier, 'quality': quality},
+                path=file, operation="compress", describe=plan_compression) for file in files]
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, files)
-
-    return '\n'.join(res)
+    return '\n'.join(BatchScheduler().run(jobs))
 
 
 def files_convert(files: list[str], ext: str) -> str:
     """
     Convert media files (video or audio) to another format
     """
-    res = []
-
-    def process_file(file):
-        res.append(convert_media(file, ext))
+    jobs = [Job(convert_media, (file, ext), path=file, operation="convert") for file in files]
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, files)
-
-    return '\n'.join(res)
+    return '\n'.join(BatchScheduler().run(jobs))
 
 
 def files_audio_combine(videos: list[str], audios: list[str], randomize: bool) -> str:
     """
     combine les vidéos et leurs audios avec les audios d'un autre dossier
     """
-    res = []
-    n_audios = len(audios)
-    i = 0
-
-    def process_file(file):
-        nonlocal i
-        if randomize:
-            audio_to_combine = random.choice(audios)
-        else:
-            audio_to_combine = audios[i]
-            i = (i + 1) % len(audios)
-        res.append(audio_combine(file, audio_to_combine))
+    jobs = list(audio_jobs(audio_combine, "combine", videos, audios, randomize))
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, videos)
-
-    return '\n'.join(res)
+    return '\n'.join(BatchScheduler().run(jobs))
 
 
 def files_audio_replace(videos: list[str], audios: list[str], randomize: bool) -> str:
     """
-    replace audios of files with compression
+    replace audios of files, the video streams are copied
     """
-    res = []
-    n_audios = len(audios)
-    i = 0
+    jobs = list(audio_jobs(audio_replace, "replace", videos, audios, randomize))
 
-    def process_file(file):
-        nonlocal i
-        if randomize:
-            audio_to_combine = random.choice(audios)
-        else:
-            audio_to_combine = audios[i]
-            i = (i + 1) % n_audios
-        res.append(audio_replace(file, audio_to_combine))
+    return '\n'.join(BatchScheduler().run(jobs))
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, videos)
 
-    return '\n'.join(res)
+def files_convert_video_to_video(videos: list[str], ext: str) -> str:
+    jobs = [Job(convert_media, (file, ext), path=file, operation="convert") for file in videos]
 
+    return '\n'.join(BatchScheduler().run(jobs))
 
-def files_convert_video_to_video(videos: list[str], ext: str) -> str:
-    res = []
 
-    def process_file(file):
-        res.append(convert_media(file, ext))
+def files_contact_sheets(videos: list[str], columns: int = 4, rows: int = 4) -> str:
+    """
+    contact sheet of each video, next to it
+    """
+    jobs = [Job(contact_sheet, (file, "", columns, rows), path=file, operation="sheet") for file in videos]
+
+    return '\n'.join(BatchScheduler().run(jobs))
 
-    with ThreadPoolExecutor(max_workers=params.get_max_workers()) as executor:
-        executor.map(process_file, videos)
 
-    return '\n'.join(res)
+def files_apply_effects(files: list[str], effects: str) -> str:
+    """
+    apply an effect chain to each file, the output is next to it
+    :param effects: chain of effects, see audio_effects.parse_effects
+    """
+    parse_effects(effects)
+    jobs = [Job(apply_effects, (file, effects), path=file, operation="effects") for file in files]
+
+    return '\n'.join(BatchScheduler().run(jobs))
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import ffmpeg
+
+from back_end.media_info import file_key, probe
+from toolbox.Parameters import Params
+from toolbox.PersistentCache import PersistentCache
+from toolbox.Singleton import SingletonMeta
+
+params = Params()
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"  # nothing to do, the input already is the result
+
+
+class JobJournal(metaclass=SingletonMeta):
+    """
+    Persistent record of batch jobs: for each (input identity, operation, parameters),
+    whether the job is running, done or failed, and where its output went.
+    """
+
+    def __init__(self):
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def _get_cache(self) -> PersistentCache:
+        with self._lock:
+            if self._cache is None:
+                self._cache = PersistentCache(os.path.join(params.get_cache_dir(), "journal.sqlite"), "journal")
+            return self._cache
+
+    def close(self) -> None:
+        with self._lock:
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
+
+    @staticmethod
+    def job_key(path: str, operation: str, job_params, inputs: tuple[str, ...] = ()) -> str | None:
+        """
+        :param path: input file of the job
+        :param operation: name of the operation
+        :param job_params: parameters of the operation, must be JSON serializable (str used otherwise)
+        :param inputs: other input files of the job (audio of a replace), keyed by their identity
+        :return: key of the job, None if an input doesn't exist
+        """
+        try:
+            identity = [file_key(path)] + [file_key(other) for other in inputs]
+        except OSError:
+            return None
+        payload = json.dumps([identity, operation, job_params], default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    @staticmethod
+    def _assignment_key(path: str, operation: str) -> str | None:
+        try:
+            identity = file_key(path)
+        except OSError:
+            return None
+        return "audio:" + hashlib.sha1(json.dumps([identity, operation]).encode()).hexdigest()
+
+    def assigned_audio(self, path: str, operation: str) -> str | None:
+        """
+        :return: audio given to the video by a previous run of the operation, None if there is none
+        """
+        key = self._assignment_key(path, operation)
+        entry = self.get(key) if key is not None else None
+        return entry["audio"] if entry is not None else None
+
+    def assign_audio(self, path: str, operation: str, audio: str) -> None:
+        """
+        record the audio given to the video, a resumed batch gives it the same one
+        """
+        key = self._assignment_key(path, operation)
+        if key is not None:
+            self._get_cache().set(key, {"audio": audio})
+
+    def get(self, key: str) -> dict | None:
+        return self._get_cache().get(key)
+
+    def start(self, key: str, path: str, operation: str) -> None:
+        self._get_cache().set(key, {"status": RUNNING, "input": path, "operation": operation,
+                                    "started": time.time()})
+
+    def finish(self, key: str, path: str, operation: str, output: str) -> None:
+        st = os.stat(output)
+        self._get_cache().set(key, {"status": DONE, "input": path, "operation": operation, "output": output,
+                                    "size": st.st_size, "mtime_ns": st.st_mtime_ns, "finished": time.time()})
+
+    def fail(self, key: str, path: str, operation: str, error: str) -> None:
+        self._get_cache().set(key, {"status": FAILED, "input": path, "operation": operation, "error": error,
+                                    "finished": time.time()})
+
+    def skip(self, key: str, path: str, operation: str, note: str) -> None:
+        self._get_cache().set(key, {"status": SKIPPED, "input": path, "operation": operation, "note": note,
+                                    "finished": time.time()})
+
+    def completed_output(self, key: str) -> str | None:
+        """
+        :return: output of the job if it is done and the output is still valid
+        (same size and modification time, readable by ffprobe), None otherwise
+        """
+        entry = self.get(key)
+        if entry is None or entry["status"] != DONE:
+            return None
+        output = entry["output"]
+        try:
+            st = os.stat(output)
+        except OSError:
+            return None
+        if st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+            return None
+        try:
+            probe(output)
+        except (ffmpeg.Error, OSError):
+            return None
+        return output
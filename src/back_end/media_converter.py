@@ -1,6 +1,11 @@
 import os
 import ffmpeg
 
+from back_end import runner
+from back_end.chunked import chunked_segments, encode_in_segments
+from back_end.encoders import resolve_encoder
+from back_end.media_info import probe
+from back_end.scheduler import ffmpeg_threads
 from toolbox.ProgressBar import progress_bar
 
 def get_media_duration(path: str) -> float | str:
@@ -9,8 +14,8 @@ def get_media_duration(path: str) -> float | str:
     :return: audio duration
     """
     try:
-        probe = ffmpeg.probe(path)
-        duration = float(probe['format']['duration'])
+        info = probe(path)
+        duration = float(info['format']['duration'])
         return duration
     except ffmpeg.Error as e:
         return f"ffmpeg error: {e.stderr}"
@@ -41,21 +46,16 @@ def convert_media(input_path: str, ext: str) -> str:
     output_path = os.path.splitext(input_path)[0] + "." + ext
 
     try:
-        # Create input
-        input_stream = ffmpeg.input(input_path)
-
         # Set codec options based on output format
         output_args = {}
-
-        # Default video codec based on format
-        if ext in ['mp4', 'mkv', 'mov']:
-            # Try hardware acceleration first, fall back to software
-            try:
-                output_args['vcodec'] = 'hevc_nvenc'  # NVIDIA GPU acceleration
-            except:
-                output_args['vcodec'] = 'libx265'  # Software fallback
-        elif ext == 'webm':
-            output_args['vcodec'] = 'libvpx-vp9'  # VP9 for WebM
+        input_args = {}
+        encoder = None
+
+        # Default video codec based on format, fastest working encoder of the family
+        if ext in ['mp4', 'mkv', 'mov', 'webm']:
+            encoder = resolve_encoder('vp9' if ext == 'webm' else 'hevc')
+            output_args.update(encoder.output_args())
+            input_args.update(encoder.input_args())
         elif ext == 'ogg':
             output_args['vcodec'] = 'libtheora'  # Theora for Ogg
         elif ext == 'avi':
@@ -72,6 +72,20 @@ def convert_media(input_path: str, ext: str) -> str:
         # Common settings
         output_args['pix_fmt'] = 'yuv420p'  # Standard pixel format
 
+        # Long video and idle cores: video segments encoded in parallel, the audio in one pass
+        segments = chunked_segments(input_path, duration, encoder) if encoder is not None else None
+        if segments:
+            audio_args = {'acodec': output_args.pop('acodec')}
+            encode_in_segments(input_path, output_path, duration, segments, output_args, audio_args, input_args)
+            print(f"\nConversion completed successfully ({len(segments)} segments)")
+            return output_path
+
+        # Create input
+        input_stream = ffmpeg.input(input_path, **input_args)
+
+        # Share of the cores given by the batch scheduler
+        output_args.update(ffmpeg_threads())
+
         # Add progress monitoring
         output_args['stats'] = None
         output_args['progress'] = 'pipe:1'
@@ -80,8 +94,8 @@ def convert_media(input_path: str, ext: str) -> str:
         output = ffmpeg.output(input_stream, output_path, **output_args)
         output = ffmpeg.overwrite_output(output)
 
-        process = ffmpeg.run_async(output, pipe_stdout=True)
-        progress_bar(duration, process)
+        process = runner.run_async(output, pipe_stdout=True)
+        progress_bar(duration, process, os.path.basename(input_path))
         return_code = process.wait()
 
         if return_code == 0:
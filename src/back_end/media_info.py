@@ -0,0 +1,187 @@
+import copy
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import ffmpeg
+
+from back_end import runner
+from toolbox.Parameters import Params
+from toolbox.PersistentCache import PersistentCache
+
+params = Params()
+
+LRU_SIZE = 1024
+# bytes read at once to hash the content of a file
+CONTENT_CHUNK_SIZE = 1024 * 1024
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_table(table: str) -> PersistentCache:
+    """
+    table of the on-disk index shared by the metadata caches, stored in the cache directory
+    """
+    with _tables_lock:
+        if table not in _tables:
+            _tables[table] = PersistentCache(os.path.join(params.get_cache_dir(), "media_index.sqlite"), table)
+        return _tables[table]
+
+
+def get_index() -> PersistentCache:
+    return get_table("probe")
+
+
+def close_index() -> None:
+    with _tables_lock:
+        for table in _tables.values():
+            table.close()
+        _tables.clear()
+
+
+def file_key(path: str) -> tuple[str, int, int]:
+    """
+    identity of a file on disk, changes as soon as the file is modified
+    :param path: path to the file
+    :return: (absolute path, size, modification time in ns)
+    """
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+def content_key(path: str) -> str:
+    """
+    identity of the content of a file, the same for copies of a file in different places
+    the file is read once: the hash is kept in the on-disk index, keyed by (path, size, mtime)
+    :param path: path to the file
+    :return: sha1 of the whole content
+    """
+    hashes = get_table("content")
+    key = repr(file_key(path))
+    digest = hashes.get(key)
+    if digest is None:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            while chunk := f.read(CONTENT_CHUNK_SIZE):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        hashes.set(key, digest)
+    return digest
+
+
+def probe(path: str) -> dict:
+    """
+    Same result as ffmpeg.probe(path), but each file is probed only once:
+    results are kept in an in-memory LRU and in the on-disk index, keyed by (path, size, mtime)
+
+    :param path: path to the media file
+    :return: ffprobe output (format and streams), a copy the caller may modify
+    :raise ffmpeg.Error: if ffprobe fails
+    """
+    try:
+        key = file_key(path)
+    except OSError:
+        # let ffprobe report the error
+        return ffmpeg.probe(path)
+
+    with _lru_lock:
+        if key in _lru:
+            _lru.move_to_end(key)
+            return copy.deepcopy(_lru[key])
+
+    abs_path, size, mtime_ns = key
+    index = get_index()
+    entry = index.get(abs_path)
+    if entry is not None and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+        info = entry["probe"]
+    else:
+        info = ffmpeg.probe(path)
+        index.set(abs_path, {"size": size, "mtime_ns": mtime_ns, "probe": info})
+
+    with _lru_lock:
+        _lru[key] = info
+        _lru.move_to_end(key)
+        while len(_lru) > LRU_SIZE:
+            _lru.popitem(last=False)
+    return copy.deepcopy(info)
+
+
+def get_keyframe_index(path: str) -> list[tuple[float, float]]:
+    """
+    Timestamps of the keyframes of the first video stream, read from the packet flags (nothing is decoded).
+    Cached in the on-disk index like probe.
+
+    :param path: path to the video file
+    :return: (pts, dts) of the keyframes in seconds, sorted by pts
+    :raise ffmpeg.Error: if ffprobe fails
+    """
+    abs_path, size, mtime_ns = file_key(path)
+    cache = get_table("keyframes")
+    entry = cache.get(abs_path)
+    if entry is not None and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+        return [tuple(keyframe) for keyframe in entry["keyframes"]]
+
+    args = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,dts_time,flags', '-of', 'csv=p=0', path]
+    stdout, _ = runner.run(args, capture_stdout=True, capture_stderr=True)
+
+    keyframes = []
+    for line in stdout.decode('utf-8', errors='replace').splitlines():
+        fields = line.split(',')
+        if len(fields) < 3 or 'K' not in fields[2] or fields[0] in ('', 'N/A'):
+            continue
+        pts_time = float(fields[0])
+        dts_time = float(fields[1]) if fields[1] not in ('', 'N/A') else pts_time
+        keyframes.append((pts_time, dts_time))
+    keyframes.sort()
+
+    cache.set(abs_path, {"size": size, "mtime_ns": mtime_ns, "keyframes": keyframes})
+    return keyframes
+
+
+def get_packet_times(path: str, start: float, end: float) -> list[float]:
+    """
+    Timestamps of the packets of the first video stream between start and end, read from the packets
+    (nothing is decoded), whatever the frame rate of the stream
+
+    :return: sorted pts in seconds, start included, end excluded
+    :raise ffmpeg.Error: if ffprobe fails
+    """
+    args = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', f"{start}%{end}",
+            '-show_entries', 'packet=pts_time', '-of', 'csv=p=0', path]
+    stdout, _ = runner.run(args, capture_stdout=True, capture_stderr=True)
+    times = []
+    for line in stdout.decode('utf-8', errors='replace').splitlines():
+        value = line.strip().rstrip(',')
+        if value in ('', 'N/A'):
+            continue
+        if start <= float(value) < end:
+            times.append(float(value))
+    return sorted(times)
+
+
+def get_keyframes(path: str) -> list[float]:
+    """
+    :param path: path to the video file
+    :return: sorted keyframe times in seconds
+    :raise ffmpeg.Error: if ffprobe fails
+    """
+    return [pts for pts, _ in get_keyframe_index(path)]
+
+
+def get_stream(info: dict, codec_type: str) -> dict | None:
+    """
+    :param info: result of probe
+    :param codec_type: 'video' or 'audio'
+    :return: first stream of this type, None if there is none
+    """
+    return next((stream for stream in info.get('streams', []) if stream.get('codec_type') == codec_type), None)
+
+
+def clear_memory_cache() -> None:
+    with _lru_lock:
+        _lru.clear()
@@ -0,0 +1,236 @@
+import contextvars
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import ffmpeg
+import numpy as np
+from scipy import signal
+
+from back_end import runner
+from back_end.media_info import probe, get_stream
+from toolbox.Parameters import Params
+
+# ffmpeg resamples to the rate of the ITU-R BS.1770 filter coefficients
+ANALYSIS_RATE = 48000
+SUB_BLOCK = ANALYSIS_RATE // 10  # 100 ms
+# frames read at once, a whole number of sub-blocks: the memory of a file doesn't depend on its length
+CHUNK_FRAMES = ANALYSIS_RATE
+
+# K-weighting at 48 kHz: high shelf then RLB high-pass (ITU-R BS.1770-4)
+K_WEIGHTING = np.array([
+    [1.53512485958697, -2.69169618940638, 1.19839281085285, 1.0, -1.69065929318241, 0.73248077421585],
+    [1.0, -2.0, 1.0, 1.0, -1.99004745483398, 0.99007225036621],
+])
+# channel weights of the loudness sum, other layouts are downmixed to stereo
+CHANNEL_WEIGHTS = {
+    1: np.array([1.0]),
+    2: np.array([1.0, 1.0]),
+    6: np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41]),  # 5.1: L R C LFE Ls Rs
+}
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+LRA_RELATIVE_GATE = -20.0
+# true peak: 4x oversampling
+OVERSAMPLING = 4
+TRUE_PEAK_TAPS = 48
+SILENCE_THRESHOLD = -50.0  # dBFS
+MIN_SILENCE = 0.5  # seconds
+
+
+@dataclass
+class Analysis:
+    integrated: float  # LUFS
+    loudness_range: float  # LU
+    threshold: float  # relative gate of the integrated loudness, LUFS
+    true_peak: float  # dBTP
+    rms: float  # dBFS
+    duration: float  # seconds
+    silences: list[tuple[float, float]] = field(default_factory=list)  # (start, end) in seconds
+
+
+def _to_db(power, offset: float = 0.0):
+    with np.errstate(divide='ignore'):
+        return offset + 10 * np.log10(power)
+
+
+def _loudness(power):
+    return _to_db(power, -0.691)
+
+
+def integrated_loudness(powers: np.ndarray) -> tuple[float, float]:
+    """
+    gated loudness of 400 ms blocks overlapping by 75 %
+    :param powers: K-weighted mean square of each 100 ms sub-block, summed over the channels
+    :return: (integrated loudness, relative gate)
+    """
+    if len(powers) == 0:
+        return -math.inf, -math.inf
+    if len(powers) >= 4:
+        blocks = np.convolve(powers, np.full(4, 0.25), mode='valid')
+    else:
+        # shorter than one block
+        blocks = np.array([powers.mean()])
+    gated = blocks[_loudness(blocks) > ABSOLUTE_GATE]
+    if len(gated) == 0:
+        return -math.inf, -math.inf
+    threshold = float(_loudness(gated.mean())) + RELATIVE_GATE
+    gated = gated[_loudness(gated) > threshold]
+    return float(_loudness(gated.mean())), threshold
+
+
+def loudness_range(powers: np.ndarray) -> float:
+    """
+    spread (10th to 95th percentile) of the gated short-term (3 s) loudness, EBU Tech 3342
+    """
+    if len(powers) < 30:
+        return 0.0
+    short_term = _loudness(np.convolve(powers, np.full(30, 1 / 30), mode='valid'))
+    short_term = short_term[short_term > ABSOLUTE_GATE]
+    if len(short_term) == 0:
+        return 0.0
+    threshold = float(_loudness(np.mean(10 ** ((short_term + 0.691) / 10)))) + LRA_RELATIVE_GATE
+    short_term = short_term[short_term > threshold]
+    low, high = np.percentile(short_term, [10, 95])
+    return float(high - low)
+
+
+def silence_regions(levels: np.ndarray, threshold: float = SILENCE_THRESHOLD,
+                    min_duration: float = MIN_SILENCE) -> list[tuple[float, float]]:
+    """
+    :param levels: level of each 100 ms sub-block, dBFS
+    :return: (start, end) in seconds of the runs of sub-blocks under the threshold
+    """
+    silent = np.concatenate(([False], levels < threshold, [False]))
+    edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+    starts, ends = edges[::2], edges[1::2]
+    step = SUB_BLOCK / ANALYSIS_RATE
+    return [(round(float(start) * step, 3), round(float(end) * step, 3))
+            for start, end in zip(starts, ends) if (end - start) * step >= min_duration]
+
+
+class _Accumulator:
+    """
+    state of the analysis of one stream, fed chunk by chunk
+    """
+
+    def __init__(self, channels: int):
+        self.weights = CHANNEL_WEIGHTS[channels]
+        self.zi = np.zeros((len(K_WEIGHTING), 2, channels))
+        self.fir = signal.firwin(TRUE_PEAK_TAPS, 1 / OVERSAMPLING) * OVERSAMPLING
+        self.history = np.zeros((TRUE_PEAK_TAPS // OVERSAMPLING, channels))
+        self.powers = []
+        self.levels = []
+        self.square_sum = 0.0
+        self.frames = 0
+        self.peak = 0.0
+
+    def add(self, chunk: np.ndarray) -> None:
+        """
+        :param chunk: frames x channels
+        """
+        self.frames += len(chunk)
+        self.square_sum += float(np.einsum('ij,ij->', chunk, chunk, dtype=np.float64))
+
+        weighted, self.zi = signal.sosfilt(K_WEIGHTING, chunk, axis=0, zi=self.zi)
+        blocks = len(chunk) // SUB_BLOCK
+        if blocks:
+            shape = (blocks, SUB_BLOCK, chunk.shape[1])
+            mean_squares = np.mean(weighted[:blocks * SUB_BLOCK].reshape(shape) ** 2, axis=1)
+            self.powers.append(mean_squares @ self.weights)
+            raw = np.mean(chunk[:blocks * SUB_BLOCK].reshape(shape).astype(np.float64) ** 2, axis=(1, 2))
+            self.levels.append(_to_db(raw))
+
+        # the previous frames complete the filter window at the start of the chunk
+        padded = np.concatenate((self.history, chunk))
+        upsampled = signal.upfirdn(self.fir, padded, up=OVERSAMPLING, axis=0)
+        start = len(self.history) * OVERSAMPLING
+        self.peak = max(self.peak, float(np.abs(upsampled[start:len(padded) * OVERSAMPLING]).max(initial=0)),
+                        float(np.abs(chunk).max(initial=0)))
+        self.history = padded[-len(self.history):]
+
+    def result(self) -> Analysis:
+        powers = np.concatenate(self.powers) if self.powers else np.zeros(0)
+        levels = np.concatenate(self.levels) if self.levels else np.zeros(0)
+        integrated, threshold = integrated_loudness(powers)
+        mean_square = self.square_sum / (self.frames * len(self.weights)) if self.frames else 0.0
+        return Analysis(
+            integrated=integrated,
+            loudness_range=loudness_range(powers),
+            threshold=threshold,
+            true_peak=float(_to_db(self.peak ** 2)),
+            rms=float(_to_db(mean_square)),
+            duration=self.frames / ANALYSIS_RATE,
+            silences=silence_regions(levels),
+        )
+
+
+def _channels(path: str) -> int:
+    try:
+        audio_stream = get_stream(probe(path), 'audio')
+    except (ffmpeg.Error, OSError):
+        return 2
+    channels = int(audio_stream.get('channels') or 2) if audio_stream else 2
+    return channels if channels in CHANNEL_WEIGHTS else 2
+
+
+def read_into(stream, buffer: np.ndarray) -> int:
+    """
+    fill the buffer from the pipe
+    :return: number of values read, less than the buffer size at the end of the stream
+    """
+    view = memoryview(buffer).cast('B')
+    filled = 0
+    while filled < len(view):
+        n = stream.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled // buffer.itemsize
+
+
+def analyze(path: str) -> Analysis:
+    """
+    Loudness (EBU R128 integrated, range), true peak, RMS and silences of the audio of a file,
+    computed in one read of a raw PCM pipe from ffmpeg, by chunks of CHUNK_FRAMES frames
+    :raise ffmpeg.Error: if ffmpeg can't decode the file
+    """
+    channels = _channels(path)
+    args = ['ffmpeg', '-nostdin', '-hide_banner', '-nostats', '-loglevel', 'error', '-i', path, '-vn',
+            '-ac', str(channels), '-ar', str(ANALYSIS_RATE), '-f', 'f32le', '-acodec', 'pcm_f32le', '-']
+    accumulator = _Accumulator(channels)
+    buffer = np.empty((CHUNK_FRAMES, channels), dtype=np.float32)
+    process = runner.run_async(args, pipe_stdout=True, pipe_stderr=True)
+    try:
+        while (values := read_into(process.stdout, buffer)) > 0:
+            accumulator.add(buffer[:values // channels])
+    except Exception:
+        process.kill()
+        process.wait()
+        raise
+    err = process.stderr.read()
+    if process.wait() != 0:
+        scope = runner.current_scope()
+        if scope is not None and scope.cancelled:
+            raise runner.JobCancelled()
+        raise ffmpeg.Error('ffmpeg', None, err)
+    return accumulator.result()
+
+
+def analyze_many(paths: list[str], max_workers: int | None = None) -> dict[str, Analysis | str]:
+    """
+    Analyse several files at once, each one holds a single chunk buffer: memory is bounded by max_workers
+    :param max_workers: files analysed at once, default: max workers of the options
+    :return: analysis of each path, or the error message
+    """
+    def safe_analyze(path: str) -> Analysis | str:
+        try:
+            return analyze(path)
+        except ffmpeg.Error as e:
+            return f"ffmpeg error: {e.stderr.decode(errors='replace') if e.stderr else e}"
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    with ThreadPoolExecutor(max_workers=max_workers or Params().get_max_workers()) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, safe_analyze, path) for path in paths]
+        return {path: future.result() for path, future in zip(paths, futures)}
@@ -0,0 +1,242 @@
+import math
+
+import ffmpeg
+import numpy as np
+
+from back_end import runner
+from back_end.pcm_analysis import read_into
+
+MIX_RATE = 48000
+MIX_CHANNELS = 2
+# frames mixed at once: the memory of the mix doesn't depend on the length of the video
+CHUNK_FRAMES = MIX_RATE
+# a music shorter than this is decoded once and looped in memory (12 MB at most),
+# a longer one is streamed and looped by the decoder: the memory of a mix stays bounded
+MAX_MUSIC_SECONDS = 30
+# loudness of the mix: both inputs are brought to the same loudness, 3 dB under the target
+MIX_TARGET = -16.0
+MAX_GAIN = 20.0  # dB, the noise floor of a very quiet input isn't raised further
+# limiter: sample peak ceiling, gain computed on blocks of 10 ms, released at 20 dB/s
+CEILING = -1.5  # dBFS
+LIMITER_BLOCK = MIX_RATE // 100
+RELEASE = 20.0
+
+
+def mix_gain(loudness: float | None) -> float:
+    """
+    :param loudness: integrated loudness of an input, None or -inf if unknown or silent
+    :return: linear gain bringing the input 3 dB under MIX_TARGET
+    """
+    if loudness is None or not math.isfinite(loudness):
+        return 1.0
+    return 10 ** (min(MIX_TARGET - 3 - loudness, MAX_GAIN) / 20)
+
+
+def _check_cancelled() -> None:
+    scope = runner.current_scope()
+    if scope is not None and scope.cancelled:
+        raise runner.JobCancelled()
+
+
+def _decode_args(path: str, looped: bool = False, duration: float | None = None) -> list[str]:
+    """
+    ffmpeg command decoding the audio of a file to float PCM on stdout
+    """
+    args = ['ffmpeg', '-nostdin', '-hide_banner', '-nostats', '-loglevel', 'error']
+    if looped:
+        args += ['-stream_loop', '-1']
+    args += ['-i', path, '-vn']
+    if duration is not None:
+        args += ['-t', str(duration)]
+    return args + ['-ac', str(MIX_CHANNELS), '-ar', str(MIX_RATE), '-f', 'f32le', '-acodec', 'pcm_f32le', '-']
+
+
+class _PcmPipe:
+    """
+    audio of a file decoded by ffmpeg, read in a fixed buffer
+    """
+
+    def __init__(self, path: str, frames: int, looped: bool = False, duration: float | None = None):
+        self.path = path
+        self.buffer = np.empty((frames, MIX_CHANNELS), dtype=np.float32)
+        self.process = runner.run_async(_decode_args(path, looped, duration), pipe_stdout=True)
+
+    def read(self, frames: int) -> np.ndarray:
+        """
+        :return: view of the buffer with at most frames frames, empty at the end of the stream
+        """
+        values = read_into(self.process.stdout, self.buffer[:frames])
+        return self.buffer[:values // MIX_CHANNELS]
+
+    def close(self) -> None:
+        """
+        stop the decoder, the rest of the stream isn't needed
+        :raise ffmpeg.Error: if the decoder failed on its own
+        """
+        running = self.process.poll() is None
+        if running:
+            self.process.kill()
+        if self.process.wait() != 0 and not running:
+            _check_cancelled()
+            raise ffmpeg.Error('ffmpeg', None, f"could not decode the audio of {self.path}".encode())
+
+
+class _Music:
+    """
+    music looped and trimmed to the length of the video
+    a short music is decoded once and looped with views of its samples, a long one is streamed
+    """
+
+    def __init__(self, path: str, duration: float, total_frames: int):
+        """
+        :param duration: duration of the music
+        :param total_frames: frames of the mix
+        """
+        self.position = 0
+        self.pipe = None
+        self.samples = None
+        if duration <= MAX_MUSIC_SECONDS:
+            # trimmed at decode time if longer than the video
+            frames = min(math.ceil(duration * MIX_RATE) + MIX_RATE, total_frames)
+            pipe = _PcmPipe(path, frames, duration=frames / MIX_RATE)
+            try:
+                self.samples = pipe.read(frames)
+            finally:
+                pipe.close()
+        else:
+            self.pipe = _PcmPipe(path, CHUNK_FRAMES, looped=True)
+
+    def add_to(self, out: np.ndarray, gain: float, scratch: np.ndarray) -> None:
+        """
+        out += gain x next len(out) frames of the music
+        :param scratch: buffer of the size of out, for the scaled samples
+        """
+        filled = 0
+        while filled < len(out):
+            if self.pipe is not None:
+                part = self.pipe.read(len(out) - filled)
+            elif len(self.samples):
+                part = self.samples[self.position:self.position + len(out) - filled]
+                self.position = (self.position + len(part)) % len(self.samples)
+            else:
+                part = self.samples
+            if len(part) == 0:
+                # silent or unreadable music
+                return
+            np.multiply(part, gain, out=scratch[:len(part)])
+            out[filled:filled + len(part)] += scratch[:len(part)]
+            filled += len(part)
+
+    def close(self) -> None:
+        if self.pipe is not None:
+            self.pipe.close()
+
+
+class Limiter:
+    """
+    Peak limiter applied chunk by chunk. The gain of each block of LIMITER_BLOCK frames brings its peak under
+    the ceiling and rises back by RELEASE dB/s; it is interpolated sample by sample between the block starts,
+    so that it never steps. A gain falling is reached at the start of its block: the attack ramps over the
+    block before, the output is one block behind the input.
+    """
+
+    def __init__(self, ceiling: float = CEILING, release: float = RELEASE):
+        self.ceiling = ceiling
+        self.step = release * LIMITER_BLOCK / MIX_RATE
+        self.gain = 0.0  # dB, gain of the last output block
+        self._pending = np.empty((0, MIX_CHANNELS), dtype=np.float32)
+        self._buffer = np.empty((0, MIX_CHANNELS), dtype=np.float32)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        :param samples: next frames of the input
+        :return: next frames of the output, a view of a buffer reused by the next call;
+            the first call returns one block less than given, see flush
+        """
+        length = len(self._pending) + len(samples)
+        if len(self._buffer) < length:
+            self._buffer = np.empty((length, MIX_CHANNELS), dtype=np.float32)
+        buffer = self._buffer[:length]
+        buffer[:len(self._pending)] = self._pending
+        buffer[len(self._pending):] = samples
+        # the last block waits for the gain of the next one
+        ready = max(0, (length - 1) // LIMITER_BLOCK) * LIMITER_BLOCK
+        self._apply(buffer[:length], ready)
+        self._pending = buffer[ready:].copy()
+        return buffer[:ready]
+
+    def flush(self) -> np.ndarray:
+        """
+        :return: the frames still held, at the end of the input
+        """
+        samples, self._pending = self._pending, self._pending[:0]
+        self._apply(samples, len(samples))
+        return samples
+
+    def _apply(self, samples: np.ndarray, ready: int) -> None:
+        """
+        apply the gain in place to samples[:ready], the frames after it are only looked ahead
+        """
+        if ready == 0:
+            return
+        blocks = math.ceil(len(samples) / LIMITER_BLOCK)
+        padded = np.zeros(blocks * LIMITER_BLOCK, dtype=np.float32)
+        padded[:len(samples)] = np.abs(samples).max(axis=1)
+        peaks = padded.reshape(blocks, LIMITER_BLOCK).max(axis=1)
+        with np.errstate(divide='ignore'):
+            required = np.minimum(0.0, self.ceiling - 20 * np.log10(peaks))
+        # gain[n] = min(required[n], gain[n - 1] + step), unrolled as a running minimum
+        ramp = np.arange(1, blocks + 1) * self.step
+        gains = ramp + np.minimum(self.gain, np.minimum.accumulate(required - ramp))
+        # gain at the start of each block: never above the gain of the blocks on both sides
+        previous = np.concatenate(([self.gain], gains[:-1]))
+        starts = np.minimum(previous, gains)
+        ready_blocks = math.ceil(ready / LIMITER_BLOCK)
+        anchors = np.append(starts[:ready_blocks], starts[ready_blocks] if ready_blocks < blocks else gains[-1])
+        self.gain = float(gains[ready_blocks - 1])
+        if anchors.min() < 0:
+            curve = np.interp(np.arange(ready), np.arange(ready_blocks + 1) * LIMITER_BLOCK, anchors)
+            samples[:ready] *= (10 ** (curve / 20)).astype(np.float32)[:, None]
+
+
+def stream_mix(video_path: str, music_path: str, sink, duration: float, music_duration: float,
+               video_gain: float, music_gain: float, video_has_audio: bool = True) -> None:
+    """
+    Mix the audio of the video with the music, looped or trimmed to the duration of the video,
+    and write the result to sink as float PCM (MIX_RATE, stereo), chunk by chunk
+    :param sink: binary stream, the stdin of the encoder
+    :param duration: duration of the video
+    :param music_duration: duration of the music
+    """
+    total_frames = math.ceil(duration * MIX_RATE)
+    out = np.empty((CHUNK_FRAMES, MIX_CHANNELS), dtype=np.float32)
+    scratch = np.empty_like(out)
+    limiter = Limiter()
+    voice = _PcmPipe(video_path, CHUNK_FRAMES) if video_has_audio else None
+    try:
+        music = _Music(music_path, music_duration, total_frames)
+    except BaseException:
+        if voice is not None:
+            voice.process.kill()
+            voice.process.wait()
+        raise
+    try:
+        written = 0
+        while written < total_frames:
+            _check_cancelled()
+            frames = min(CHUNK_FRAMES, total_frames - written)
+            chunk = out[:frames]
+            decoded = voice.read(frames) if voice is not None else out[:0]
+            np.multiply(decoded, video_gain, out=chunk[:len(decoded)])
+            # the audio of the video can be shorter than the video
+            chunk[len(decoded):] = 0
+            music.add_to(chunk, music_gain, scratch)
+            sink.write(limiter.process(chunk).data)
+            written += frames
+        sink.write(limiter.flush().data)
+    finally:
+        try:
+            music.close()
+        finally:
+            if voice is not None:
+                voice.close()
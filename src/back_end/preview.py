@@ -0,0 +1,113 @@
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import ffmpeg
+
+from back_end import runner
+from back_end.audio_manip import is_audio
+from back_end.media_info import file_key
+from back_end.video_manip import is_video
+
+# the preview is an excerpt of the start of the media, its cost doesn't depend on the media duration
+PREVIEW_SECONDS = 30
+PREVIEW_HEIGHT = 360
+PREVIEW_THREADS = 2
+MAX_PREVIEWS = 50
+
+# in the temp directory, where gradio is allowed to serve files from
+PREVIEW_DIR = os.path.join(tempfile.gettempdir(), "media_processing_previews")
+
+# key -> [lock, number of threads using it], removed when no thread uses it
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _key_lock(key: str):
+    with _locks_lock:
+        entry = _locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _locks[key]
+
+
+def preview_path(path: str) -> str | None:
+    """
+    :return: path of the cached preview of path, the name depends on the identity of the file,
+        None if path is not a media
+    """
+    if is_video(path):
+        ext = ".mp4"
+    elif is_audio(path):
+        ext = ".mp3"
+    else:
+        return None
+    key = hashlib.sha1(repr(file_key(path)).encode()).hexdigest()
+    return os.path.join(PREVIEW_DIR, key + ext)
+
+
+def _encode_preview(path: str, output: str) -> None:
+    stream = ffmpeg.input(path, t=PREVIEW_SECONDS)
+    if output.endswith(".mp4"):
+        output_args = {'vf': f"scale=-2:'min({PREVIEW_HEIGHT},ih)'", 'vcodec': 'libx264', 'preset': 'ultrafast',
+                       'crf': 30, 'pix_fmt': 'yuv420p', 'acodec': 'aac', 'b:a': '96k', 'movflags': '+faststart'}
+    else:
+        output_args = {'vn': None, 'acodec': 'libmp3lame', 'b:a': '128k'}
+    output = ffmpeg.output(stream, output, threads=PREVIEW_THREADS, f=os.path.splitext(output)[1][1:], **output_args)
+    runner.run(output.overwrite_output(), quiet=True)
+
+
+def _prune() -> None:
+    """
+    keep the MAX_PREVIEWS most recent previews
+    """
+    try:
+        entries = sorted(os.scandir(PREVIEW_DIR), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for entry in entries[MAX_PREVIEWS:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def make_preview(path: str) -> str | None:
+    """
+    Low resolution excerpt of a media, for the players of the UI. The source is never copied nor modified.
+    Previews are cached by identity of the file (path, size, modification time), a preview requested
+    by several users at once is encoded once.
+    :param path: video or audio file
+    :return: path of the preview, None if path isn't a media or the preview failed
+    """
+    try:
+        output = preview_path(path)
+    except OSError:
+        return None
+    if output is None:
+        return None
+
+    with _key_lock(output):
+        if os.path.exists(output):
+            return output
+        os.makedirs(PREVIEW_DIR, exist_ok=True)
+        # written aside then renamed, a preview is never read half written
+        tmp_output = f"{output}.{os.getpid()}.{threading.get_ident()}.tmp{os.path.splitext(output)[1]}"
+        try:
+            _encode_preview(path, tmp_output)
+            os.replace(tmp_output, output)
+        except (ffmpeg.Error, OSError):
+            if os.path.exists(tmp_output):
+                os.remove(tmp_output)
+            return None
+    _prune()
+    return output
@@ -0,0 +1,366 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import signal
+import subprocess
+import threading
+from contextlib import contextmanager
+
+import ffmpeg
+
+from toolbox.ProgressBar import ProgressHub, parse_progress_block
+
+
+class JobCancelled(Exception):
+    """the operation was cancelled, no new process is started for it"""
+
+
+class CancelScope:
+    """
+    Processes started on behalf of one UI handler (and the batch jobs it submits), killed together on cancel.
+    With a loop, the ffmpeg runs of the scope are executed by the asyncio engine of this loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop | None = None):
+        self.loop = loop
+        self.cancelled = False
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def add(self, process) -> None:
+        with self._lock:
+            if self.cancelled:
+                _kill(process)
+                raise JobCancelled()
+            self._processes.add(process)
+
+    def discard(self, process) -> None:
+        with self._lock:
+            self._processes.discard(process)
+
+    def cancel(self) -> None:
+        """
+        kill the running processes, refuse the new ones
+        """
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+        for process in processes:
+            _kill(process)
+
+
+# the interactive lane (single file operations of the UI) preempts the batch lane (scheduled jobs)
+INTERACTIVE = "interactive"
+BATCH = "batch"
+# the batch lane can be paused (SIGSTOP) on posix systems only
+CAN_PAUSE = os.name == 'posix'
+
+_scope = contextvars.ContextVar("ffmpeg_cancel_scope", default=None)
+_lane = contextvars.ContextVar("ffmpeg_lane", default=INTERACTIVE)
+# every process started by the tool, killed when the server stops
+_live = set()
+# processes of the batch lane, stopped while batch_paused
+_batch = set()
+_batch_paused = False
+_live_lock = threading.Lock()
+
+
+def current_scope() -> CancelScope | None:
+    return _scope.get()
+
+
+def _group_kwargs() -> dict:
+    """
+    own process group: the process and its children are killed together, and a Ctrl+C in the terminal
+    is handled by the tool instead of reaching ffmpeg directly
+    """
+    if os.name == 'posix':
+        return {'start_new_session': True}
+    return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+def _kill(process) -> None:
+    if process.returncode is not None:
+        return
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        pass
+
+
+def _send(process, sig: int) -> None:
+    """
+    signal the process group of a running process, posix only
+    """
+    if os.name != 'posix' or process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, sig)
+    except OSError:
+        pass
+
+
+def _register(process, scope: CancelScope | None) -> None:
+    with _live_lock:
+        # Popen objects don't tell when they end, the finished ones are dropped here
+        for finished in [p for p in _live if isinstance(p, subprocess.Popen) and p.poll() is not None]:
+            _live.discard(finished)
+            _batch.discard(finished)
+        _live.add(process)
+        if _lane.get() == BATCH:
+            _batch.add(process)
+            if _batch_paused:
+                _send(process, signal.SIGSTOP)
+    if scope is not None:
+        try:
+            scope.add(process)
+        except JobCancelled:
+            _unregister(process, None)
+            raise
+
+
+def _unregister(process, scope: CancelScope | None) -> None:
+    with _live_lock:
+        _live.discard(process)
+        _batch.discard(process)
+    if scope is not None:
+        scope.discard(process)
+
+
+def kill_all() -> None:
+    """
+    kill every running process of the tool, when the server stops
+    """
+    with _live_lock:
+        processes = list(_live)
+        _live.clear()
+        _batch.clear()
+    for process in processes:
+        _kill(process)
+
+
+@contextmanager
+def lane(name: str):
+    """
+    lane of the processes started by the current thread (and the threads or tasks it starts)
+    :param name: INTERACTIVE or BATCH
+    """
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def pause_batch() -> None:
+    """
+    stop the processes of the batch lane (SIGSTOP), those started from now on are stopped at once
+    no effect outside of posix systems
+    """
+    global _batch_paused
+    with _live_lock:
+        _batch_paused = True
+        for process in _batch:
+            _send(process, signal.SIGSTOP)
+
+
+def resume_batch() -> None:
+    """
+    continue the processes of the batch lane (SIGCONT)
+    """
+    global _batch_paused
+    with _live_lock:
+        _batch_paused = False
+        for process in _batch:
+            _send(process, signal.SIGCONT)
+
+
+def _command(stream_spec) -> list[str]:
+    """
+    :param stream_spec: ffmpeg-python output node, or the command as a list of arguments
+    """
+    if isinstance(stream_spec, list):
+        return stream_spec
+    return ffmpeg.compile(stream_spec)
+
+
+def run_async(stream_spec, pipe_stdin: bool = False, pipe_stdout: bool = False, pipe_stderr: bool = False,
+              quiet: bool = False) -> subprocess.Popen:
+    """
+    like ffmpeg.run_async, the process is tracked by the current cancel scope and runs in its own process group
+    """
+    process = subprocess.Popen(_command(stream_spec), stdin=subprocess.PIPE if pipe_stdin else None,
+                               stdout=subprocess.PIPE if pipe_stdout or quiet else None,
+                               stderr=subprocess.PIPE if pipe_stderr or quiet else None, **_group_kwargs())
+    try:
+        _register(process, _scope.get())
+    except JobCancelled:
+        process.wait()
+        raise
+    return process
+
+
+def _in_loop_thread(loop: asyncio.AbstractEventLoop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def run(stream_spec, capture_stdout: bool = False, capture_stderr: bool = False,
+        quiet: bool = False) -> tuple[bytes | None, bytes | None]:
+    """
+    like ffmpeg.run: wait for the end of the process
+    in a cancel scope bound to an event loop, the process is run by run_ffmpeg_async on that loop
+    :param stream_spec: ffmpeg-python output node, or the command as a list of arguments
+    :return: (stdout, stderr), None for the streams not captured
+    :raise ffmpeg.Error: if the process fails
+    :raise JobCancelled: if the scope is cancelled
+    """
+    args = _command(stream_spec)
+    scope = _scope.get()
+    if scope is not None and scope.loop is not None and not _in_loop_thread(scope.loop):
+        if scope.cancelled:
+            raise JobCancelled()
+        future = asyncio.run_coroutine_threadsafe(
+            run_ffmpeg_async(args, capture_stdout or quiet, capture_stderr or quiet, scope=scope), scope.loop)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            # the loop stopped
+            raise JobCancelled()
+
+    process = run_async(args, pipe_stdout=capture_stdout, pipe_stderr=capture_stderr, quiet=quiet)
+    try:
+        out, err = process.communicate()
+    finally:
+        _unregister(process, scope)
+    if process.returncode != 0:
+        if scope is not None and scope.cancelled:
+            raise JobCancelled()
+        raise ffmpeg.Error(os.path.basename(args[0]), out, err)
+    return out, err
+
+
+async def _follow_progress(stdout: asyncio.StreamReader, duration: float, name: str) -> None:
+    """
+    '-progress pipe:1' output of the process, to the ProgressHub
+    """
+    hub = ProgressHub()
+    job = hub.start_job(name, duration)
+    try:
+        progress_info = {}
+        async for raw_line in stdout:
+            line = raw_line.decode('utf-8', errors='replace').strip()
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            progress_info[key.strip()] = value.strip()
+            if key == 'progress':
+                hub.update(job, parse_progress_block(progress_info))
+                progress_info = {}
+    finally:
+        hub.finish_job(job)
+
+
+async def run_ffmpeg_async(stream_spec, capture_stdout: bool = False, capture_stderr: bool = False,
+                           duration: float | None = None, name: str = "",
+                           scope: CancelScope | None = None) -> tuple[bytes | None, bytes | None]:
+    """
+    Run ffmpeg with asyncio.create_subprocess_exec, in its own process group.
+    Cancelling the awaiting task kills the process group at once.
+    :param stream_spec: ffmpeg-python output node, or the command as a list of arguments
+    :param duration: duration of the media, the progress ('-progress pipe:1' in the command) goes to the
+        ProgressHub if set
+    :param scope: cancel scope of the process, default: the current one
+    :return: (stdout, stderr), None for the streams not captured
+    :raise ffmpeg.Error: if the process fails
+    :raise JobCancelled: if the scope is cancelled
+    """
+    args = _command(stream_spec)
+    scope = scope or _scope.get()
+    if scope is not None and scope.cancelled:
+        raise JobCancelled()
+    follow = duration is not None
+    process = await asyncio.create_subprocess_exec(
+        *args, stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE if capture_stdout or follow else None,
+        stderr=asyncio.subprocess.PIPE if capture_stderr else None, **_group_kwargs())
+    try:
+        _register(process, scope)
+    except JobCancelled:
+        await process.wait()
+        raise
+    try:
+        if follow:
+            stderr_task = asyncio.ensure_future(process.stderr.read()) if capture_stderr else None
+            await _follow_progress(process.stdout, duration, name or os.path.basename(args[-1]))
+            out, err = None, (await stderr_task if stderr_task else None)
+            await process.wait()
+        else:
+            out, err = await process.communicate()
+    except asyncio.CancelledError:
+        _kill(process)
+        raise
+    finally:
+        _unregister(process, scope)
+    if process.returncode != 0:
+        if scope is not None and scope.cancelled:
+            raise JobCancelled()
+        raise ffmpeg.Error(os.path.basename(args[0]), out, err)
+    return out, err
+
+
+async def run_operation(fn, *args, **kwargs):
+    """
+    Async version of a back end operation: fn runs in a thread, its ffmpeg processes (and those of the batch
+    jobs it submits) belong to a new cancel scope and are run by the asyncio engine of the running loop.
+    Cancelling the awaiting task (closed tab, stopped event) kills them at once.
+    """
+    scope = CancelScope(asyncio.get_running_loop())
+    token = _scope.set(scope)
+    try:
+        # to_thread copies the context, the scope included
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    except asyncio.CancelledError:
+        scope.cancel()
+        raise
+    finally:
+        _scope.reset(token)
+
+
+async def run_generator(fn, *args, **kwargs):
+    """
+    Async version of a back end generator: each step runs in a thread, in one cancel scope for the whole generator.
+    Cancelling the awaiting task kills the processes, waits for the running step to stop, then closes the generator.
+    """
+    loop = asyncio.get_running_loop()
+    scope = CancelScope(loop)
+    context = contextvars.copy_context()
+    context.run(_scope.set, scope)
+    generator = fn(*args, **kwargs)
+    done = object()
+    step = None
+    try:
+        while True:
+            step = loop.run_in_executor(None, context.run, next, generator, done)
+            # shielded: the step keeps running in its thread when the task is cancelled
+            res = await asyncio.shield(step)
+            step = None
+            if res is done:
+                return
+            yield res
+    except asyncio.CancelledError:
+        scope.cancel()
+        raise
+    finally:
+        try:
+            if step is not None:
+                # close() raises ValueError while the generator is executing
+                await asyncio.wait([step])
+        finally:
+            generator.close()
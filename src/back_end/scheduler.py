@@ -0,0 +1,522 @@
+import contextvars
+import heapq
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import ffmpeg
+
+from back_end import runner
+from back_end.broker import BrokerClient, REMOTE_OPERATIONS, DONE, FAILED
+from back_end.journal import JobJournal
+from back_end.media_info import probe, get_stream
+from toolbox.Parameters import Params
+from toolbox.ProgressBar import ProgressHub, ProgressEvent
+from toolbox.Singleton import SingletonMeta
+from toolbox.utils import iter_audios
+
+params = Params()
+
+# relative cost of an operation for the same duration and resolution
+OPERATION_WEIGHTS = {
+    "compress": 1.0,
+    "convert": 1.0,
+    "combine": 0.3,
+    "replace": 0.05,
+    "sheet": 0.02,
+    "effects": 0.05,
+}
+REFERENCE_PIXELS = 1920 * 1080
+# seconds between two polls of the broker while a batch runs on the workers
+BROKER_POLL_INTERVAL = 1.0
+# jobs of a streamed batch waiting for a worker, ordered by cost among themselves
+STREAM_WINDOW = 32
+# latencies kept for the percentiles of each lane
+LATENCY_SAMPLES = 1000
+LATENCY_PERCENTILES = (50, 90, 99)
+# seconds the batch lane stays paused for an interactive operation, then it runs beside it without the reserved slot
+MAX_BATCH_PAUSE = 30.0
+
+# threads of the ffmpeg processes of a scheduled job, carried to the threads it starts with its context
+_threads: contextvars.ContextVar[int | None] = contextvars.ContextVar("ffmpeg_threads", default=None)
+
+
+@dataclass
+class Job:
+    fn: callable
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    path: str = ""  # media used to estimate the cost
+    operation: str = ""
+    cost: float = 0.0
+    inputs: tuple = ()  # other input files, keyed by their identity in the journal
+    describe: callable = None  # called with the arguments of fn before it runs, note added to the result
+
+
+def format_result(output: str, note=None) -> str:
+    """
+    line of a batch result: output of a job (or error message) followed by its note
+    """
+    return f"{output} ({note})" if note else output
+
+
+# (output, note) of every job run in the context, see collect_results
+_collected: contextvars.ContextVar[list | None] = contextvars.ContextVar("collected_results", default=None)
+
+
+@contextmanager
+def collect_results():
+    """
+    record the output and note of every job run in the with block, whatever formats their results
+    """
+    results = []
+    token = _collected.set(results)
+    try:
+        yield results
+    finally:
+        _collected.reset(token)
+
+
+@contextmanager
+def thread_share(threads: int):
+    """
+    threads given to the ffmpeg processes started in the current context, see ffmpeg_threads
+    """
+    token = _threads.set(threads)
+    try:
+        yield
+    finally:
+        _threads.reset(token)
+
+
+def ffmpeg_threads() -> dict:
+    """
+    output arguments limiting the threads of an ffmpeg process started by a scheduled job,
+    empty outside of the scheduler
+    """
+    threads = _threads.get()
+    if threads:
+        return {'threads': threads}
+    return {}
+
+
+def estimate_cost(path: str, operation: str) -> float:
+    """
+    :return: duration x resolution x operation weight, relative to one second of 1080p compression
+    """
+    weight = OPERATION_WEIGHTS.get(operation, 1.0)
+    try:
+        info = probe(path)
+        duration = float(info['format']['duration'])
+    except (ffmpeg.Error, OSError, KeyError, ValueError):
+        return weight
+    video_stream = get_stream(info, 'video')
+    if video_stream is not None and video_stream.get('width') and video_stream.get('height'):
+        pixels = int(video_stream['width']) * int(video_stream['height']) / REFERENCE_PIXELS
+    else:
+        # audio only
+        pixels = 0.05
+    return duration * pixels * weight
+
+
+def journal_key(job: Job) -> str | None:
+    """
+    key of the job in the journal: identity of its inputs, operation and other parameters
+    """
+    args = [arg for arg in job.args if arg not in job.inputs]
+    return JobJournal().job_key(job.path, job.operation, [job.fn.__name__, args, job.kwargs], job.inputs)
+
+
+def audio_jobs(fn, operation: str, videos: Iterable[str], audios: list[str], randomize: bool) -> Iterator[Job]:
+    """
+    jobs giving an audio to each video, random or in round-robin order
+    with resumable batches, a video gets again the audio drawn for it by an interrupted run
+    """
+    resume = params.get_resume_batches()
+    journal = JobJournal()
+    for video, audio in zip(videos, iter_audios(audios, randomize)):
+        if resume:
+            previous = journal.assigned_audio(video, operation)
+            if previous in audios:
+                audio = previous
+            else:
+                journal.assign_audio(video, operation, audio)
+        yield Job(fn, (video, audio), path=video, operation=operation, inputs=(audio,))
+
+
+def _journal_result(journal: JobJournal, key: str, job: Job, res, note) -> None:
+    """
+    record the result of a job: its output, nothing if the input already was the result, or the error
+    """
+    if res == job.path:
+        journal.skip(key, job.path, job.operation, str(note or ""))
+    elif isinstance(res, str) and os.path.isfile(res):
+        journal.finish(key, job.path, job.operation, res)
+    else:
+        journal.fail(key, job.path, job.operation, str(res))
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    nearest-rank percentile of a non-empty list
+    """
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+class BatchScheduler(metaclass=SingletonMeta):
+    """
+    Single worker pool shared by every batch operation.
+    Jobs are ordered by estimated cost and every ffmpeg process gets a share of the cores,
+    so that the running processes together match the core count.
+    Scheduled jobs form the batch lane; the single file operations of the UI form the interactive lane.
+    An interactive operation pauses the batch lane for MAX_BATCH_PAUSE seconds at most and keeps a reserved
+    worker slot while it runs.
+    """
+
+    def __init__(self):
+        self.cores = os.cpu_count() or 1
+        self._executor = None
+        self._max_workers = 0
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._streams = 0
+        self._interactive = 0
+        self._paused = None  # timer ending the pause of the batch lane
+        self._running = 0
+        self._slots = threading.Condition(self._lock)
+        self._latencies = {lane: deque(maxlen=LATENCY_SAMPLES) for lane in (runner.INTERACTIVE, runner.BATCH)}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            max_workers = params.get_max_workers()
+            if self._executor is None or self._max_workers != max_workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(max_workers=max_workers)
+                self._max_workers = max_workers
+            return self._executor
+
+    def _batch_slots(self) -> int:
+        """
+        workers the batch jobs can use, one is reserved while an interactive operation runs
+        """
+        if self._interactive and self._max_workers > 1:
+            return self._max_workers - 1
+        return self._max_workers
+
+    def threads_per_job(self) -> int:
+        """
+        while a streamed batch runs, the number of jobs to come is unknown: every worker is assumed busy
+        an interactive operation gets the share of one job
+        """
+        with self._lock:
+            slots = self._batch_slots()
+            queued = slots if self._streams else self._queued
+            running = max(1, min(slots, self.cores, queued)) + (1 if self._interactive else 0)
+        return max(1, self.cores // running)
+
+    @staticmethod
+    def _estimate(job: Job) -> None:
+        if job.path:
+            job.cost = estimate_cost(job.path, job.operation)
+
+    @staticmethod
+    def _priority(job: Job) -> float:
+        """
+        longest first minimises the makespan, shortest first gives results sooner
+        """
+        return job.cost if params.get_schedule_order() == "shortest" else -job.cost
+
+    def order(self, jobs: list[Job]) -> list[Job]:
+        for job in jobs:
+            self._estimate(job)
+        return sorted(jobs, key=self._priority)
+
+    def _record_latency(self, lane: str, submitted: float) -> None:
+        with self._lock:
+            self._latencies[lane].append(time.monotonic() - submitted)
+
+    def latency_percentiles(self) -> dict[str, dict[str, float]]:
+        """
+        :return: for each lane, number of recent jobs and percentiles (p50, p90, p99) in seconds
+            of the time from submission to result
+        """
+        with self._lock:
+            latencies = {lane: list(values) for lane, values in self._latencies.items()}
+        stats = {}
+        for lane, values in latencies.items():
+            stats[lane] = {"count": len(values)}
+            if values:
+                stats[lane].update({f"p{p}": percentile(values, p) for p in LATENCY_PERCENTILES})
+        return stats
+
+    def latency_summary(self) -> str:
+        lines = []
+        for lane, stats in self.latency_percentiles().items():
+            if stats["count"]:
+                values = ", ".join(f"p{p} {stats[f'p{p}']:.1f}s" for p in LATENCY_PERCENTILES)
+                lines.append(f"{lane}: {stats['count']} jobs, {values}")
+            else:
+                lines.append(f"{lane}: no job yet")
+        return '\n'.join(lines)
+
+    @contextmanager
+    def interactive(self):
+        """
+        run an operation in the interactive lane: the ffmpeg processes of the batch lane are paused
+        (SIGSTOP / SIGCONT) for MAX_BATCH_PAUSE seconds at most, then (or at once without SIGSTOP) the batch
+        jobs run beside it: a worker slot and the threads of one job stay reserved until no interactive
+        operation is running
+        """
+        submitted = time.monotonic()
+        with self._lock:
+            self._interactive += 1
+            if self._interactive == 1 and runner.CAN_PAUSE:
+                runner.pause_batch()
+                timer = threading.Timer(MAX_BATCH_PAUSE, lambda: self._end_pause(timer))
+                timer.daemon = True
+                timer.start()
+                self._paused = timer
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._interactive -= 1
+                if self._interactive == 0:
+                    self._end_pause_locked()
+                self._slots.notify_all()
+            self._record_latency(runner.INTERACTIVE, submitted)
+
+    def _end_pause(self, timer: threading.Timer) -> None:
+        """
+        end of MAX_BATCH_PAUSE, unless the pause of this timer already ended
+        """
+        with self._lock:
+            if self._paused is timer:
+                self._end_pause_locked()
+
+    def _end_pause_locked(self) -> None:
+        if self._paused is not None:
+            self._paused.cancel()
+            self._paused = None
+            runner.resume_batch()
+
+    @contextmanager
+    def _batch_slot(self):
+        """
+        wait for a worker slot not reserved for the interactive lane
+        """
+        with self._slots:
+            while self._running >= self._batch_slots():
+                self._slots.wait()
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._slots:
+                self._running -= 1
+                self._slots.notify_all()
+
+    def _run_job(self, job: Job, submitted: float) -> tuple[str, object]:
+        """
+        :return: output of the job (or error message) and its note
+        """
+        try:
+            with self._batch_slot(), thread_share(self.threads_per_job()), runner.lane(runner.BATCH):
+                note = job.describe(*job.args, **job.kwargs) if job.describe is not None else None
+                if job.path and params.get_resume_batches():
+                    return self._run_journaled(job, note)
+                return job.fn(*job.args, **job.kwargs), note
+        except Exception as e:
+            return f"Error: {str(e)}", None
+        finally:
+            with self._lock:
+                self._queued -= 1
+            self._record_latency(runner.BATCH, submitted)
+
+    @staticmethod
+    def _run_journaled(job: Job, note) -> tuple[str, object]:
+        """
+        skip the job if the journal has a valid output for it, record the result otherwise
+        """
+        journal = JobJournal()
+        key = journal_key(job)
+        if key is None:
+            return job.fn(*job.args, **job.kwargs), note
+
+        output = journal.completed_output(key)
+        if output is not None:
+            return output, "already done"
+
+        journal.start(key, job.path, job.operation)
+        try:
+            res = job.fn(*job.args, **job.kwargs)
+        except Exception as e:
+            journal.fail(key, job.path, job.operation, str(e))
+            raise
+        _journal_result(journal, key, job, res, note)
+        return res, note
+
+    def run(self, jobs: Iterable[Job]) -> list[str]:
+        """
+        :return: result lines of the jobs, see run_results
+        """
+        return [format_result(output, note) for output, note in self.run_results(jobs)]
+
+    def run_results(self, jobs: Iterable[Job]) -> list[tuple[str, object]]:
+        """
+        :param jobs: list of jobs, ordered by cost before being submitted,
+            or any other iterable (generator), each job is submitted as soon as it is produced
+        :return: output (or error message) and note of the jobs, in the order of the given jobs
+        """
+        if params.get_broker_url():
+            results = self._run_remote(jobs)
+        else:
+            results = self._run_local(jobs)
+        collected = _collected.get()
+        if collected is not None:
+            collected.extend(results)
+        return results
+
+    def _run_local(self, jobs: Iterable[Job]) -> list[tuple[str, object]]:
+        if not isinstance(jobs, (list, tuple)):
+            return self._run_stream(jobs)
+        executor = self._get_executor()
+        with self._lock:
+            self._queued += len(jobs)
+        with ProgressHub().batch(len(jobs)):
+            submitted = time.monotonic()
+            # the context carries the cancel scope of the caller to the jobs
+            futures = {id(job): executor.submit(contextvars.copy_context().run, self._run_job, job, submitted)
+                       for job in self.order(list(jobs))}
+            return [futures[id(job)].result() for job in jobs]
+
+    def _run_stream(self, jobs: Iterable[Job]) -> list[tuple[str, object]]:
+        """
+        the total cost is unknown while the jobs are produced: a job is submitted as soon as a worker is free,
+        the jobs produced meanwhile wait in a window of STREAM_WINDOW jobs and are submitted by cost
+        """
+        executor = self._get_executor()
+        hub = ProgressHub()
+        slots = threading.Semaphore(self._max_workers)
+        window = []
+        futures = []
+
+        def submit() -> None:
+            index, job = heapq.heappop(window)[1:]
+            with self._lock:
+                self._queued += 1
+            future = executor.submit(contextvars.copy_context().run, self._run_job, job, time.monotonic())
+            future.add_done_callback(lambda _: slots.release())
+            futures[index] = future
+
+        with self._lock:
+            self._streams += 1
+        try:
+            for job in jobs:
+                self._estimate(job)
+                heapq.heappush(window, (self._priority(job), len(futures), job))
+                futures.append(None)
+                hub.announce(1)
+                # wait for a worker only once the window is full
+                while window and slots.acquire(blocking=len(window) >= STREAM_WINDOW):
+                    submit()
+            while window:
+                slots.acquire()
+                submit()
+            return [future.result() for future in futures]
+        finally:
+            with self._lock:
+                self._streams -= 1
+            hub.announce(-len(futures))
+
+    def _run_remote(self, jobs: Iterable[Job]) -> list[tuple[str, object]]:
+        """
+        submit the jobs a worker can run to the broker as soon as they are produced and wait for their results,
+        the others run locally meanwhile
+        """
+        if isinstance(jobs, (list, tuple)):
+            discovered = self.order(list(jobs))
+        else:
+            discovered = jobs
+        client = BrokerClient(params.get_broker_url())
+        journal = JobJournal()
+        produced = []
+        results = {}
+        keys = {}
+        notes = {}
+        submitted = []
+        batch = None
+        ids = []
+        local = []
+
+        def local_jobs() -> Iterator[Job]:
+            """
+            the jobs to run locally, the others are submitted to the broker while the generator is consumed
+            """
+            nonlocal batch
+            for job in discovered:
+                produced.append(job)
+                if job.fn.__name__ not in REMOTE_OPERATIONS:
+                    local.append(job)
+                    yield job
+                    continue
+                if job.path and params.get_resume_batches():
+                    key = journal_key(job)
+                    output = journal.completed_output(key) if key is not None else None
+                    if output is not None:
+                        results[id(job)] = output, "already done"
+                        continue
+                    if key is not None:
+                        keys[id(job)] = key
+                if job.describe is not None:
+                    notes[id(job)] = job.describe(*job.args, **job.kwargs)
+                batch, job_ids = client.submit(
+                    [{"operation": job.fn.__name__, "args": list(job.args), "kwargs": job.kwargs}], batch)
+                ids.extend(job_ids)
+                submitted.append(job)
+
+        # the workers start on the submitted jobs while the others run here
+        local_results = self._run_stream(local_jobs())
+        results.update(zip(map(id, local), local_results))
+        for job, result in zip(submitted, self._wait_remote(client, batch, ids, submitted)):
+            note = notes.get(id(job))
+            results[id(job)] = result, note
+            key = keys.get(id(job))
+            if key is not None:
+                _journal_result(journal, key, job, result, note)
+        order = jobs if isinstance(jobs, (list, tuple)) else produced
+        return [results[id(job)] for job in order]
+
+    @staticmethod
+    def _wait_remote(client: BrokerClient, batch: str, ids: list[int], jobs: list[Job]) -> list[str]:
+        """
+        follow the jobs of a batch on the broker, their progress goes to the ProgressHub
+        :return: results of the jobs, in the order of ids
+        """
+        if not ids:
+            return []
+        hub = ProgressHub()
+        with hub.batch(len(ids)):
+            progress = {job_id: hub.start_job(os.path.basename(job.path) or f"job {job_id}", 1.0)
+                        for job_id, job in zip(ids, jobs)}
+            results = {}
+            while len(results) < len(ids):
+                time.sleep(BROKER_POLL_INTERVAL)
+                for remote_job in client.batch(batch):
+                    job_id = remote_job["id"]
+                    if job_id in results or job_id not in progress:
+                        continue
+                    if remote_job["status"] in (DONE, FAILED):
+                        results[job_id] = remote_job["result"]
+                        hub.finish_job(progress[job_id])
+                    else:
+                        hub.update(progress[job_id], ProgressEvent(out_time=remote_job["progress"]))
+        return [results[job_id] for job_id in ids]
@@ -0,0 +1,69 @@
+import os
+
+import ffmpeg
+
+from back_end import runner
+from back_end.media_info import probe, file_key, get_table
+from back_end.scheduler import ffmpeg_threads
+
+SHEET_COLUMNS = 4
+SHEET_ROWS = 4
+THUMBNAIL_WIDTH = 320
+# interval between thumbnails when the duration is unknown
+DEFAULT_INTERVAL = 10.0
+
+
+def _get_cached_sheet(key: str) -> str | None:
+    entry = get_table("contact_sheets").get(key)
+    if entry is None:
+        return None
+    try:
+        st = os.stat(entry["output"])
+    except OSError:
+        return None
+    if st.st_size != entry["size"] or st.st_mtime_ns != entry["mtime_ns"]:
+        return None
+    return entry["output"]
+
+
+def contact_sheet(video_path: str, output_path: str = "", columns: int = SHEET_COLUMNS, rows: int = SHEET_ROWS,
+                  width: int = THUMBNAIL_WIDTH) -> str:
+    """
+    Tiled contact sheet of a video, made of keyframes only: the other frames are not decoded.
+    The keyframes are picked at a fixed interval and downscaled before being tiled.
+    Sheets are cached by identity of the video (path, size, modification time) and parameters.
+    :param video_path: path to the video
+    :param output_path: path of the jpg, default: next to the video, "__sheet.jpg" suffix
+    :param columns: number of thumbnails per row
+    :param rows: number of rows
+    :param width: width of a thumbnail
+    :return: path of the contact sheet or error message
+    """
+    if not os.path.exists(video_path):
+        return f"Error: {video_path} doesn't exist"
+    if not output_path:
+        output_path = os.path.splitext(video_path)[0] + "__sheet.jpg"
+
+    key = repr([file_key(video_path), os.path.abspath(output_path), columns, rows, width])
+    cached = _get_cached_sheet(key)
+    if cached is not None:
+        return cached
+
+    try:
+        interval = float(probe(video_path)['format']['duration']) / (columns * rows)
+    except (ffmpeg.Error, KeyError, ValueError):
+        interval = DEFAULT_INTERVAL
+
+    try:
+        stream = ffmpeg.input(video_path, skip_frame='nokey')
+        stream = stream.video.filter('select', f"isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f})")
+        stream = stream.filter('scale', width, -2)
+        stream = stream.filter('tile', f"{columns}x{rows}")
+        output = ffmpeg.output(stream, output_path, vframes=1, vsync='vfr', **ffmpeg_threads())
+        runner.run(output.overwrite_output(), quiet=True)
+    except ffmpeg.Error as e:
+        return f"ffmpeg error: {e.stderr}"
+
+    st = os.stat(output_path)
+    get_table("contact_sheets").set(key, {"output": output_path, "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+    return output_path
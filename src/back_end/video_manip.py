@@ -1,13 +1,19 @@
+import bisect
 import os
-import os
-import subprocess
-import sys
+import shutil
 import tempfile
+from dataclasses import dataclass
 
 import ffmpeg
 
+from back_end import runner
+from back_end.chunked import chunked_segments, encode_in_segments
+from back_end.encoders import resolve_encoder
+from back_end.media_info import probe, get_stream, get_keyframes, get_keyframe_index, get_packet_times
+from back_end.scheduler import ffmpeg_threads
+from toolbox.Parameters import Params
 from toolbox.ProgressBar import progress_bar
-from toolbox.utils import to_seconds
+from toolbox.utils import to_seconds, write_concat_list
 
 
 def is_video(path: str) -> bool:
@@ -20,15 +26,19 @@ def get_original_codecs(input_video) -> tuple[str, str]:
     if not is_video(input_video):
         return f"Error: Not a video file", ""
     try:
-        probe = ffmpeg.probe(input_video, v='error', select_streams='v:0', show_entries='stream=codec_name')
-        video_codec = probe['streams'][0]['codec_name']
-
-        probe = ffmpeg.probe(input_video, v='error', select_streams='a:0', show_entries='stream=codec_name')
-        audio_codec = probe['streams'][0]['codec_name']
+        info = probe(input_video)
+        video_stream = get_stream(info, 'video')
+        if video_stream is None:
+            raise ValueError("No video stream found in the file")
+        video_codec = video_stream['codec_name']
+        audio_stream = get_stream(info, 'audio')
+        audio_codec = audio_stream['codec_name'] if audio_stream else ""
 
         return video_codec, audio_codec
     except ffmpeg.Error as e:
         return f"ffmpeg error: {e.stderr}", ""
+    except (KeyError, ValueError) as e:
+        return f"Error extracting codecs: {e}", ""
 
 
 def get_video_duration(video_path: str) -> float | str:
@@ -39,9 +49,9 @@ def get_video_duration(video_path: str) -> float | str:
     if not is_video(video_path):
         return f"Error: Not a video file"
     try:
-        probe = ffmpeg.probe(video_path)
+        info = probe(video_path)
 
-        duration = float(probe['format']['duration'])
+        duration = float(info['format']['duration'])
 
         return duration
     except ffmpeg.Error as e:
@@ -62,10 +72,9 @@ def get_resolution(video_path: str) -> tuple[int | str, int | None]:
     if not is_video(video_path):
         return f"Error: Not a video file", None
     try:
-        probe = ffmpeg.probe(video_path)
+        info = probe(video_path)
 
-        video_stream = next((stream for stream in probe['streams']
-                             if stream['codec_type'] == 'video'), None)
+        video_stream = get_stream(info, 'video')
 
         if video_stream is None:
             raise ValueError("No video stream found in the file")
@@ -90,18 +99,17 @@ def get_video_bitrate(video_path: str) -> float | str:
     if not is_video(video_path):
         return f"Error: Not a video file"
     try:
-        probe = ffmpeg.probe(video_path)
+        info = probe(video_path)
 
-        video_stream = next((stream for stream in probe['streams']
-                             if stream['codec_type'] == 'video'), None)
+        video_stream = get_stream(info, 'video')
 
         if video_stream is None:
             raise ValueError("No video stream found in the file")
 
         if 'bit_rate' in video_stream and video_stream['bit_rate']:
             bitrate = float(video_stream['bit_rate'])
-        elif 'bit_rate' in probe['format'] and probe['format']['bit_rate']:
-            bitrate = float(probe['format']['bit_rate'])
+        elif 'bit_rate' in info['format'] and info['format']['bit_rate']:
+            bitrate = float(info['format']['bit_rate'])
         else:
             raise ValueError("Bitrate information not found")
 
@@ -113,12 +121,13 @@ def get_video_bitrate(video_path: str) -> float | str:
         return f"Error extracting bitrate: {e}"
 
 
-def video_cut(input_video: str, start=None, end=None) -> str:
+def video_cut(input_video: str, start=None, end=None, smart: bool = False) -> str:
     """
     Cut a video from start to end
     :param input_video: path to the input video file
     :param start: start time in format "HH:MM:SS" or seconds
     :param end: end time in format "HH:MM:SS" or seconds
+    :param smart: frame accurate cut, only the partial GOPs at the start and at the end are re-encoded
     :return: path to the output video file
     """
     if not is_video(input_video):
@@ -141,6 +150,12 @@ def video_cut(input_video: str, start=None, end=None) -> str:
 
     output_video = os.path.splitext(input_video)[0] + "__cut.mp4"
 
+    if smart:
+        try:
+            return _smart_cut(input_video, start or 0, end, output_video)
+        except ffmpeg.Error as e:
+            print(f"Smart cut failed, cutting on keyframes: {e}")
+
     try:
         if start:
             stream = ffmpeg.input(input_video, ss=start)
@@ -154,7 +169,7 @@ def video_cut(input_video: str, start=None, end=None) -> str:
 
         stream = ffmpeg.overwrite_output(stream)
 
-        ffmpeg.run(stream)
+        runner.run(stream)
 
         return output_video
 
@@ -162,6 +177,211 @@ def video_cut(input_video: str, start=None, end=None) -> str:
         return f"ffmpeg error: {e.stderr}"
 
 
+def _smart_cut(input_video: str, start: float, end: float | None, output_video: str) -> str:
+    """
+    The range is split on the keyframes: the GOP parts before the first keyframe and after the last one
+    are re-encoded with the parameters of the source, everything in between is stream copied.
+    The pieces are spliced with the concat demuxer, the audio is copied in the same run.
+    Every piece carries its parameter sets in band, the mp4 muxer keeps the extradata of the first one only.
+    If the result doesn't decode cleanly around the splices, the whole range is re-encoded.
+    """
+    if not end:
+        end = get_video_duration(input_video)
+        if type(end) == str:
+            return end
+
+    reference = stream_signature(input_video)
+    keyframe_index = get_keyframe_index(input_video)
+    keyframes = [pts for pts, _ in keyframe_index]
+    first = bisect.bisect_left(keyframes, start)
+    last = bisect.bisect_right(keyframes, end) - 1
+    copy_start = keyframes[first] if first < len(keyframes) else end
+    copy_end = keyframes[last] if last >= 0 else start
+
+    if reference['vcodec'] not in VIDEO_ENCODERS:
+        raise ffmpeg.Error('smart cut', b'', f"No encoder for {reference['vcodec']}".encode())
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        extension = os.path.splitext(input_video)[1]
+        entries = []
+        if copy_start >= copy_end:
+            # no complete GOP in the range
+            head = os.path.join(temp_dir, f"head{extension}")
+            _encode_range_like(input_video, start, end, reference, head)
+            entries.append((head, None, None))
+        else:
+            if start < copy_start:
+                head = os.path.join(temp_dir, f"head{extension}")
+                _encode_range_like(input_video, start, copy_start, reference, head)
+                entries.append((head, None, None))
+            # the concat demuxer drops packets by dts: stop at the dts of the keyframe so that the frames
+            # reordered before it are kept, and give the real duration for the timestamps of the tail
+            middle = (input_video, copy_start, keyframe_index[last][1], copy_end - copy_start)
+            if reference['vcodec'] in ANNEXB_FILTERS:
+                middle = (_copy_in_band(middle, reference, os.path.join(temp_dir, f"middle{extension}")),
+                          None, None, copy_end - copy_start)
+            entries.append(middle)
+            if copy_end < end:
+                tail = os.path.join(temp_dir, f"tail{extension}")
+                _encode_range_like(input_video, copy_end, end, reference, tail)
+                entries.append((tail, None, None))
+
+        list_path = write_concat_list(entries)
+        try:
+            video = ffmpeg.input(list_path, format='concat', safe=0).video
+            streams = [video]
+            if reference['acodec'] is not None:
+                streams.append(ffmpeg.input(input_video, ss=start, t=end - start).audio)
+            runner.run(
+                ffmpeg.output(*streams, output_video, c='copy')
+                .overwrite_output()
+            )
+        finally:
+            os.unlink(list_path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if copy_start < copy_end and not _splices_decode_cleanly(input_video, output_video, start, end,
+                                                             _splice_windows(keyframes, first, last, start, end)):
+        print(f"Smart cut of {input_video} doesn't decode cleanly, re-encoding the whole range")
+        _encode_cut(input_video, start, end, reference, output_video)
+    return output_video
+
+
+def _splice_windows(keyframes: list[float], first: int, last: int, start: float, end: float) -> list[tuple]:
+    """
+    Ranges of the source to check after a smart cut: from the start to two GOPs into the copied part,
+    and from the GOP before the last copied keyframe to the end
+    :param first: index of the first copied keyframe
+    :param last: index of the last copied keyframe
+    :return: (from, to) in seconds, sorted and disjoint
+    """
+    head_end = keyframes[first + 2] if first + 2 < last else end
+    if keyframes[last] >= end:
+        return [(start, head_end)]
+    tail_start = keyframes[max(first, last - 1)]
+    if tail_start <= head_end:
+        return [(start, end)]
+    return [(start, head_end), (tail_start, end)]
+
+
+def _splices_decode_cleanly(input_video: str, output_video: str, start: float, end: float,
+                            windows: list[tuple]) -> bool:
+    """
+    Decode the output of a smart cut around its splices only, a few GOPs instead of the whole video.
+    The frames reordered around a copied keyframe of an open GOP are dropped by the decoder:
+    the number of decoded frames is compared with the number of packets of the source in the same range.
+    :param windows: ranges of the source around the splices, see _splice_windows
+    """
+    for window_start, window_end in windows:
+        expected_frames = len(get_packet_times(input_video, window_start, window_end))
+        duration = window_end - window_start if window_end < end else None
+        if not decodes_cleanly(output_video, expected_frames, window_start - start, duration):
+            return False
+    return True
+
+
+def _copy_in_band(entry: tuple, reference: dict, output_path: str) -> str:
+    """
+    Stream copy a range given as a concat entry, with the parameter sets of the source before each keyframe
+    """
+    list_path = write_concat_list([entry])
+    try:
+        runner.run(
+            ffmpeg.input(list_path, format='concat', safe=0).video
+            .output(output_path, c='copy', **{'bsf:v': ANNEXB_FILTERS[reference['vcodec']]})
+            .overwrite_output()
+        )
+    finally:
+        os.unlink(list_path)
+    return output_path
+
+
+def _encode_args(input_video: str, reference: dict) -> dict:
+    """
+    output arguments re-encoding the video stream with the codec, profile, level and pixel format of the source,
+    the parameter sets are repeated before each keyframe
+    """
+    encoder = VIDEO_ENCODERS[reference['vcodec']]
+    output_args = {
+        'vcodec': encoder,
+        'pix_fmt': reference['pix_fmt'],
+        'video_track_timescale': reference['time_base'].split('/')[1],
+        # timestamps of the source: a variable frame rate isn't made constant or rounded to the nominal rate
+        'fps_mode': 'passthrough',
+        'enc_time_base:v': 'demux',
+    }
+    profile = PROFILES.get(reference['vcodec'], {}).get(reference.get('profile'))
+    if profile:
+        output_args['profile:v'] = profile
+    level = reference.get('level')
+    if encoder == 'libx264':
+        if level and level > 0:
+            output_args['level:v'] = f"{level / 10:.1f}"
+        output_args['x264-params'] = 'repeat-headers=1'
+    elif encoder == 'libx265':
+        x265_params = 'repeat-headers=1'
+        if level and level > 0:
+            x265_params += f":level-idc={level / 30:.1f}"
+        output_args['x265-params'] = x265_params
+    bitrate = get_video_bitrate(input_video)
+    if type(bitrate) != str:
+        output_args['video_bitrate'] = f"{int(bitrate)}k"
+    return output_args
+
+
+def _encode_range_like(input_video: str, start: float, end: float, reference: dict, output_path: str) -> None:
+    """
+    Re-encode the video stream between start and end with the codec and stream parameters of the source
+    """
+    runner.run(
+        ffmpeg.input(input_video, ss=start).video
+        .output(output_path, bf=0, t=end - start, **_encode_args(input_video, reference))
+        .overwrite_output()
+    )
+
+
+def _encode_cut(input_video: str, start: float, end: float, reference: dict, output_video: str) -> None:
+    """
+    Fallback of the smart cut: the whole range is re-encoded, the audio is copied
+    """
+    input_stream = ffmpeg.input(input_video, ss=start, t=end - start)
+    streams = [input_stream.video]
+    output_args = _encode_args(input_video, reference)
+    if reference['acodec'] is not None:
+        streams.append(input_stream.audio)
+        output_args['acodec'] = 'copy'
+    runner.run(ffmpeg.output(*streams, output_video, **output_args).overwrite_output())
+
+
+def decodes_cleanly(video_path: str, expected_frames: int | None = None, start: float = 0.0,
+                    duration: float | None = None) -> bool:
+    """
+    :param expected_frames: number of frames of the range, one frame of difference is tolerated
+    :param start: start of the range in seconds, decoded from the keyframe before it
+    :param duration: duration of the range, until the end of the video if None
+    :return: whether the video stream decodes without any error over the range
+    """
+    args = ['ffmpeg', '-nostdin', '-hide_banner', '-v', 'error', '-xerror']
+    if start > 0:
+        args += ['-ss', str(start)]
+    # every decoded frame is counted, even with a timestamp equal to the previous one
+    args += ['-i', video_path, '-map', '0:v:0', '-fps_mode', 'passthrough']
+    # on the decoded frames: as an input option, -t lets the frames buffered by the decoder through
+    if duration is not None:
+        args += ['-t', str(duration)]
+    args += ['-f', 'framecrc', '-']
+    try:
+        out, err = runner.run(args, capture_stdout=True, capture_stderr=True)
+    except ffmpeg.Error:
+        return False
+    if (err or b'').strip():
+        return False
+    frames = sum(1 for line in out.splitlines() if line and not line.startswith(b'#'))
+    return expected_frames is None or abs(frames - expected_frames) <= 1
+
+
 def video_upscale(input_video: str, factor: int) -> str:
     """
     Multiply the resolution of a video
@@ -194,7 +414,7 @@ def video_upscale(input_video: str, factor: int) -> str:
         output = ffmpeg.output(video, audio, output_video, acodec='copy')
         output = ffmpeg.overwrite_output(output)
 
-        ffmpeg.run(output)
+        runner.run(output)
 
         return output_video
 
@@ -204,16 +424,110 @@ def video_upscale(input_video: str, factor: int) -> str:
         return f"Error during video upscaling: {str(e)}"
 
 
+# ffmpeg format name of the containers, to know if a file has to be remuxed
+CONTAINER_FORMATS = {'.mp4': 'mp4', '.mov': 'mov', '.mkv': 'matroska', '.webm': 'webm', '.avi': 'avi'}
+
+
+# past participle of each action, for the results
+DECISION_NAMES = {'skip': 'skipped', 'remux': 'remuxed', 'encode': 'encoded'}
+
+
+@dataclass
+class CompressionDecision:
+    """What video_compress does with a video, and why"""
+    action: str  # "skip" (already compliant), "remux" (only the container changes) or "encode"
+    reason: str
+
+    def __str__(self) -> str:
+        return f"{DECISION_NAMES[self.action]}: {self.reason}"
+
+
+def compression_decision(info: dict, output_ext: str, target_bitrate: int, min_resolution: int, family: str,
+                         quality: int | None = None) -> CompressionDecision:
+    """
+    Decide from the probed metadata if a video has to be compressed
+    :param info: ffprobe output of the video
+    :param output_ext: extension of the output file
+    :param target_bitrate: target video bitrate in kbps
+    :param min_resolution: maximum size of the short side
+    :param family: codec family of the output (hevc, h264, vp9...)
+    :param quality: constant quality, the bitrate isn't checked if set
+    """
+    video_stream = get_stream(info, 'video')
+    if video_stream is None:
+        return CompressionDecision("encode", "no video stream found")
+    codec = video_stream.get('codec_name')
+    width, height = int(video_stream.get('width', 0)), int(video_stream.get('height', 0))
+
+    if min(width, height) > min_resolution:
+        return CompressionDecision("encode", f"{width}x{height} > {min_resolution}p")
+    if codec != family:
+        return CompressionDecision("encode", f"{codec} -> {family}")
+
+    description = f"{codec} {width}x{height}"
+    if quality is None:
+        bitrate = video_stream.get('bit_rate')
+        if not bitrate:
+            # whole file minus the audio
+            audio_stream = get_stream(info, 'audio') or {}
+            try:
+                bitrate = float(info['format']['bit_rate']) - float(audio_stream.get('bit_rate') or 0)
+            except (KeyError, ValueError):
+                return CompressionDecision("encode", "bitrate unknown")
+        bitrate = float(bitrate) / 1000
+        if bitrate > target_bitrate:
+            return CompressionDecision("encode", f"{bitrate:.0f} kb/s > {target_bitrate} kb/s")
+        description += f" {bitrate:.0f} kb/s <= {target_bitrate} kb/s"
+
+    container = CONTAINER_FORMATS.get(output_ext.lower())
+    if container is not None and container not in info.get('format', {}).get('format_name', '').split(','):
+        return CompressionDecision("remux", f"already {description}, container -> {container}")
+    return CompressionDecision("skip", f"already {description}")
+
+
+def plan_compression(video_path: str, output_filename: str = "", target_bitrate: int = 8000,
+                     min_resolution: int = 1080, vcodec: str = "hevc", speed_tier: str | None = None,
+                     quality: int | None = None) -> CompressionDecision | None:
+    """
+    decision video_compress takes for a video, same arguments as video_compress
+    :return: None if the video can't be probed, video_compress returns the error
+    """
+    if not is_video(video_path):
+        return None
+    if output_filename == "":
+        output_filename = os.path.splitext(video_path)[0] + f"__compressed.mp4"
+    try:
+        info = probe(video_path)
+        encoder = resolve_encoder(vcodec)
+    except Exception:
+        return None
+    return compression_decision(info, os.path.splitext(output_filename)[1], int(target_bitrate), int(min_resolution),
+                                encoder.family, quality)
+
+
+def _remux(video_path: str, output_filename: str) -> None:
+    output = ffmpeg.output(ffmpeg.input(video_path), output_filename, c='copy', map=0, movflags='+faststart')
+    runner.run(output.overwrite_output(), quiet=True)
+
+
 def video_compress(video_path: str, output_filename: str = "", target_bitrate: int = 8000,
-                   min_resolution: int = 1080, vcodec: str = "hevc_nvenc") -> str:
+                   min_resolution: int = 1080, vcodec: str = "hevc", speed_tier: str | None = None,
+                   quality: int | None = None) -> str:
     """
-    Convert video to 1080p with CUDA acceleration while keeping aspect ratio
+    Compress a video with the fastest working encoder of the codec family, the short side is brought down
+    to min_resolution while keeping aspect ratio.
+    Videos already in the codec, under the target bitrate and resolution are skipped, or remuxed if only
+    the container changes.
 
     :param video_path: path to the input video file
     :param output_filename: path for output file, if not specified adds __compressed to filename
     :param target_bitrate: target bitrate in kbps (default: 8000)
     :param min_resolution: minimum resolution
-    :return: path to the output video file or original path if no compression needed
+    :param vcodec: codec family (hevc, h264, vp9) or encoder, resolved by the encoder registry
+    :param speed_tier: fast, balanced or archive, preset of the encoder (default: Params)
+    :param quality: constant quality (CRF scale, lower is better) instead of target_bitrate
+    :return: path to the output video file, the input if skipped, or an error message
+        (see plan_compression for the decision)
     """
     if not is_video(video_path):
         return f"Error: Not a video file"
@@ -228,51 +542,79 @@ def video_compress(video_path: str, output_filename: str = "", target_bitrate: i
         if height is None:
             return width
 
-        # Check if compression is needed
-        if width >= min_resolution or height >= min_resolution:
-            if output_filename == "":
-                output_filename = os.path.splitext(video_path)[0] + f"__compressed.mp4"
-
-            # CUDA acceleration
-            input_stream = ffmpeg.input(video_path, hwaccel='cuda')
+        if output_filename == "":
+            output_filename = os.path.splitext(video_path)[0] + f"__compressed.mp4"
+
+        encoder = resolve_encoder(vcodec)
+        decision = compression_decision(probe(video_path), os.path.splitext(output_filename)[1],
+                                        target_bitrate, min_resolution, encoder.family, quality)
+        if decision.action == "skip":
+            print(f"{os.path.basename(video_path)} {decision}")
+            return video_path
+        if decision.action == "remux":
+            try:
+                _remux(video_path, output_filename)
+                return output_filename
+            except ffmpeg.Error as e:
+                print(f"Remux of {os.path.basename(video_path)} failed, encoding: {e.stderr}")
 
-            # scaling based on orientation
+        # scaling based on orientation, never upscaled
+        filters = []
+        if min(width, height) > min_resolution:
             if width > height:
-                video = input_stream.video.filter('scale', -2, min_resolution)
+                filters.append(('scale', -2, min_resolution))
             else:
-                video = input_stream.video.filter('scale', min_resolution, -2)
-
-            audio = input_stream.audio
-
-            output = ffmpeg.output(
-                video,
-                audio,
-                output_filename,
-                vcodec=vcodec,
-                video_bitrate=f'{target_bitrate}k',
-                acodec='copy',
-                pix_fmt='yuv420p',
-                **{'stats': None, 'progress': 'pipe:1'}  # Force progress output
-            )
+                filters.append(('scale', min_resolution, -2))
 
-            output = ffmpeg.overwrite_output(output)
+        if quality is not None:
+            rate_args = encoder.quality_args(int(quality))
+        else:
+            rate_args = {'video_bitrate': f'{target_bitrate}k'}
+        video_args = {**encoder.output_args(speed_tier or Params().get_speed_tier()), **rate_args,
+                      'pix_fmt': 'yuv420p'}
+
+        # long video and idle cores: segments encoded in parallel
+        segments = chunked_segments(video_path, duration, encoder)
+        if segments:
+            print(f"Compressing {os.path.basename(video_path)} in {len(segments)} segments")
+            encode_in_segments(video_path, output_filename, duration, segments, video_args, {'acodec': 'copy'},
+                               encoder.input_args(), filters)
+            return output_filename
+
+        # hardware decoding when the encoder runs on the same hardware
+        input_stream = ffmpeg.input(video_path, **encoder.input_args())
+
+        video = input_stream.video
+        for name, *args in filters:
+            video = video.filter(name, *args)
+
+        audio = input_stream.audio
+
+        output = ffmpeg.output(
+            video,
+            audio,
+            output_filename,
+            **video_args,
+            acodec='copy',
+            **ffmpeg_threads(),
+            **{'stats': None, 'progress': 'pipe:1'}  # Force progress output
+        )
 
-            print(f"Compressing {os.path.basename(video_path)} to {os.path.basename(output_filename)}")
-            process = ffmpeg.run_async(output, pipe_stdout=True)
+        output = ffmpeg.overwrite_output(output)
 
-            progress_bar(duration, process)
+        print(f"Compressing {os.path.basename(video_path)} to {os.path.basename(output_filename)}")
+        process = runner.run_async(output, pipe_stdout=True)
 
-            # Wait for process to finish
-            return_code = process.wait()
+        progress_bar(duration, process, os.path.basename(video_path))
 
-            if return_code == 0:
-                sys.stdout.write("\n")
-                print(f"Compression completed successfully")
-                return output_filename
-            else:
-                return f"\nCompression failed with return code {return_code}"
+        # Wait for process to finish
+        return_code = process.wait()
+
+        if return_code == 0:
+            print(f"Compression completed successfully")
+            return output_filename
         else:
-            return f"{video_path} is already < to {min_resolution}."
+            return f"\nCompression failed with return code {return_code}"
 
     except ffmpeg.Error as e:
         return f"ffmpeg error: {e.stderr.decode() if hasattr(e.stderr, 'decode') else e.stderr}"
@@ -280,11 +622,57 @@ def video_compress(video_path: str, output_filename: str = "", target_bitrate: i
         return f"Error: {str(e)}"
 
 
+# software encoder used to produce a stream with the same codec as a probed one
+VIDEO_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265', 'vp9': 'libvpx-vp9', 'vp8': 'libvpx', 'av1': 'libaom-av1',
+                  'mpeg4': 'mpeg4'}
+# software encoder used to produce an audio stream with the same codec as a probed one
+AUDIO_ENCODERS = {'aac': 'aac', 'mp3': 'libmp3lame', 'opus': 'libopus', 'vorbis': 'libvorbis', 'ac3': 'ac3'}
+# keys of stream_signature describing each stream
+VIDEO_SIGNATURE = ('vcodec', 'profile', 'level', 'width', 'height', 'pix_fmt', 'time_base', 'r_frame_rate')
+AUDIO_SIGNATURE = ('acodec', 'sample_rate', 'channels', 'channel_layout')
+# ffprobe profile names -> encoder profiles
+PROFILES = {
+    'h264': {'Constrained Baseline': 'baseline', 'Baseline': 'baseline', 'Main': 'main', 'High': 'high',
+             'High 10': 'high10', 'High 4:2:2': 'high422', 'High 4:4:4 Predictive': 'high444'},
+    'hevc': {'Main': 'main', 'Main 10': 'main10', 'Main Still Picture': 'mainstillpicture'},
+}
+# parameter sets of a copied range written before each keyframe,
+# the concat demuxer already does it for h264 (auto_convert)
+ANNEXB_FILTERS = {'hevc': 'hevc_mp4toannexb'}
+
+
+def stream_signature(video_path: str) -> dict:
+    """
+    Parameters that must be identical for two videos to be joined without re-encoding
+    :param video_path: path to the video file
+    :return: codec, profile, level, resolution, pixel format, timebase, frame rate and audio layout
+    """
+    info = probe(video_path)
+    video_stream = get_stream(info, 'video') or {}
+    audio_stream = get_stream(info, 'audio') or {}
+    return {
+        'vcodec': video_stream.get('codec_name'),
+        'profile': video_stream.get('profile'),
+        'level': video_stream.get('level'),
+        'width': video_stream.get('width'),
+        'height': video_stream.get('height'),
+        'pix_fmt': video_stream.get('pix_fmt'),
+        'time_base': video_stream.get('time_base'),
+        'r_frame_rate': video_stream.get('r_frame_rate'),
+        'acodec': audio_stream.get('codec_name'),
+        'sample_rate': audio_stream.get('sample_rate'),
+        'channels': audio_stream.get('channels'),
+        'channel_layout': audio_stream.get('channel_layout')
+    }
+
+
 def videos_concat(videos: list[str]) -> str:
     """
-    Concatenate multiple video files using FFmpeg's concat protocol
+    Concatenate multiple video files
 
-    This method is especially useful for concatenating files with different codecs.
+    If every input has the same codecs and stream parameters as the first one, they are joined with
+    the concat demuxer without re-encoding. Otherwise the streams of the other inputs that don't match are
+    re-encoded with the parameters of the first one before being joined the same way.
 
     :param videos: list of video paths
     :return: path to the output concatenated video file
@@ -296,39 +684,230 @@ def videos_concat(videos: list[str]) -> str:
     output_video = f"{base_name}__concat.mp4"
 
     try:
-        # Create intermediate inputs
-        inputs = [ffmpeg.input(video) for video in videos]
+        signatures = [stream_signature(video) for video in videos]
+    except ffmpeg.Error as e:
+        return f"ffmpeg error: {e.stderr.decode() if hasattr(e.stderr, 'decode') else e.stderr}"
+
+    reference = signatures[0]
+    conform_all = False
+    if all(signature == reference for signature in signatures):
+        list_path = write_concat_list([(video, None, None) for video in videos])
+        try:
+            runner.run(
+                ffmpeg.input(list_path, format='concat', safe=0)
+                .output(output_video, c='copy')
+                .overwrite_output()
+            )
+            return output_video
+        except ffmpeg.Error as e:
+            print(f"Concatenation without re-encoding failed, re-encoding everything: {e}")
+            conform_all = True
+        finally:
+            os.unlink(list_path)
 
-        # Create separate video and audio streams for each input
-        video_streams = [input.video for input in inputs]
-        audio_streams = [input.audio for input in inputs]
+    return _concat_reencode(videos, signatures, output_video, conform_all)
 
-        # Concatenate streams
-        joined_video = ffmpeg.concat(*video_streams, v=1, a=0)
-        joined_audio = ffmpeg.concat(*audio_streams, v=0, a=1)
 
-        # Combine back and output
-        output = ffmpeg.output(joined_video, joined_audio, output_video,
-                               vcodec="libx264", acodec="aac", video_bitrate=f"{get_video_bitrate(videos[0])}k" ,audio_bitrate="192K")
-        output = ffmpeg.overwrite_output(output)
+def _conform_reference(signature: dict) -> dict:
+    """
+    parameters the inputs of a concatenation are re-encoded with: those of the first input,
+    h264 / aac for a codec without software encoder
+    """
+    reference = dict(signature)
+    if reference['vcodec'] not in VIDEO_ENCODERS:
+        reference.update(vcodec='h264', profile=None, level=None, pix_fmt='yuv420p')
+    if reference['acodec'] is not None and reference['acodec'] not in AUDIO_ENCODERS:
+        reference['acodec'] = 'aac'
+    return reference
 
-        ffmpeg.run(output)
+
+def _conform(video: str, signature: dict, reference: dict, conform_all: bool, output_path: str) -> None:
+    """
+    Re-encode the streams of an input of a concatenation that don't match the reference, the others are copied.
+    The picture is scaled into the frame of the reference and padded, an input without audio gets silence.
+    """
+    source = ffmpeg.input(video)
+    streams = []
+    output_args = {}
+    if conform_all or any(signature[key] != reference[key] for key in VIDEO_SIGNATURE):
+        width, height = reference['width'], reference['height']
+        streams.append(
+            source.video
+            .filter('scale', width, height, force_original_aspect_ratio='decrease', force_divisible_by=2)
+            .filter('pad', width, height, '(ow-iw)/2', '(oh-ih)/2')
+            .filter('setsar', 1)
+            .filter('fps', reference['r_frame_rate'])
+        )
+        output_args.update(_encode_args(video, reference))
+    else:
+        streams.append(source.video)
+        output_args['vcodec'] = 'copy'
+
+    if reference['acodec'] is None:
+        # the audio of the other inputs is dropped
+        pass
+    elif conform_all or any(signature[key] != reference[key] for key in AUDIO_SIGNATURE):
+        if signature['acodec'] is None:
+            layout = reference['channel_layout'] or f"{reference['channels']}c"
+            streams.append(ffmpeg.input(f"anullsrc=r={reference['sample_rate']}:cl={layout}", format='lavfi').audio)
+            output_args['shortest'] = None
+        else:
+            streams.append(source.audio)
+        output_args.update(acodec=AUDIO_ENCODERS[reference['acodec']], ar=reference['sample_rate'],
+                           ac=reference['channels'], audio_bitrate="192k")
+    else:
+        streams.append(source.audio)
+        output_args['acodec'] = 'copy'
+    runner.run(ffmpeg.output(*streams, output_path, **output_args).overwrite_output())
+
+
+def _concat_reencode(videos: list[str], signatures: list[dict], output_video: str, conform_all: bool = False) -> str:
+    """
+    Join the videos with the concat demuxer once the inputs that don't match the first one are conformed to it
+    :param conform_all: re-encode every input, the first one included
+    """
+    reference = _conform_reference(signatures[0])
+    temp_dir = tempfile.mkdtemp()
+    try:
+        entries = []
+        for index, (video, signature) in enumerate(zip(videos, signatures)):
+            if conform_all or signature != reference:
+                conformed = os.path.join(temp_dir, f"{index}.mp4")
+                _conform(video, signature, reference, conform_all, conformed)
+                video = conformed
+            entries.append((video, None, None))
+
+        list_path = write_concat_list(entries)
+        try:
+            runner.run(
+                ffmpeg.input(list_path, format='concat', safe=0)
+                .output(output_video, c='copy')
+                .overwrite_output()
+            )
+        finally:
+            os.unlink(list_path)
         return output_video
 
     except Exception as e:
         return f"Error: {str(e)}"
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def parse_segments(times: list[list[str, str]], duration: float) -> list[tuple[float, float]] | str:
+    """
+    :param times: list of [start, end] in format "HH:MM:SS" or seconds, empty start/end means start/end of the video
+    :param duration: duration of the video
+    :return: list of (start, end) in seconds, or error message
+    """
+    segments = []
+    for start, end in times:
+        if not start and not end:
+            continue
+        start_s = to_seconds(start) if start else 0
+        if start_s is None:
+            return f"Syntax error: Start Time: {start}, expected HH:MM:SS or seconds"
+        end_s = to_seconds(end) if end else duration
+        if end_s is None:
+            return f"Syntax error: End Time: {end}, expected HH:MM:SS or seconds"
+        end_s = min(end_s, duration)
+        if start_s >= end_s:
+            return f"Error: Start Time ({start_s}) >= End Time ({end_s})"
+        segments.append((float(start_s), float(end_s)))
+
+    if not segments:
+        return "Error: No segment provided"
+    return segments
+
+
+def is_on_keyframe(time: float, keyframes: list[float], tolerance: float = 0.001) -> bool:
+    """
+    :param keyframes: sorted keyframe times (see get_keyframes)
+    """
+    i = bisect.bisect_left(keyframes, time - tolerance)
+    return i < len(keyframes) and keyframes[i] <= time + tolerance
 
 
 def multiple_cuts_plus_concatenate(video_path: str, times: list[list[str, str]]) -> str:
-    video_paths = []
-    padding = len(str(len(times)))
-    for i, (start, end) in enumerate(times):
-        path = video_cut(video_path, start, end)
-        if os.path.exists(path):
-            new_name = os.path.splitext(path)[0] + f"__{i:0{padding}}.mp4"
-            os.rename(path, new_name)
-            video_paths.append(new_name)
+    """
+    Cut several segments of a video and concatenate them, in a single ffmpeg run:
+    stream copy with the concat demuxer if every segment starts on a keyframe,
+    otherwise one trim/atrim + concat filter graph
+
+    :param video_path: path to the input video file
+    :param times: list of [start, end] in format "HH:MM:SS" or seconds
+    :return: path to the output video file
+    """
+    if not is_video(video_path):
+        return f"Error: Not a video file"
+
+    duration = get_video_duration(video_path)
+    if type(duration) == str:
+        return duration
+
+    segments = parse_segments(times, duration)
+    if type(segments) == str:
+        return segments
+
+    output_video = os.path.splitext(video_path)[0] + "__cut_concat.mp4"
+
+    try:
+        keyframes = get_keyframes(video_path)
+    except ffmpeg.Error:
+        keyframes = []
+
+    try:
+        if keyframes and all(is_on_keyframe(start, keyframes) for start, _ in segments):
+            _concat_copy_segments(video_path, segments, output_video)
         else:
-            # error during cut
-            return f"Error with parameters:\nstart={start}\nend={end}\n" + path
-    return videos_concat(video_paths)
+            return _concat_filter_segments(video_path, segments, output_video)
+        return output_video
+    except ffmpeg.Error as e:
+        return f"ffmpeg error: {e.stderr.decode() if hasattr(e.stderr, 'decode') else e.stderr}"
+
+
+def _concat_copy_segments(video_path: str, segments: list[tuple[float, float]], output_video: str) -> None:
+    list_path = write_concat_list([(video_path, start, end) for start, end in segments])
+    try:
+        runner.run(
+            ffmpeg.input(list_path, format='concat', safe=0)
+            .output(output_video, c='copy')
+            .overwrite_output()
+        )
+    finally:
+        os.unlink(list_path)
+
+
+def _concat_filter_segments(video_path: str, segments: list[tuple[float, float]], output_video: str) -> str:
+    info = probe(video_path)
+    has_audio = get_stream(info, 'audio') is not None
+    stream = ffmpeg.input(video_path)
+
+    parts = []
+    for start, end in segments:
+        parts.append(stream.video.trim(start=start, end=end).setpts('PTS-STARTPTS'))
+        if has_audio:
+            parts.append(stream.audio.filter('atrim', start=start, end=end).filter('asetpts', 'PTS-STARTPTS'))
+    joined = ffmpeg.concat(*parts, v=1, a=1 if has_audio else 0).node
+
+    output_args = {
+        'vcodec': 'libx264',
+        'stats': None,
+        'progress': 'pipe:1'
+    }
+    bitrate = get_video_bitrate(video_path)
+    if type(bitrate) != str:
+        output_args['video_bitrate'] = f"{int(bitrate)}k"
+    if has_audio:
+        output = ffmpeg.output(joined[0], joined[1], output_video, acodec='aac', audio_bitrate='192k', **output_args)
+    else:
+        output = ffmpeg.output(joined[0], output_video, **output_args)
+    output = ffmpeg.overwrite_output(output)
+
+    process = runner.run_async(output, pipe_stdout=True)
+    progress_bar(sum(end - start for start, end in segments), process, os.path.basename(output_video))
+    return_code = process.wait()
+
+    if return_code == 0:
+        return output_video
+    return f"Cut and concatenate failed with return code {return_code}"
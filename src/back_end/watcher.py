@@ -0,0 +1,180 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+
+from back_end.audio_manip import audio_replace, is_audio
+from back_end.discovery import is_output
+from back_end.media_converter import convert_media
+from back_end.scheduler import BatchScheduler, Job, format_result
+from back_end.video_manip import video_compress, plan_compression, is_video
+from toolbox.Parameters import Params
+from toolbox.utils import pick_audios
+
+WATCH_OPERATIONS = ["compress", "convert", "replace"]
+# result lines kept by a watcher, the oldest are dropped
+RESULTS_KEPT = 1000
+
+
+class FolderWatcher:
+    """
+    Watch folders for new or modified media files, with stat snapshots taken every interval seconds.
+    A file is processed once its size and modification time haven't changed for settle_time seconds.
+    Jobs go through the batch scheduler, so the job journal prevents processing a file twice.
+    Each poll submits its files as a batch run in its own thread: the folders are still scanned while it runs.
+    """
+
+    def __init__(self, folders: list[str], operation: str, options: dict | None = None,
+                 interval: float = 5.0, settle_time: float = 10.0):
+        """
+        :param folders: folders to watch, not recursive
+        :param operation: one of WATCH_OPERATIONS
+        :param options: parameters of the operation:
+            compress: bitrate, min_res, vcodec, speed_tier, quality; convert: ext; replace: audio_dir, randomize
+        :param interval: seconds between two snapshots
+        :param settle_time: seconds without change before a file is processed
+        """
+        if operation not in WATCH_OPERATIONS:
+            raise Exception(f"Unknown operation: {operation}")
+        self.folders = folders
+        self.operation = operation
+        self.options = options or {}
+        self.interval = interval
+        self.settle_time = settle_time
+        self.results = deque(maxlen=RESULTS_KEPT)
+        # path -> (size, mtime_ns, time of the last change)
+        self._snapshot = {}
+        # path -> (size, mtime_ns) already submitted
+        self._submitted = {}
+        self._outputs = set()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # threads of the batches still running
+        self._batches = []
+
+    def _is_candidate(self, path: str) -> bool:
+        name = os.path.basename(path)
+        if is_output(name) or path in self._outputs:
+            return False
+        if self.operation == "convert":
+            ext = self.options.get("ext", "")
+            return (is_video(path) or is_audio(path)) and not name.lower().endswith("." + ext)
+        return is_video(path)
+
+    def scan(self, now: float | None = None) -> list[str]:
+        """
+        take a stat snapshot of the folders
+        :return: files that stopped changing and are not processed yet
+        """
+        now = time.time() if now is None else now
+        seen = {}
+        for folder in self.folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.is_file() or not self._is_candidate(entry.path):
+                    continue
+                st = entry.stat()
+                previous = self._snapshot.get(entry.path)
+                if previous is not None and previous[:2] == (st.st_size, st.st_mtime_ns):
+                    seen[entry.path] = previous
+                else:
+                    seen[entry.path] = (st.st_size, st.st_mtime_ns, now)
+        self._snapshot = seen
+
+        ready = []
+        for path, (size, mtime_ns, changed) in seen.items():
+            if now - changed >= self.settle_time and self._submitted.get(path) != (size, mtime_ns):
+                ready.append(path)
+        return ready
+
+    def _make_job(self, path: str, audio: str | None) -> Job:
+        if self.operation == "compress":
+            output_folder = os.path.join(os.path.dirname(path), "output")
+            os.makedirs(output_folder, exist_ok=True)
+            output = os.path.join(output_folder, os.path.basename(path))
+            return Job(video_compress, (path, output, self.options.get("bitrate", 8000),
+                                        int(self.options.get("min_res", 1080)),
+                                        self.options.get("vcodec", "hevc"),
+                                        self.options.get("speed_tier") or Params().get_speed_tier(),
+                                        self.options.get("quality")),
+                       path=path, operation="compress", describe=plan_compression)
+        if self.operation == "convert":
+            return Job(convert_media, (path, self.options["ext"]), path=path, operation="convert")
+        return Job(audio_replace, (path, audio), path=path, operation="replace", inputs=(audio,))
+
+    def poll_once(self) -> list[str]:
+        """
+        scan the folders and submit the ready files, without waiting for their results (see wait)
+        :return: files submitted
+        """
+        ready = self.scan()
+        if not ready:
+            return []
+
+        audios = [None] * len(ready)
+        if self.operation == "replace":
+            audio_dir = self.options["audio_dir"]
+            audio_list = [os.path.join(audio_dir, file) for file in os.listdir(audio_dir) if is_audio(file)]
+            audios = pick_audios(audio_list, len(ready), self.options.get("randomize", True))
+
+        for path in ready:
+            size, mtime_ns, _ = self._snapshot[path]
+            self._submitted[path] = (size, mtime_ns)
+
+        jobs = [self._make_job(path, audio) for path, audio in zip(ready, audios)]
+        self._batches = [batch for batch in self._batches if batch.is_alive()]
+        # the context carries the cancel scope of the caller to the jobs
+        batch = threading.Thread(target=contextvars.copy_context().run, args=(self._run_batch, ready, jobs),
+                                 daemon=True)
+        batch.start()
+        self._batches.append(batch)
+        return ready
+
+    def _run_batch(self, ready: list[str], jobs: list[Job]) -> None:
+        try:
+            results = BatchScheduler().run_results(jobs)
+        except Exception as e:
+            self.results.append(f"Error: {str(e)}")
+            return
+        for output, _ in results:
+            # a skipped video is its own result
+            if os.path.isfile(output) and output not in ready:
+                self._outputs.add(output)
+        self.results.extend(format_result(output, note) for output, note in results)
+
+    def wait(self) -> None:
+        """
+        wait for the batches submitted so far
+        """
+        for batch in list(self._batches):
+            batch.join()
+
+    def run(self) -> None:
+        """
+        poll until stop is called
+        """
+        while not self._stop_event.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.results.append(f"Error: {str(e)}")
+            self._stop_event.wait(self.interval)
+
+    def start(self) -> None:
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.wait()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
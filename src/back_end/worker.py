@@ -0,0 +1,135 @@
+import contextvars
+import logging
+import os
+import socket
+import threading
+
+from back_end.audio_manip import audio_replace
+from back_end.broker import BrokerClient, DONE, FAILED
+from back_end.media_converter import convert_media
+from back_end.scheduler import thread_share
+from back_end.video_manip import video_compress
+from toolbox.Parameters import Params
+from toolbox.ProgressBar import ProgressHub, JobProgress
+
+# back end functions run for the broker, by name (see broker.REMOTE_OPERATIONS)
+OPERATIONS = {
+    "video_compress": video_compress,
+    "convert_media": convert_media,
+    "audio_replace": audio_replace,
+}
+
+# seconds between two polls of an empty queue, and between two progress reports (they renew the lease)
+POLL_INTERVAL = 2.0
+HEARTBEAT_INTERVAL = 10.0
+
+logger = logging.getLogger("worker")
+
+
+class _BrokerSink:
+    """
+    progress sink of the ProgressHub, keeps the progress of the ffmpeg job run by each slot of the worker
+    the broker job is carried by the context of the slot, to the threads its operation starts (chunked encodes)
+    """
+
+    def __init__(self):
+        self.progress = {}
+        self._current = contextvars.ContextVar("broker_job", default=None)
+
+    def set_job(self, job_id: int | None) -> contextvars.Token:
+        if job_id is not None:
+            self.progress[job_id] = 0.0
+        return self._current.set(job_id)
+
+    def reset_job(self, token: contextvars.Token) -> None:
+        self._current.reset(token)
+
+    def update(self, hub: ProgressHub, job: JobProgress) -> None:
+        job_id = self._current.get()
+        if job_id is not None:
+            self.progress[job_id] = job.fraction
+
+    def job_finished(self, hub: ProgressHub, job: JobProgress) -> None:
+        pass
+
+
+class Worker:
+    """
+    Run the jobs of a broker: each slot pulls a job, runs it with its share of the cores and reports the result.
+    The progress of the running jobs is sent every HEARTBEAT_INTERVAL seconds.
+    """
+
+    def __init__(self, broker_url: str, slots: int | None = None, name: str | None = None,
+                 poll_interval: float = POLL_INTERVAL, heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        """
+        :param slots: number of jobs run at once, default: max workers of the options
+        :param name: name of the worker in the broker, default: host name and pid
+        """
+        self.client = BrokerClient(broker_url)
+        self.slots = slots or Params().get_max_workers()
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.done_count = 0
+        self._done_lock = threading.Lock()
+        self._sink = _BrokerSink()
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        """
+        run until stop is called
+        """
+        ProgressHub().add_sink(self._sink)
+        threads = [threading.Thread(target=self._run_slot, name=f"{self.name}-{i}", daemon=True)
+                   for i in range(self.slots)]
+        threads.append(threading.Thread(target=self._heartbeat, name=f"{self.name}-heartbeat", daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        finally:
+            ProgressHub().remove_sink(self._sink)
+
+    def _run_slot(self) -> None:
+        threads = max(1, (os.cpu_count() or 1) // self.slots)
+        while not self._stop.is_set():
+            try:
+                job = self.client.claim(self.name, list(OPERATIONS))
+            except OSError as e:
+                logger.warning(f"{self.name}: broker unreachable: {str(e)}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            with thread_share(threads):
+                self._execute(job)
+
+    def _execute(self, job: dict) -> None:
+        token = self._sink.set_job(job["id"])
+        try:
+            res = OPERATIONS[job["operation"]](*job["args"], **job["kwargs"])
+        except Exception as e:
+            res = f"Error: {str(e)}"
+        finally:
+            self._sink.reset_job(token)
+        self._sink.progress.pop(job["id"], None)
+        status = DONE if isinstance(res, str) and os.path.isfile(res) else FAILED
+        try:
+            if not self.client.finish(job["id"], self.name, str(res), status):
+                logger.warning(f"{self.name}: job {job['id']} was given to another worker")
+        except OSError as e:
+            logger.warning(f"{self.name}: result of job {job['id']} lost: {str(e)}")
+        with self._done_lock:
+            self.done_count += 1
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(self.heartbeat_interval):
+            for job_id, progress in list(self._sink.progress.items()):
+                try:
+                    self.client.progress(job_id, self.name, progress)
+                except OSError:
+                    pass
@@ -0,0 +1,447 @@
+"""
+Command line interface, usable without the web UI nor a display:
+    python -m cli compress videos/ --recursive --bitrate 4000
+    python -m cli batch manifest.csv
+    python -m cli ui
+to run from src, or with src in PYTHONPATH.
+Each command imports only the back end it needs, gradio and tkinter are only imported by the ui command.
+Exit code: 0 if every job succeeded, 1 if a job failed, 2 on invalid arguments, 130 if interrupted (Ctrl+C).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+MANIFEST_OPERATIONS = ["compress", "convert", "cut", "replace", "combine", "normalize", "sheet"]
+
+
+def report(results: list[str], job_results: list[tuple[str, object]] = ()) -> int:
+    """
+    :param results: result lines of the command, the path of an output or an error message
+    :param job_results: output and note of the batch jobs, whose lines are the output followed by the note
+    """
+    from back_end.scheduler import format_result
+    succeeded = {format_result(output, note) for output, note in job_results if os.path.exists(output)}
+
+    def is_success(result: str) -> bool:
+        return result in succeeded or os.path.exists(result)
+
+    for result in results:
+        print(result, file=sys.stdout if is_success(result) else sys.stderr)
+    return EXIT_OK if all(is_success(result) for result in results) else EXIT_FAILED
+
+
+def split_results(res: str) -> list[str]:
+    return [line for line in res.split('\n') if line]
+
+
+def to_bool(value) -> bool:
+    return str(value).lower() in ("true", "1", "yes")
+
+
+def cmd_cut(args) -> list[str]:
+    from back_end.video_manip import video_cut
+    return [video_cut(args.input, args.start, args.end, args.smart)]
+
+
+def cmd_cut_concat(args) -> list[str]:
+    from back_end.video_manip import multiple_cuts_plus_concatenate
+    return [multiple_cuts_plus_concatenate(args.input, args.segment)]
+
+
+def cmd_concat(args) -> list[str]:
+    from back_end.video_manip import videos_concat
+    return [videos_concat(args.inputs)]
+
+
+def cmd_compress(args) -> list[str]:
+    from back_end.dir_manip import dir_compress_videos
+    from back_end.files_manip import files_compress_videos
+    res = []
+    files = [path for path in args.inputs if not os.path.isdir(path)]
+    for path in args.inputs:
+        if os.path.isdir(path):
+            res += split_results(dir_compress_videos(path, args.bitrate, args.min_res, args.vcodec, args.recursive,
+                                                     args.include, args.exclude, args.tier, args.crf))
+    if files:
+        res += split_results(files_compress_videos(files, args.bitrate, args.min_res, args.vcodec, args.tier,
+                                                   args.crf))
+    return res
+
+
+def cmd_convert(args) -> list[str]:
+    from back_end.dir_manip import dir_convert_video_to_video
+    from back_end.files_manip import files_convert
+    res = []
+    files = [path for path in args.inputs if not os.path.isdir(path)]
+    for path in args.inputs:
+        if os.path.isdir(path):
+            res += split_results(dir_convert_video_to_video(path, args.ext, args.recursive, args.include,
+                                                            args.exclude))
+    if files:
+        res += split_results(files_convert(files, args.ext))
+    return res
+
+
+def cmd_sheet(args) -> list[str]:
+    from back_end.dir_manip import dir_contact_sheets
+    from back_end.files_manip import files_contact_sheets
+    res = []
+    files = [path for path in args.inputs if not os.path.isdir(path)]
+    for path in args.inputs:
+        if os.path.isdir(path):
+            res += split_results(dir_contact_sheets(path, args.columns, args.rows, args.recursive))
+    if files:
+        res += split_results(files_contact_sheets(files, args.columns, args.rows))
+    return res
+
+
+def cmd_effects(args) -> list[str]:
+    from back_end.dir_manip import dir_apply_effects
+    from back_end.files_manip import files_apply_effects
+    res = []
+    files = [path for path in args.inputs if not os.path.isdir(path)]
+    for path in args.inputs:
+        if os.path.isdir(path):
+            res += split_results(dir_apply_effects(path, args.chain, args.recursive, args.include, args.exclude))
+    if files:
+        res += split_results(files_apply_effects(files, args.chain))
+    return res
+
+
+def cmd_audio(args) -> list[str]:
+    from back_end.audio_manip import is_audio
+    from back_end.discovery import discover
+    from back_end.files_manip import files_audio_combine, files_audio_replace
+    from back_end.video_manip import is_video
+    audios = []
+    for path in args.audio:
+        if os.path.isdir(path):
+            audios += list(discover(path, is_audio, max_depth=0))
+        else:
+            audios.append(path)
+    videos = []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            videos += list(discover(path, is_video, max_depth=None if args.recursive else 0))
+        else:
+            videos.append(path)
+    if not videos:
+        return []
+    files_fn = files_audio_replace if args.command == "replace" else files_audio_combine
+    return split_results(files_fn(videos, audios, not args.in_order))
+
+
+def cmd_normalize(args) -> list[str]:
+    from back_end.audio_manip import normalize_audio
+    output = args.output or os.path.splitext(args.input)[0] + "__normalized" + os.path.splitext(args.input)[1]
+    return [normalize_audio(args.input, output, args.i, args.tp, args.lra)]
+
+
+def format_analysis(path: str, analysis) -> str:
+    silences = ", ".join(f"{start:g}-{end:g}s" for start, end in analysis.silences) or "none"
+    return (f"{path}: {analysis.integrated:.1f} LUFS, LRA {analysis.loudness_range:.1f} LU, "
+            f"true peak {analysis.true_peak:.1f} dBTP, RMS {analysis.rms:.1f} dBFS, silences: {silences}")
+
+
+def cmd_analyze(args) -> list[str]:
+    """
+    the analyses go to stdout, the errors are returned
+    """
+    import time
+    from back_end.audio_manip import measure_loudness
+    from back_end.pcm_analysis import analyze_many
+
+    start = time.perf_counter()
+    analyses = analyze_many(args.inputs)
+    engine_time = time.perf_counter() - start
+    errors = []
+    for path, analysis in analyses.items():
+        if isinstance(analysis, str):
+            errors.append(f"{path}: {analysis}")
+        else:
+            print(format_analysis(path, analysis))
+    if not args.benchmark:
+        return errors
+
+    # one file at a time for both, then loudnorm only, as get_loudness did
+    sequential_time = loudnorm_time = 0.0
+    for path in args.inputs:
+        start = time.perf_counter()
+        analysis = analyze_many([path], max_workers=1)[path]
+        sequential_time += time.perf_counter() - start
+        start = time.perf_counter()
+        stats = measure_loudness(path)
+        loudnorm_time += time.perf_counter() - start
+        engine = f"{analysis.integrated:.2f}" if not isinstance(analysis, str) else "failed"
+        loudnorm = f"{stats['input_i']:.2f}" if stats is not None else "failed"
+        print(f"{path}: engine {engine} LUFS, loudnorm {loudnorm} LUFS")
+    print(f"engine: {sequential_time:.2f}s one at a time, {engine_time:.2f}s concurrently; "
+          f"loudnorm: {loudnorm_time:.2f}s")
+    return errors
+
+
+def cmd_encoders(args) -> list[str]:
+    from back_end.encoders import EncoderRegistry
+    EncoderRegistry().capabilities(refresh=args.refresh)
+    print(EncoderRegistry().summary())
+    return []
+
+
+def load_manifest(path: str) -> list[dict]:
+    """
+    JSON: list of objects, CSV: one row per job with a header
+    each entry has an "operation" (one of MANIFEST_OPERATIONS), an "input" and the options of the operation
+    """
+    with open(path, newline='') as f:
+        if path.lower().endswith(".json"):
+            entries = json.load(f)
+        else:
+            entries = list(csv.DictReader(f))
+    # empty CSV cells are missing options
+    return [{key: value for key, value in entry.items() if value not in ("", None)} for entry in entries]
+
+
+def manifest_job(entry: dict):
+    """
+    :return: scheduler job of a manifest entry
+    """
+    from back_end.scheduler import Job
+    operation = entry.get("operation")
+    path = entry.get("input")
+    if operation not in MANIFEST_OPERATIONS or not path:
+        raise ValueError(f"Invalid manifest entry: {entry}")
+
+    if operation == "compress":
+        from back_end.video_manip import video_compress, plan_compression
+        return Job(video_compress, (path,), {'output_filename': entry.get("output", ""),
+                                             'target_bitrate': int(entry.get("bitrate", 8000)),
+                                             'min_resolution': int(entry.get("min_res", 1080)),
+                                             'vcodec': entry.get("vcodec", "hevc"),
+                                             'speed_tier': entry.get("tier"),
+                                             'quality': int(entry["crf"]) if "crf" in entry else None},
+                   path=path, operation=operation, describe=plan_compression)
+    if operation == "convert":
+        from back_end.media_converter import convert_media
+        return Job(convert_media, (path, entry["ext"]), path=path, operation=operation)
+    if operation == "cut":
+        from back_end.video_manip import video_cut
+        return Job(video_cut, (path, entry.get("start"), entry.get("end"), to_bool(entry.get("smart", False))),
+                   path=path, operation=operation)
+    if operation == "normalize":
+        from back_end.audio_manip import normalize_audio
+        output = entry.get("output") or os.path.splitext(path)[0] + "__normalized" + os.path.splitext(path)[1]
+        return Job(normalize_audio, (path, output, float(entry.get("i", -16)), float(entry.get("tp", -1.5)),
+                                     float(entry.get("lra", 11))), path=path, operation=operation)
+    if operation == "sheet":
+        from back_end.thumbnails import contact_sheet
+        return Job(contact_sheet, (path, entry.get("output", ""), int(entry.get("columns", 4)),
+                                   int(entry.get("rows", 4))), path=path, operation=operation)
+    from back_end.audio_manip import audio_combine, audio_replace
+    return Job(audio_replace if operation == "replace" else audio_combine, (path, entry["audio"]),
+               path=path, operation=operation, inputs=(entry["audio"],))
+
+
+def cmd_batch(args) -> list[str]:
+    from back_end.scheduler import BatchScheduler
+    return BatchScheduler().run([manifest_job(entry) for entry in load_manifest(args.manifest)])
+
+
+def cmd_broker(args) -> list[str]:
+    from back_end.broker import BrokerServer
+    from toolbox.Parameters import Params
+    server = BrokerServer(args.db or os.path.join(Params().get_cache_dir(), "broker.sqlite"), args.host, args.port)
+    print(f"Broker listening on {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return []
+
+
+def cmd_worker(args) -> list[str]:
+    from back_end.worker import Worker
+    from toolbox.Parameters import Params
+    broker_url = Params().get_broker_url()
+    if not broker_url:
+        raise ValueError("the worker needs the URL of the broker: --broker http://host:port")
+    worker = Worker(broker_url, args.slots)
+    print(f"Worker {worker.name} ({worker.slots} slots) pulling jobs from {broker_url}", file=sys.stderr)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        from back_end.runner import kill_all
+        worker.stop()
+        kill_all()
+    return []
+
+
+def cmd_ui(args) -> list[str]:
+    import logging
+    from front_end.GradioManager import GradioManager
+    logging.getLogger("asyncio").setLevel(logging.CRITICAL)
+    GradioManager().launch()
+    return []
+
+
+def add_dir_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--recursive", "-r", action="store_true", help="also process the subdirectories")
+    parser.add_argument("--include", action="append", help="glob pattern of the files to process, repeatable")
+    parser.add_argument("--exclude", action="append", help="glob pattern of the files to skip, repeatable")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Media Processing Tool, without the UI")
+    parser.add_argument("--workers", type=int, help="number of parallel jobs (default: saved option)")
+    parser.add_argument("--params", default="save.json", help="options file of the UI (default: save.json)")
+    parser.add_argument("--no-resume", action="store_true", help="redo the jobs already done")
+    parser.add_argument("--no-chunks", action="store_true",
+                        help="encode long videos in one process instead of parallel segments")
+    parser.add_argument("--quiet", "-q", action="store_true", help="no progress bar")
+    parser.add_argument("--broker", help="URL of the job broker running the batches (default: saved option)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("cut", help="cut a video")
+    p.add_argument("input")
+    p.add_argument("--start", help="HH:MM:SS or seconds")
+    p.add_argument("--end", help="HH:MM:SS or seconds")
+    p.add_argument("--smart", action="store_true", help="re-encode only around the cut points")
+    p.set_defaults(fn=cmd_cut)
+
+    p = sub.add_parser("cut-concat", help="cut segments of a video and join them")
+    p.add_argument("input")
+    p.add_argument("--segment", nargs=2, action="append", required=True, metavar=("START", "END"))
+    p.set_defaults(fn=cmd_cut_concat)
+
+    p = sub.add_parser("concat", help="join videos")
+    p.add_argument("inputs", nargs="+")
+    p.set_defaults(fn=cmd_concat)
+
+    p = sub.add_parser("compress", help="compress videos or directories of videos")
+    p.add_argument("inputs", nargs="+")
+    p.add_argument("--bitrate", type=int, default=8000, help="kbps")
+    p.add_argument("--min-res", type=int, default=1080)
+    p.add_argument("--vcodec", default="hevc", help="codec family (hevc, h264, vp9) or encoder")
+    p.add_argument("--tier", choices=["fast", "balanced", "archive"],
+                   help="fast: maximum fps, archive: maximum compression (default: saved option)")
+    p.add_argument("--crf", type=int, help="constant quality (lower is better) instead of the bitrate")
+    add_dir_options(p)
+    p.set_defaults(fn=cmd_compress)
+
+    p = sub.add_parser("convert", help="convert medias or directories of videos")
+    p.add_argument("inputs", nargs="+")
+    p.add_argument("--ext", required=True, help="extension of the outputs: mp4, mkv, mp3...")
+    add_dir_options(p)
+    p.set_defaults(fn=cmd_convert)
+
+    for name, help_text in (("replace", "replace the audio of videos"), ("combine", "mix an audio with videos")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("inputs", nargs="+", help="videos or directories of videos")
+        p.add_argument("--audio", nargs="+", required=True, help="audios or a directory of audios")
+        p.add_argument("--in-order", action="store_true", help="use the audios in order instead of randomly")
+        p.add_argument("--recursive", "-r", action="store_true", help="also process the subdirectories")
+        if name == "combine":
+            p.add_argument("--mix", choices=["ffmpeg", "numpy"],
+                           help="numpy: mix in process, without intermediate file (default: saved option)")
+        p.set_defaults(fn=cmd_audio)
+
+    p = sub.add_parser("normalize", help="two-pass loudness normalization")
+    p.add_argument("input")
+    p.add_argument("--output")
+    p.add_argument("--i", type=float, default=-16, help="integrated loudness target (LUFS)")
+    p.add_argument("--tp", type=float, default=-1.5, help="true peak (dBTP)")
+    p.add_argument("--lra", type=float, default=11, help="loudness range (LU)")
+    p.set_defaults(fn=cmd_normalize)
+
+    p = sub.add_parser("effects", help="apply an audio effect chain in one pass to medias or directories")
+    p.add_argument("inputs", nargs="+")
+    p.add_argument("--chain", required=True,
+                   help='effects and their arguments, ex: "reverb, pitch=0.8, eq=100:-3:1, gain=-2, fade_out=2"')
+    add_dir_options(p)
+    p.set_defaults(fn=cmd_effects)
+
+    p = sub.add_parser("analyze", help="loudness, true peak, RMS and silences of medias")
+    p.add_argument("inputs", nargs="+")
+    p.add_argument("--benchmark", action="store_true", help="compare the time and the loudness with loudnorm")
+    p.set_defaults(fn=cmd_analyze)
+
+    p = sub.add_parser("sheet", help="keyframe contact sheets of videos or directories of videos")
+    p.add_argument("inputs", nargs="+")
+    p.add_argument("--columns", type=int, default=4)
+    p.add_argument("--rows", type=int, default=4)
+    p.add_argument("--recursive", "-r", action="store_true", help="also process the subdirectories")
+    p.set_defaults(fn=cmd_sheet)
+
+    p = sub.add_parser("batch", help="run the jobs of a JSON or CSV manifest in parallel")
+    p.add_argument("manifest")
+    p.set_defaults(fn=cmd_batch)
+
+    p = sub.add_parser("encoders", help="show the encoder used for each codec family")
+    p.add_argument("--refresh", action="store_true", help="detect the encoders again")
+    p.set_defaults(fn=cmd_encoders)
+
+    p = sub.add_parser("broker", help="run the job broker the batches are submitted to")
+    p.add_argument("--host", default="127.0.0.1", help="0.0.0.0 to accept the workers of other machines")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--db", help="queue file (default: broker.sqlite in the cache directory)")
+    p.set_defaults(fn=cmd_broker)
+
+    p = sub.add_parser("worker", help="run the jobs of the broker given by --broker")
+    p.add_argument("--slots", type=int, help="jobs run at once (default: max workers option)")
+    p.set_defaults(fn=cmd_worker)
+
+    p = sub.add_parser("ui", help="launch the web UI")
+    p.set_defaults(fn=cmd_ui)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    from toolbox.Parameters import Params
+    params = Params()
+    params.load_params_from_json(args.params)
+    if args.workers is not None:
+        params.params_dict["max_workers"] = args.workers
+    if args.no_resume:
+        params.params_dict["resume_batches"] = False
+    if args.no_chunks:
+        params.params_dict["chunked_encoding"] = False
+    if args.broker is not None:
+        params.params_dict["broker_url"] = args.broker
+    if getattr(args, "mix", None) is not None:
+        params.params_dict["mix_backend"] = args.mix
+
+    # stdout only gets the results, the progress bar goes to stderr
+    from toolbox.ProgressBar import ProgressHub, TerminalSink
+    hub = ProgressHub()
+    for sink in [sink for sink in hub.sinks if isinstance(sink, TerminalSink)]:
+        hub.remove_sink(sink)
+    if not args.quiet:
+        hub.add_sink(TerminalSink(sys.stderr))
+
+    from back_end.scheduler import collect_results
+    try:
+        with collect_results() as job_results:
+            results = args.fn(args)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return EXIT_USAGE
+    except KeyboardInterrupt:
+        # the ffmpeg processes run in their own process group, Ctrl+C doesn't reach them
+        from back_end.runner import kill_all
+        kill_all()
+        return EXIT_INTERRUPTED
+    return report(results, job_results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
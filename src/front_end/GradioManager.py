@@ -1,19 +1,27 @@
 import datetime
+import inspect
 import signal
 import sys
+from contextlib import nullcontext, aclosing
 
 import gradio as gr
 
 from middle_end.directory import *
 from middle_end.single_file import *
 from middle_end.multiple_files import *
+from back_end.encoders import EncoderRegistry, SPEED_TIERS
+from back_end.runner import kill_all, run_operation, run_generator
+from back_end.scheduler import BatchScheduler
 from front_end.script_js import js
 from toolbox.DraggableListbox import WindowDragListBox
 from toolbox.Parameters import Params
+from toolbox.ProgressBar import ProgressHub, GradioSink
 from toolbox.tkinter_getters import *
 
 
 def on_close(sig, frame):
+    # the ffmpeg processes run in their own process group, they don't get the signal
+    kill_all()
     sys.exit(0)
 
 
@@ -22,26 +30,88 @@ signal.signal(signal.SIGTERM, on_close)
 
 save_path = "save.json"
 
+# codec families are resolved to the fastest working encoder by the encoder registry
+VCODEC_CHOICES = ["hevc", "h264", "vp9", "hevc_nvenc", "h264_nvenc", "libx265", "libx264", "libvpx-vp9"]
+
 params = Params()
 params.load_params_from_json(save_path)
 
 
-def apply_option(max_workers: int, vcodec) -> str:
-    Params.save_params_to_json({"max_workers": max_workers, "vcodec": vcodec}, save_path)
+def apply_option(max_workers: int, vcodec, schedule_order: str, resume_batches: bool, speed_tier: str,
+                 rate_mode: str, quality: str, chunked_encoding: bool, broker_url: str, mix_backend: str) -> str:
+    Params.save_params_to_json({**params.params_dict, "max_workers": max_workers, "vcodec": vcodec,
+                                "schedule_order": schedule_order, "resume_batches": resume_batches,
+                                "speed_tier": speed_tier, "rate_mode": rate_mode, "quality": quality,
+                                "chunked_encoding": chunked_encoding, "broker_url": broker_url.strip(),
+                                "mix_backend": mix_backend}, save_path)
     params.load_params_from_json(save_path)
     return f"Save {datetime.datetime.now()}"
 
 
+def detect_encoders() -> str:
+    EncoderRegistry().capabilities(refresh=True)
+    return EncoderRegistry().summary()
+
+
 def ui_reload():
     return (
         params.get_max_workers(),  # opt_max_workers
         params.get_vcodec(),  # opt_vcodec
+        params.get_schedule_order(),  # opt_schedule_order
+        params.get_resume_batches(),  # opt_resume_batches
+        params.get_speed_tier(),  # opt_speed_tier
+        params.get_rate_mode(),  # opt_rate_mode
+        str(params.get_quality()),  # opt_quality
+        params.get_chunked_encoding(),  # opt_chunked_encoding
+        params.get_broker_url(),  # opt_broker_url
+        params.get_mix_backend(),  # opt_mix_backend
         params.get_vcodec(),  # s_compr_vcodec
         params.get_vcodec(),  # d_compr_vcodec
-        params.get_vcodec()  # m_compr_vcodec
+        params.get_vcodec(),  # m_compr_vcodec
+        params.get_vcodec(),  # d_watch_vcodec
+        params.get_speed_tier(),  # s_compr_speed_tier
+        params.get_rate_mode(),  # s_compr_rate_mode
+        str(params.get_quality()),  # s_compr_quality
+        params.get_speed_tier(),  # d_compr_speed_tier
+        params.get_rate_mode(),  # d_compr_rate_mode
+        str(params.get_quality()),  # d_compr_quality
+        params.get_speed_tier(),  # m_compr_speed_tier
+        params.get_rate_mode(),  # m_compr_rate_mode
+        str(params.get_quality())  # m_compr_quality
     )
 
 
+def with_progress(fn, interactive: bool = False):
+    """
+    wrap a callback so that the progress of its ffmpeg jobs is shown in the UI
+    the callback runs as an async operation: cancelling the event (Stop button, closed tab) kills its processes
+    :param interactive: single file operation, the batch jobs are paused for a while and leave it a worker slot
+    """
+    lane = BatchScheduler().interactive if interactive else nullcontext
+
+    if inspect.isgeneratorfunction(fn):
+        # gradio streams the successive results of generator callbacks
+        async def handler(*args, progress=gr.Progress()):
+            # the sink follows only the jobs of this event, not those of the other sessions
+            scoped = ProgressHub().scoped(fn, GradioSink(progress))
+            with lane():
+                async with aclosing(run_generator(scoped, *args)) as results:
+                    async for res in results:
+                        yield res
+    else:
+        async def handler(*args, progress=gr.Progress()):
+            scoped = ProgressHub().scoped(fn, GradioSink(progress))
+            with lane():
+                return await run_operation(scoped, *args)
+
+    handler.__name__ = fn.__name__
+    return handler
+
+
+def job_latency() -> str:
+    return BatchScheduler().latency_summary()
+
+
 def reorder_list(dataframe):
     try:
         files = [f[0] for f in dataframe]
@@ -69,6 +139,8 @@ class GradioManager:
                                 s_cut_get_v_path = gr.Button("📂", scale=1)
                             s_cut_start_time = gr.Textbox(label="Start Time (HH:MM:SS or seconds)")
                             s_cut_end_time = gr.Textbox(label="End Time (HH:MM:SS) or seconds")
+                            s_cut_smart = gr.Checkbox(label="Frame accurate (re-encode only the cut GOPs)",
+                                                      value=False)
 
                             s_cut_run = gr.Button("Cut Video")
                         with gr.Column():
@@ -76,8 +148,8 @@ class GradioManager:
                             s_cut_video_output = gr.Video(sources=["upload"])
 
                     s_cut_get_v_path.click(get_file, inputs=s_cut_v_path, outputs=s_cut_v_path)
-                    s_cut_run.click(cut_video,
-                                    inputs=[s_cut_v_path, s_cut_start_time, s_cut_end_time],
+                    s_cut_run.click(with_progress(cut_video, interactive=True),
+                                    inputs=[s_cut_v_path, s_cut_start_time, s_cut_end_time, s_cut_smart],
                                     outputs=[s_cut_text_output, s_cut_video_output])
 
                 with gr.Tab("Cut and concatenate"):
@@ -99,7 +171,7 @@ class GradioManager:
                             s_cc_video_output = gr.Video(sources=["upload"])
 
                     s_cc_get_v_path.click(get_file, inputs=s_cc_v_path, outputs=s_cc_v_path)
-                    s_cc_run.click(cut_and_concate,
+                    s_cc_run.click(with_progress(cut_and_concate, interactive=True),
                                    inputs=[s_cc_v_path, s_cc_times],
                                    outputs=[s_cc_text_output, s_cc_video_output])
 
@@ -114,14 +186,17 @@ class GradioManager:
                                                                         "wav",
                                                                         "ogg", "flac"])
                             s_conv_run = gr.Button("Convert")
+                            s_conv_stop = gr.Button("Stop")
                         with gr.Column():
                             s_conv_text_output = gr.Textbox(label="Result", interactive=False)
                             s_conv_a_output = gr.Audio()
                             s_conv_v_output = gr.Video(sources=["upload"])
 
                     s_conv_get_v_path.click(get_file, inputs=s_conv_v_path, outputs=s_conv_v_path)
-                    s_conv_run.click(convert_media_to_media, inputs=[s_conv_v_path, s_conv_chose_ext],
-                                     outputs=[s_conv_text_output, s_conv_v_output, s_conv_a_output])
+                    s_conv_event = s_conv_run.click(with_progress(convert_media_to_media, interactive=True),
+                                                    inputs=[s_conv_v_path, s_conv_chose_ext],
+                                                    outputs=[s_conv_text_output, s_conv_v_output, s_conv_a_output])
+                    s_conv_stop.click(None, cancels=[s_conv_event])
 
                 with gr.Tab("Modify Audio in Video"):
                     with gr.Row():
@@ -140,7 +215,7 @@ class GradioManager:
 
                     s_modif_btn_get_video_path.click(get_file, inputs=s_modif_video_path, outputs=s_modif_video_path)
                     s_modif_btn_get_audio_path.click(get_file, inputs=s_modif_audio_path, outputs=s_modif_audio_path)
-                    s_modif_btn_run.click(modify_audio,
+                    s_modif_btn_run.click(with_progress(modify_audio, interactive=True),
                                           inputs=[s_modif_video_path, s_modif_audio_path, s_modif_chose_opt],
                                           outputs=[s_modif_text_output, s_modif_video_output])
 
@@ -153,14 +228,45 @@ class GradioManager:
                             s_compr_bitrate = gr.Textbox(label="Target bitrate", value="8000")
                             s_compr_min_res = gr.Textbox(label="Minimum resolution", value="1080")
                             s_compr_vcodec = gr.Dropdown(label="Video codec", value=params.get_vcodec(),
-                                                         choices=["hevc_nvenc", "libx264", "libvpx-vp9", "h264_nvenc"])
+                                                         choices=VCODEC_CHOICES)
+                            with gr.Row():
+                                s_compr_speed_tier = gr.Dropdown(label="Speed tier", value=params.get_speed_tier(),
+                                                                 choices=SPEED_TIERS)
+                                s_compr_rate_mode = gr.Dropdown(label="Rate control", value=params.get_rate_mode(),
+                                                                choices=["bitrate", "quality"])
+                                s_compr_quality = gr.Textbox(label="Quality (CRF, lower is better)",
+                                                             value=str(params.get_quality()))
                             s_compr_run = gr.Button("Compress")
+                            s_compr_stop = gr.Button("Stop")
                         with gr.Column():
                             s_cv_output = gr.Textbox(label="Result", interactive=False)
+                            s_cv_video_output = gr.Video(sources=["upload"])
 
                     s_compr_btn_get_v_path.click(get_file, s_compr_v_path, s_compr_v_path)
-                    s_compr_run.click(compress_vid, [s_compr_v_path, s_compr_bitrate, s_compr_min_res, s_compr_vcodec],
-                                      s_cv_output)
+                    s_compr_event = s_compr_run.click(with_progress(compress_vid, interactive=True),
+                                                      [s_compr_v_path, s_compr_bitrate, s_compr_min_res, s_compr_vcodec,
+                                                       s_compr_speed_tier, s_compr_rate_mode, s_compr_quality],
+                                                      [s_cv_output, s_cv_video_output])
+                    s_compr_stop.click(None, cancels=[s_compr_event])
+
+                with gr.Tab("Contact sheet"):
+                    with gr.Row():
+                        with gr.Column():
+                            with gr.Row(equal_height=True):
+                                s_sheet_v_path = gr.Textbox(label="Video Path", scale=8)
+                                s_sheet_btn_get_v_path = gr.Button("📂", scale=1)
+                            with gr.Row():
+                                s_sheet_columns = gr.Textbox(label="Columns", value="4")
+                                s_sheet_rows = gr.Textbox(label="Rows", value="4")
+                            s_sheet_run = gr.Button("Make contact sheet")
+                        with gr.Column():
+                            s_sheet_text_output = gr.Textbox(label="Result", interactive=False)
+                            s_sheet_image_output = gr.Image(type="filepath")
+
+                    s_sheet_btn_get_v_path.click(get_file, s_sheet_v_path, s_sheet_v_path)
+                    s_sheet_run.click(with_progress(video_contact_sheet, interactive=True),
+                                      [s_sheet_v_path, s_sheet_columns, s_sheet_rows],
+                                      [s_sheet_text_output, s_sheet_image_output])
 
             with gr.Tab("Directory"):
                 with gr.Tab("Convert medias"):
@@ -173,13 +279,21 @@ class GradioManager:
                                                                choices=["mp4", "mov", "avi", "webm", "mkv", "mp3",
                                                                         "wav",
                                                                         "ogg", "flac"])
+                            d_conv_recursive = gr.Checkbox(label="Include subdirectories", value=False)
+                            with gr.Row():
+                                d_conv_include = gr.Textbox(label="Include patterns (*.mp4, clips/*)")
+                                d_conv_exclude = gr.Textbox(label="Exclude patterns")
                             d_conv_run = gr.Button("Convert")
+                            d_conv_stop = gr.Button("Stop")
                         with gr.Column():
                             d_conv_output = gr.Textbox(label="Result", interactive=False)
 
                     d_conv_btn_get_v_path.click(get_dir, inputs=d_conv_v_path, outputs=d_conv_v_path)
-                    d_conv_run.click(directory_media2media, inputs=[d_conv_v_path, d_conv_chose_ext],
-                                     outputs=d_conv_output)
+                    d_conv_event = d_conv_run.click(with_progress(directory_media2media),
+                                                    inputs=[d_conv_v_path, d_conv_chose_ext, d_conv_recursive,
+                                                            d_conv_include, d_conv_exclude],
+                                                    outputs=d_conv_output)
+                    d_conv_stop.click(None, cancels=[d_conv_event])
 
                 with gr.Tab("Modify audio"):
                     gr.Markdown("Random choice mapping between videos and audios")
@@ -193,14 +307,16 @@ class GradioManager:
                                 d_modif_btn_get_a_path = gr.Button("📂", scale=1)
                             d_modif_mode_opt = gr.Dropdown(label="Select a mode", choices=["replace", "combine"])
                             d_modif_randomize = gr.Checkbox(label="Random order", value=True)
+                            d_modif_recursive = gr.Checkbox(label="Include subdirectories", value=False)
                             d_modif_run = gr.Button("Batch Modify Audio")
                         with gr.Column():
                             d_modif_output = gr.Textbox(label="Result", interactive=False)
 
                     d_modif_btn_get_v_path.click(get_dir, inputs=d_modif_v_path, outputs=d_modif_v_path)
                     d_modif_btn_get_a_path.click(get_dir, inputs=d_modif_a_path, outputs=d_modif_a_path)
-                    d_modif_run.click(directory_audio_modify,
-                                      inputs=[d_modif_v_path, d_modif_a_path, d_modif_mode_opt, d_modif_randomize],
+                    d_modif_run.click(with_progress(directory_audio_modify),
+                                      inputs=[d_modif_v_path, d_modif_a_path, d_modif_mode_opt, d_modif_randomize,
+                                              d_modif_recursive],
                                       outputs=d_modif_output)
 
                 with gr.Tab("Compress Videos"):
@@ -212,16 +328,113 @@ class GradioManager:
                             d_compr_bitrate = gr.Textbox(label="Bitrate wanted:", value="8000")
                             d_compr_min_res = gr.Textbox(label="Minimum resolution", value="1080")
                             d_compr_vcodec = gr.Dropdown(label="Video codec", value=params.get_vcodec(),
-                                                         choices=["hevc_nvenc", "libx264", "libvpx-vp9", "h264_nvenc"])
+                                                         choices=VCODEC_CHOICES)
+                            with gr.Row():
+                                d_compr_speed_tier = gr.Dropdown(label="Speed tier", value=params.get_speed_tier(),
+                                                                 choices=SPEED_TIERS)
+                                d_compr_rate_mode = gr.Dropdown(label="Rate control", value=params.get_rate_mode(),
+                                                                choices=["bitrate", "quality"])
+                                d_compr_quality = gr.Textbox(label="Quality (CRF, lower is better)",
+                                                             value=str(params.get_quality()))
+                            d_compr_recursive = gr.Checkbox(label="Include subdirectories (mirrored in output)",
+                                                            value=False)
+                            with gr.Row():
+                                d_compr_include = gr.Textbox(label="Include patterns (*.mp4, clips/*)")
+                                d_compr_exclude = gr.Textbox(label="Exclude patterns")
 
                             d_compr_run = gr.Button("Batch compress video")
+                            d_compr_stop = gr.Button("Stop")
                         with gr.Column():
                             d_compr_output = gr.Textbox(label="Result", interactive=False)
 
                     d_compr_btn_get_v_path.click(get_dir, d_compr_v_path, d_compr_v_path)
-                    d_compr_run.click(directory_compress,
-                                      [d_compr_v_path, d_compr_bitrate, d_compr_min_res, d_compr_vcodec],
-                                      d_compr_output)
+                    d_compr_event = d_compr_run.click(with_progress(directory_compress),
+                                                      [d_compr_v_path, d_compr_bitrate, d_compr_min_res, d_compr_vcodec,
+                                                       d_compr_recursive, d_compr_include, d_compr_exclude,
+                                                       d_compr_speed_tier, d_compr_rate_mode, d_compr_quality],
+                                                      d_compr_output)
+                    d_compr_stop.click(None, cancels=[d_compr_event])
+
+                with gr.Tab("Contact sheets"):
+                    with gr.Row():
+                        with gr.Column():
+                            with gr.Row(equal_height=True):
+                                d_sheet_v_path = gr.Textbox(label="Video Directory Path", scale=8)
+                                d_sheet_btn_get_v_path = gr.Button("📂", scale=1)
+                            with gr.Row():
+                                d_sheet_columns = gr.Textbox(label="Columns", value="4")
+                                d_sheet_rows = gr.Textbox(label="Rows", value="4")
+                            d_sheet_recursive = gr.Checkbox(label="Include subdirectories", value=False)
+                            d_sheet_run = gr.Button("Batch contact sheets")
+                        with gr.Column():
+                            d_sheet_output = gr.Textbox(label="Result", interactive=False)
+
+                    d_sheet_btn_get_v_path.click(get_dir, d_sheet_v_path, d_sheet_v_path)
+                    d_sheet_run.click(with_progress(directory_contact_sheets),
+                                      [d_sheet_v_path, d_sheet_columns, d_sheet_rows, d_sheet_recursive],
+                                      d_sheet_output)
+
+                with gr.Tab("Audio effects"):
+                    gr.Markdown("Effect chain applied in one pass, the outputs go to the subdirectory output")
+                    with gr.Row():
+                        with gr.Column():
+                            with gr.Row(equal_height=True):
+                                d_fx_path = gr.Textbox(label="Directory Path", scale=8)
+                                d_fx_btn_get_path = gr.Button("📂", scale=1)
+                            d_fx_effects = gr.Textbox(label="Effects (reverb, deep_voice, pitch, tempo, eq, gain, "
+                                                            "fade_in, fade_out)",
+                                                      placeholder="reverb, pitch=0.8, eq=100:-3, fade_out=2")
+                            d_fx_recursive = gr.Checkbox(label="Include subdirectories", value=False)
+                            with gr.Row():
+                                d_fx_include = gr.Textbox(label="Include patterns (*.mp3, clips/*)")
+                                d_fx_exclude = gr.Textbox(label="Exclude patterns")
+                            d_fx_run = gr.Button("Apply effects")
+                            d_fx_stop = gr.Button("Stop")
+                        with gr.Column():
+                            d_fx_output = gr.Textbox(label="Result", interactive=False)
+
+                    d_fx_btn_get_path.click(get_dir, inputs=d_fx_path, outputs=d_fx_path)
+                    d_fx_event = d_fx_run.click(with_progress(directory_effects),
+                                                inputs=[d_fx_path, d_fx_effects, d_fx_recursive, d_fx_include,
+                                                        d_fx_exclude],
+                                                outputs=d_fx_output)
+                    d_fx_stop.click(None, cancels=[d_fx_event])
+
+                with gr.Tab("Watch folder"):
+                    gr.Markdown("Process new files of a folder once they stop growing")
+                    with gr.Row():
+                        with gr.Column():
+                            with gr.Row(equal_height=True):
+                                d_watch_path = gr.Textbox(label="Directory Path", scale=8)
+                                d_watch_btn_get_path = gr.Button("📂", scale=1)
+                            d_watch_operation = gr.Dropdown(label="Operation", value="compress",
+                                                            choices=["compress", "convert", "replace"])
+                            d_watch_ext = gr.Dropdown(label="Extension (convert)", value="mp4",
+                                                      choices=["mp4", "mov", "avi", "webm", "mkv", "mp3", "wav",
+                                                               "ogg", "flac"])
+                            with gr.Row(equal_height=True):
+                                d_watch_a_path = gr.Textbox(label="Audio Directory Path (replace)", scale=8)
+                                d_watch_btn_get_a_path = gr.Button("📂", scale=1)
+                            d_watch_bitrate = gr.Textbox(label="Bitrate wanted (compress):", value="8000")
+                            d_watch_min_res = gr.Textbox(label="Minimum resolution (compress)", value="1080")
+                            d_watch_vcodec = gr.Dropdown(label="Video codec (compress)", value=params.get_vcodec(),
+                                                         choices=VCODEC_CHOICES)
+                            d_watch_settle = gr.Textbox(label="Seconds without change before processing", value="10")
+                            with gr.Row():
+                                d_watch_start = gr.Button("Start watching")
+                                d_watch_stop = gr.Button("Stop watching")
+                                d_watch_refresh = gr.Button("Status")
+                        with gr.Column():
+                            d_watch_output = gr.Textbox(label="Result", interactive=False)
+
+                    d_watch_btn_get_path.click(get_dir, d_watch_path, d_watch_path)
+                    d_watch_btn_get_a_path.click(get_dir, d_watch_a_path, d_watch_a_path)
+                    d_watch_start.click(directory_watch_start,
+                                        [d_watch_path, d_watch_operation, d_watch_ext, d_watch_a_path,
+                                         d_watch_bitrate, d_watch_min_res, d_watch_vcodec, d_watch_settle],
+                                        d_watch_output)
+                    d_watch_stop.click(directory_watch_stop, d_watch_path, d_watch_output)
+                    d_watch_refresh.click(directory_watch_status, outputs=d_watch_output)
 
             with gr.Tab("Multiples Videos"):
                 with gr.Tab("Convert Videos"):
@@ -242,11 +455,14 @@ class GradioManager:
                                 m_cvv_chose_ext = gr.Dropdown(label="Select an extension",
                                                               choices=["mp4", "mov", "avi", "webm", "mkv"])
                             m_cvv_run = gr.Button("Convert")
+                            m_cvv_stop = gr.Button("Stop")
                         with gr.Column():
                             m_cvv_output = gr.Textbox(label="Result")
 
                     m_cvv_btn_get_v_path.click(get_video_files, inputs=m_cvv_v_path, outputs=m_cvv_v_path)
-                    m_cvv_run.click(batch_convert, inputs=[m_cvv_v_path, m_cvv_chose_ext], outputs=m_cvv_output)
+                    m_cvv_event = m_cvv_run.click(with_progress(batch_convert), inputs=[m_cvv_v_path, m_cvv_chose_ext],
+                                                  outputs=m_cvv_output)
+                    m_cvv_stop.click(None, cancels=[m_cvv_event])
 
                 with gr.Tab("Convert Audios"):
                     with gr.Row():
@@ -270,7 +486,8 @@ class GradioManager:
                             m_cva_output = gr.Textbox(label="Result")
 
                     m_cva_btn_get_a_path.click(get_audio_files, inputs=m_cva_a_path, outputs=m_cva_a_path)
-                    m_cva_run.click(batch_convert, inputs=[m_cva_a_path, m_cva_chose_ext], outputs=m_cva_output)
+                    m_cva_run.click(with_progress(batch_convert), inputs=[m_cva_a_path, m_cva_chose_ext],
+                                    outputs=m_cva_output)
 
                 with gr.Tab("Modify audio"):
                     with gr.Row():
@@ -313,7 +530,7 @@ class GradioManager:
 
                     m_modif_btn_get_v_path.click(get_video_files, inputs=m_modif_v_path, outputs=m_modif_v_path)
                     m_modif_btn_get_a_path.click(get_audio_files, inputs=m_modif_a_path, outputs=m_modif_a_path)
-                    m_modif_run.click(batch_modify_audio,
+                    m_modif_run.click(with_progress(batch_modify_audio),
                                       inputs=[m_modif_v_path, m_modif_a_path, m_modif_opt_mode, m_modif_randomize],
                                       outputs=m_modif_output)
 
@@ -335,16 +552,26 @@ class GradioManager:
                             m_compr_bitrate = gr.Textbox(label="Bitrate wanted:", value="8000")
                             m_compr_min_res = gr.Textbox(label="Minimum resolution", value="1080")
                             m_compr_vcodec = gr.Dropdown(label="Video codec", value=params.get_vcodec(),
-                                                         choices=["hevc_nvenc", "libx264", "libvpx-vp9", "h264_nvenc"])
+                                                         choices=VCODEC_CHOICES)
+                            with gr.Row():
+                                m_compr_speed_tier = gr.Dropdown(label="Speed tier", value=params.get_speed_tier(),
+                                                                 choices=SPEED_TIERS)
+                                m_compr_rate_mode = gr.Dropdown(label="Rate control", value=params.get_rate_mode(),
+                                                                choices=["bitrate", "quality"])
+                                m_compr_quality = gr.Textbox(label="Quality (CRF, lower is better)",
+                                                             value=str(params.get_quality()))
 
                             m_compr_run = gr.Button("Batch compress video")
+                            m_compr_stop = gr.Button("Stop")
                         with gr.Column():
                             m_compr_output = gr.Textbox(label="Result")
 
                     m_compr_get_v_path.click(get_video_files, m_compr_v_path, m_compr_v_path)
-                    m_compr_run.click(batch_compress,
-                                      [m_compr_v_path, m_compr_bitrate, m_compr_min_res, m_compr_vcodec],
-                                      m_compr_output)
+                    m_compr_event = m_compr_run.click(with_progress(batch_compress),
+                                                      [m_compr_v_path, m_compr_bitrate, m_compr_min_res, m_compr_vcodec,
+                                                       m_compr_speed_tier, m_compr_rate_mode, m_compr_quality],
+                                                      m_compr_output)
+                    m_compr_stop.click(None, cancels=[m_compr_event])
 
                 with gr.Tab("Concatenate videos"):
                     with gr.Row():
@@ -366,27 +593,121 @@ class GradioManager:
                             m_concat_output = gr.Textbox(label="Result")
 
                     m_concat_btn_get_v_path.click(get_video_files, inputs=m_concat_v_path, outputs=m_concat_v_path)
-                    m_concat_run.click(batch_concat, inputs=m_concat_v_path, outputs=m_concat_output)
+                    m_concat_run.click(with_progress(batch_concat), inputs=m_concat_v_path, outputs=m_concat_output)
+
+                with gr.Tab("Contact sheets"):
+                    with gr.Row():
+                        with gr.Column():
+                            with gr.Row(equal_height=True):
+                                m_sheet_v_path = gr.Dataframe(
+                                    headers=["Video Paths"],
+                                    datatype="str",
+                                    col_count=(1, "fixed"),
+                                    interactive=True,
+                                    row_count=1,
+                                    type="array",
+                                    wrap=True,
+                                    scale=8
+                                )
+                                m_sheet_btn_get_v_path = gr.Button("📂")
+                            with gr.Row():
+                                m_sheet_columns = gr.Textbox(label="Columns", value="4")
+                                m_sheet_rows = gr.Textbox(label="Rows", value="4")
+                            m_sheet_run = gr.Button("Batch contact sheets")
+                        with gr.Column():
+                            m_sheet_output = gr.Textbox(label="Result")
+
+                    m_sheet_btn_get_v_path.click(get_video_files, inputs=m_sheet_v_path, outputs=m_sheet_v_path)
+                    m_sheet_run.click(with_progress(batch_contact_sheets),
+                                      inputs=[m_sheet_v_path, m_sheet_columns, m_sheet_rows], outputs=m_sheet_output)
+
+                with gr.Tab("Audio effects"):
+                    with gr.Row():
+                        with gr.Column():
+                            with gr.Row(equal_height=True):
+                                m_fx_path = gr.Dataframe(
+                                    headers=["Media Paths"],
+                                    datatype="str",
+                                    col_count=(1, "fixed"),
+                                    interactive=True,
+                                    row_count=1,
+                                    type="array",
+                                    wrap=True,
+                                    scale=8
+                                )
+                                m_fx_btn_get_path = gr.Button("📂")
+                            m_fx_effects = gr.Textbox(label="Effects (reverb, deep_voice, pitch, tempo, eq, gain, "
+                                                            "fade_in, fade_out)",
+                                                      placeholder="reverb, pitch=0.8, eq=100:-3, fade_out=2")
+                            m_fx_run = gr.Button("Apply effects")
+                        with gr.Column():
+                            m_fx_output = gr.Textbox(label="Result")
+
+                    m_fx_btn_get_path.click(get_audio_files, inputs=m_fx_path, outputs=m_fx_path)
+                    m_fx_run.click(with_progress(batch_effects), inputs=[m_fx_path, m_fx_effects], outputs=m_fx_output)
 
             with gr.Tab("Options"):
                 with gr.Row():
                     with gr.Column():
                         opt_max_workers = gr.Textbox(label="Max workers:", value=str(params.get_max_workers()))
                         opt_vcodec = gr.Dropdown(label="Default video codec:", value=params.get_vcodec(),
-                                                 choices=["hevc_nvenc", "libx264", "libvpx-vp9", "h264_nvenc"])
+                                                 choices=VCODEC_CHOICES)
+                        opt_schedule_order = gr.Dropdown(label="Batch order (by estimated cost):",
+                                                         value=params.get_schedule_order(),
+                                                         choices=["longest", "shortest"])
+                        opt_resume_batches = gr.Checkbox(label="Skip batch jobs already done (job journal)",
+                                                         value=params.get_resume_batches())
+                        opt_speed_tier = gr.Dropdown(label="Default speed tier (fast / balanced / archive):",
+                                                     value=params.get_speed_tier(), choices=SPEED_TIERS)
+                        opt_rate_mode = gr.Dropdown(label="Default rate control:", value=params.get_rate_mode(),
+                                                    choices=["bitrate", "quality"])
+                        opt_quality = gr.Textbox(label="Default quality (CRF, lower is better):",
+                                                 value=str(params.get_quality()))
+                        opt_chunked_encoding = gr.Checkbox(label="Encode long videos as segments in parallel "
+                                                                 "(software encoders)",
+                                                           value=params.get_chunked_encoding())
+                        opt_broker_url = gr.Textbox(label="Job broker URL (empty: batches run on this machine):",
+                                                    value=params.get_broker_url(),
+                                                    placeholder="http://host:8765")
+                        opt_mix_backend = gr.Dropdown(label="Audio combine mixer (numpy: no intermediate file):",
+                                                      value=params.get_mix_backend(), choices=["ffmpeg", "numpy"])
                     with gr.Column():
                         with gr.Row():
                             opt_btn_save = gr.Button("Save options")
                             opt_btn_reload_ui = gr.Button("Reload UI")
                         opt_output = gr.Textbox(label="")
-
-                opt_btn_save.click(apply_option, inputs=[opt_max_workers, opt_vcodec], outputs=opt_output)
+                        opt_encoders = gr.Textbox(label="Encoders used on this machine",
+                                                  value=EncoderRegistry().summary(), lines=4, interactive=False)
+                        opt_btn_detect = gr.Button("Detect encoders again")
+                        opt_latency = gr.Textbox(label="Job latency by lane (submission to result)",
+                                                 value=job_latency(), lines=2, interactive=False)
+                        opt_btn_latency = gr.Button("Refresh latency")
+
+                opt_btn_save.click(apply_option,
+                                   inputs=[opt_max_workers, opt_vcodec, opt_schedule_order, opt_resume_batches,
+                                           opt_speed_tier, opt_rate_mode, opt_quality, opt_chunked_encoding,
+                                           opt_broker_url, opt_mix_backend],
+                                   outputs=opt_output)
+                opt_btn_detect.click(detect_encoders, outputs=opt_encoders)
+                opt_btn_latency.click(job_latency, outputs=opt_latency)
                 opt_btn_reload_ui.click(ui_reload, outputs=[
                     opt_max_workers,
                     opt_vcodec,
+                    opt_schedule_order,
+                    opt_resume_batches,
+                    opt_speed_tier,
+                    opt_rate_mode,
+                    opt_quality,
+                    opt_chunked_encoding,
+                    opt_broker_url,
+                    opt_mix_backend,
                     s_compr_vcodec,
                     d_compr_vcodec,
-                    m_compr_vcodec
+                    m_compr_vcodec,
+                    d_watch_vcodec,
+                    s_compr_speed_tier, s_compr_rate_mode, s_compr_quality,
+                    d_compr_speed_tier, d_compr_rate_mode, d_compr_quality,
+                    m_compr_speed_tier, m_compr_rate_mode, m_compr_quality
                 ])
 
     def launch(self):
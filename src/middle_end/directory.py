@@ -1,38 +1,108 @@
+import os
+
 from back_end.dir_manip import (
     dir_convert_media,
     dir_audio_replace,
     dir_audio_combine,
     dir_convert_video_to_video,
-    dir_compress_videos
+    dir_compress_videos,
+    dir_contact_sheets,
+    dir_apply_effects
 )
 
-from toolbox.utils import regularize_path
+from back_end.discovery import parse_patterns
+from back_end.watcher import FolderWatcher
+from toolbox.utils import regularize_path, to_quality
 
-def directory_media2media(video_dir_path: str, ext: str) -> str:
+def directory_media2media(video_dir_path: str, ext: str, recursive: bool = False, include: str = "",
+                          exclude: str = "") -> str:
     try:
-        return dir_convert_media(regularize_path(video_dir_path), ext)
+        return dir_convert_media(regularize_path(video_dir_path), ext, recursive, parse_patterns(include),
+                                 parse_patterns(exclude))
     except Exception as e:
         return f"Error: {str(e)}"
 
 
-def directory_audio_modify(video_dir_path: str, audio_dir_path: str, opt: str = "replace", randomize: bool = True) -> str:
+def directory_audio_modify(video_dir_path: str, audio_dir_path: str, opt: str = "replace", randomize: bool = True,
+                           recursive: bool = False) -> str:
     try:
         if opt == "replace":
-            return dir_audio_replace(video_dir_path, audio_dir_path, randomize)
-        return dir_audio_combine(video_dir_path, audio_dir_path, randomize)
+            return dir_audio_replace(video_dir_path, audio_dir_path, randomize, recursive)
+        return dir_audio_combine(video_dir_path, audio_dir_path, randomize, recursive)
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def directory_convert(dir_path: str, ext: str, recursive: bool = False, include: str = "", exclude: str = "") -> str:
+    try:
+        return dir_convert_video_to_video(dir_path, ext, recursive, parse_patterns(include), parse_patterns(exclude))
     except Exception as e:
         return f"Error: {str(e)}"
 
 
-def directory_convert(dir_path: str, ext: str) -> str:
+def directory_compress(dir_path: str, bitrate: int = 8000, min_res: str = "1080", vcodec="hevc",
+                       recursive: bool = False, include: str = "", exclude: str = "", speed_tier: str = "balanced",
+                       rate_mode: str = "bitrate", quality: str = "23") -> str:
     try:
-        return dir_convert_video_to_video(dir_path, ext)
+        return dir_compress_videos(dir_path, bitrate, int(min_res), vcodec, recursive, parse_patterns(include),
+                                   parse_patterns(exclude), speed_tier, to_quality(rate_mode, quality))
     except Exception as e:
         return f"Error: {str(e)}"
 
 
-def directory_compress(dir_path: str, bitrate: int = 8000, min_res: str = "1080", vcodec="hevc_nvenc") -> str:
+def directory_contact_sheets(dir_path: str, columns: str = "4", rows: str = "4", recursive: bool = False) -> str:
     try:
-        return dir_compress_videos(dir_path, bitrate, int(min_res), vcodec)
+        return dir_contact_sheets(regularize_path(dir_path), int(columns), int(rows), recursive)
     except Exception as e:
-        return f"Error: {str(e)}"
\ No newline at end of file
+        return f"Error: {str(e)}"
+
+
+def directory_effects(dir_path: str, effects: str, recursive: bool = False, include: str = "",
+                      exclude: str = "") -> str:
+    try:
+        return dir_apply_effects(regularize_path(dir_path), effects, recursive, parse_patterns(include),
+                                 parse_patterns(exclude))
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+watchers = {}
+
+
+def directory_watch_start(dir_path: str, operation: str, ext: str, audio_dir_path: str, bitrate: str = "8000",
+                          min_res: str = "1080", vcodec: str = "hevc", settle_time: str = "10") -> str:
+    try:
+        dir_path = regularize_path(dir_path)
+        if not os.path.isdir(dir_path):
+            return f"{dir_path} is not a directory"
+        if dir_path in watchers and watchers[dir_path].is_running():
+            return f"Already watching {dir_path}"
+        options = {"bitrate": bitrate, "min_res": int(min_res), "vcodec": vcodec, "ext": ext}
+        if operation == "replace":
+            options["audio_dir"] = regularize_path(audio_dir_path)
+        watcher = FolderWatcher([dir_path], operation, options, settle_time=float(settle_time))
+        watcher.start()
+        watchers[dir_path] = watcher
+        return f"Watching {dir_path} ({operation})"
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def directory_watch_stop(dir_path: str) -> str:
+    dir_path = regularize_path(dir_path)
+    watcher = watchers.pop(dir_path, None)
+    if watcher is None:
+        return f"{dir_path} is not watched"
+    watcher.stop()
+    return f"Stopped watching {dir_path}\n" + '\n'.join(watcher.results)
+
+
+def directory_watch_status() -> str:
+    if not watchers:
+        return "No watched directory"
+    res = []
+    for dir_path, watcher in watchers.items():
+        state = "running" if watcher.is_running() else "stopped"
+        res.append(f"{dir_path} ({watcher.operation}, {state}): {len(watcher.results)} processed")
+        res.extend(list(watcher.results)[-10:])
+    return '\n'.join(res)
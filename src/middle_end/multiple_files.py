@@ -3,11 +3,13 @@ from back_end.files_manip import (
     files_audio_replace,
     files_compress_videos,
     files_convert,
-    files_convert_video_to_video
+    files_convert_video_to_video,
+    files_contact_sheets,
+    files_apply_effects
 )
 from back_end.video_manip import videos_concat
 
-from toolbox.utils import get_correct_files
+from toolbox.utils import get_correct_files, to_quality
 
 
 def batch_convert_video_to_video(videos: list[str], ext: str) -> str:
@@ -38,12 +40,13 @@ def batch_modify_audio(videos: list[str], audios: list[str], opt: str = "replace
         return f"Error: {str(e)}"
 
 
-def batch_compress(videos: list[str], bitrate, min_res, vcodec) -> str:
+def batch_compress(videos: list[str], bitrate, min_res, vcodec, speed_tier: str = "balanced",
+                   rate_mode: str = "bitrate", quality: str = "23") -> str:
     try:
         videos = get_correct_files(videos)
         if not videos:
             return "No provided videos"
-        return files_compress_videos(videos, bitrate, min_res, vcodec)
+        return files_compress_videos(videos, bitrate, min_res, vcodec, speed_tier, to_quality(rate_mode, quality))
     except Exception as e:
         return f"Error: {str(e)}"
 
@@ -65,3 +68,23 @@ def batch_concat(videos: list[str]) -> str:
         return videos_concat(videos)
     except Exception as e:
         return f"Error: {str(e)}"
+
+
+def batch_contact_sheets(videos: list[str], columns: str = "4", rows: str = "4") -> str:
+    try:
+        videos = get_correct_files(videos)
+        if not videos:
+            return "No provided videos"
+        return files_contact_sheets(videos, int(columns), int(rows))
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def batch_effects(medias: list[str], effects: str) -> str:
+    try:
+        medias = get_correct_files(medias)
+        if not medias:
+            return "No provided medias"
+        return files_apply_effects(medias, effects)
+    except Exception as e:
+        return f"Error: {str(e)}"
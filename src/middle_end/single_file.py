@@ -1,72 +1,89 @@
 import os
-import shutil
-import tempfile
+from collections.abc import Iterator
 
-from toolbox.utils import regularize_path
-from back_end.video_manip import video_cut, video_compress, is_video, multiple_cuts_plus_concatenate
+from toolbox.utils import regularize_path, to_quality
+from back_end.scheduler import format_result
+from back_end.video_manip import video_cut, video_compress, plan_compression, multiple_cuts_plus_concatenate
 from back_end.audio_manip import audio_replace, audio_combine
 from back_end.media_converter import convert_media
+from back_end.preview import make_preview
+from back_end.thumbnails import contact_sheet
 
-temp_file = None
 
+def with_preview(path: str, note=None) -> Iterator[tuple[str, str | None]]:
+    """
+    yield the result at once, then with the preview of the output when it is ready
+    :param note: shown after the path, decision of the operation
+    """
+    res = format_result(path, note)
+    yield res, None
+    if os.path.isfile(path):
+        yield res, make_preview(path)
 
-def make_temp_copy(src_path: str) -> str | None:
-    global temp_file
-    try:
-        _, file_extension = os.path.splitext(src_path)
-        if temp_file is not None and os.path.exists(temp_file):
-            os.unlink(temp_file)
-        with tempfile.NamedTemporaryFile(mode='w', suffix=file_extension, delete=False) as temp_path:
-            temp_file = temp_path.name
-        tmp = shutil.copy(src_path, temp_file)
-        if is_video(tmp):
-            return video_compress(tmp, target_bitrate=1000, min_resolution=480, vcodec="libx264")
-    except Exception:
-        return None
-
-
-def cut_video(video_path: str, start: str | None, end: str | None) -> tuple[str, str | None]:
+
+def cut_video(video_path: str, start: str | None, end: str | None,
+              smart: bool = False) -> Iterator[tuple[str, str | None]]:
     video_path = regularize_path(video_path)
     if not os.path.exists(video_path):
-        return f"{video_path} does not exit", None
+        yield f"{video_path} does not exit", None
+        return
 
-    path = video_cut(video_path, start=start, end=end)
-    return path, make_temp_copy(path)
+    path = video_cut(video_path, start=start, end=end, smart=smart)
+    yield from with_preview(path)
 
 
-def convert_media_to_media(video_path: str, ext: str) -> tuple[str, str | None, str | None]:
+def convert_media_to_media(video_path: str, ext: str) -> Iterator[tuple[str, str | None, str | None]]:
     try:
         path = convert_media(regularize_path(video_path), ext)
-        if ext in ["mp4", "mov", "avi", "webm", "mkv"]:
-            return path, make_temp_copy(path), None
-        return path, None, make_temp_copy(path)
     except Exception as e:
-        return f"Error: {str(e)}", None, None
+        yield f"Error: {str(e)}", None, None
+        return
+    for res, preview in with_preview(path):
+        if ext in ["mp4", "mov", "avi", "webm", "mkv"]:
+            yield res, preview, None
+        else:
+            yield res, None, preview
 
 
-def modify_audio(video_path: str, audio_path: str, opt: str = "replace") -> tuple[str, str | None]:
+def modify_audio(video_path: str, audio_path: str, opt: str = "replace") -> Iterator[tuple[str, str | None]]:
     try:
         if opt == "replace":
             path = audio_replace(regularize_path(video_path), regularize_path(audio_path))
         else:
             path = audio_combine(regularize_path(video_path), regularize_path(audio_path))
-        return path, make_temp_copy(path)
     except Exception as e:
-        return f"Error: {str(e)}", None
+        yield f"Error: {str(e)}", None
+        return
+    yield from with_preview(path)
 
 
-def compress_vid(video_path: str, bitrate: int = 8000, min_res: str = 1080, vcodec: str = "hevc_nvenc"):
+def compress_vid(video_path: str, bitrate: int = 8000, min_res: str = 1080, vcodec: str = "hevc",
+                 speed_tier: str = "balanced", rate_mode: str = "bitrate",
+                 quality: str = "23") -> Iterator[tuple[str, str | None]]:
+    options = {'target_bitrate': bitrate, 'min_resolution': int(min_res), 'vcodec': vcodec,
+               'speed_tier': speed_tier, 'quality': to_quality(rate_mode, quality)}
     try:
-        path = video_compress(video_path, target_bitrate=bitrate, min_resolution=int(min_res), vcodec=vcodec)
-        return path, make_temp_copy(path)
+        decision = plan_compression(video_path, **options)
+        path = video_compress(video_path, **options)
     except Exception as e:
-        return f"Error: {str(e)}", None
+        yield f"Error: {str(e)}", None
+        return
+    yield from with_preview(path, decision)
 
 
-def cut_and_concate(video_path: str, times: list[list[str, str]]) -> tuple[str, str | None]:
+def cut_and_concate(video_path: str, times: list[list[str, str]]) -> Iterator[tuple[str, str | None]]:
     video_path = regularize_path(video_path)
     if not os.path.exists(video_path):
-        return f"{video_path} does not exit", None
+        yield f"{video_path} does not exit", None
+        return
 
     path = multiple_cuts_plus_concatenate(video_path, times)
-    return path, make_temp_copy(path)
+    yield from with_preview(path)
+
+
+def video_contact_sheet(video_path: str, columns: str = "4", rows: str = "4") -> tuple[str, str | None]:
+    try:
+        path = contact_sheet(regularize_path(video_path), columns=int(columns), rows=int(rows))
+        return path, path if os.path.isfile(path) else None
+    except Exception as e:
+        return f"Error: {str(e)}", None
@@ -42,8 +42,85 @@ class Params(metaclass=SingletonMeta):
 
     def get_vcodec(self) -> str:
         """
-        return default video codec, default: hevc_nvenc
+        return default video codec, family or encoder, default: hevc
+        the encoder registry picks the fastest working encoder of the family
         """
         if "vcodec" in self.params_dict:
             return self.params_dict["vcodec"]
-        return "hevc_nvenc"
+        return "hevc"
+
+    def get_cache_dir(self) -> str:
+        """
+        return directory of the persistent caches (metadata index...), default: .cache
+        """
+        if "cache_dir" in self.params_dict:
+            return self.params_dict["cache_dir"]
+        return ".cache"
+
+    def get_schedule_order(self) -> str:
+        """
+        return order of batch jobs by estimated cost, "longest" or "shortest" first, default: longest
+        """
+        if "schedule_order" in self.params_dict:
+            return self.params_dict["schedule_order"]
+        return "longest"
+
+    def get_resume_batches(self) -> bool:
+        """
+        return whether batches skip the jobs already done according to the job journal, default: True
+        """
+        if "resume_batches" in self.params_dict:
+            return str(self.params_dict["resume_batches"]).lower() in ("true", "1")
+        return True
+
+    def get_speed_tier(self) -> str:
+        """
+        return speed tier of the encoders, "fast", "balanced" or "archive", default: balanced
+        """
+        if "speed_tier" in self.params_dict:
+            return self.params_dict["speed_tier"]
+        return "balanced"
+
+    def get_rate_mode(self) -> str:
+        """
+        return rate control of the compression, "bitrate" (target bitrate) or "quality" (constant quality),
+        default: bitrate
+        """
+        if "rate_mode" in self.params_dict:
+            return self.params_dict["rate_mode"]
+        return "bitrate"
+
+    def get_quality(self) -> int:
+        """
+        return constant quality of the compression (CRF scale, lower is better), default: 23
+        """
+        if "quality" in self.params_dict:
+            return int(self.params_dict["quality"])
+        return 23
+
+    def get_chunked_encoding(self) -> bool:
+        """
+        return whether long videos are split in segments encoded in parallel by the software encoders,
+        default: True
+        """
+        if "chunked_encoding" in self.params_dict:
+            return str(self.params_dict["chunked_encoding"]).lower() in ("true", "1")
+        return True
+
+    def get_broker_url(self) -> str:
+        """
+        return URL of the job broker the batches are submitted to (http://host:8765), empty to run them locally,
+        default: empty
+        """
+        if "broker_url" in self.params_dict:
+            return self.params_dict["broker_url"]
+        return ""
+
+    def get_mix_backend(self) -> str:
+        """
+        return how audio combine mixes the music with the audio of the video: "ffmpeg" (filter graph)
+        or "numpy" (in-process streaming mix, no intermediate file), default: ffmpeg
+        """
+        if "mix_backend" in self.params_dict:
+            return self.params_dict["mix_backend"]
+        return "ffmpeg"
@@ -1,54 +1,376 @@
+import functools
+import inspect
+import logging
 import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 
+from toolbox.Singleton import SingletonMeta
 from toolbox.utils import format_time
-import time
 
-def progress_bar(duration: float, process):
-    progress_buffer = ""
-    progress_info = {}
-    bar_width = 50
-    started_time = time.time()
-
-    while process.poll() is None:
-        char = process.stdout.read(1).decode('utf-8', errors='replace')
-        progress_buffer += char
-
-        if char == '\n':
-            line = progress_buffer.strip()
-            progress_buffer = ""
-
-            if '=' in line:
-                key, value = line.split('=', 1)
-                progress_info[key.strip()] = value.strip()
-
-            # Update progress bar on 'progress=continue' or 'progress=end'
-            if line in ('progress=continue', 'progress=end'):
-                out_time = progress_info.get('out_time', '00:00:00.000000').split('.')[0]
-                fps = progress_info.get('fps', '0')
-                speed = progress_info.get('speed', '0x')
-
-                # Calculate progress percentage
-                h, m, s = map(float, out_time.split(':'))
-                current_seconds = h * 3600 + m * 60 + s
-                percentage = min(100, int(current_seconds / duration * 100))
-
-                # Build progress bar
-                filled = int(bar_width * percentage / 100)
-                bar = '█' * filled + '-' * (bar_width - filled)
-
-                # Display
-                sys.stdout.write(
-                    f"\r[{bar}] {percentage:3d}% | "
-                    f"{out_time} / {format_time(duration)} | "
-                    f"{speed} | {format_time(time.time() - started_time)}\n"
-                )
-                sys.stdout.flush()
-
-                if line == 'progress=end':
-                    break
-
-    sys.stdout.write(f"\r{' ' * 150}\r")
-    sys.stdout.write(
-        f"\r[{'█' * bar_width}] 100% | Time: {format_time(duration)} / {format_time(duration)}| {format_time(time.time() - started_time)}\n"
+
+@dataclass
+class ProgressEvent:
+    """One block of ffmpeg '-progress' output"""
+    out_time: float = 0.0  # seconds
+    fps: float = 0.0
+    speed: float = 0.0
+    bitrate: str = ""
+    total_size: int = 0
+    done: bool = False
+
+
+@dataclass
+class JobProgress:
+    name: str
+    duration: float
+    started_time: float = field(default_factory=time.time)
+    out_time: float = 0.0
+    fps: float = 0.0
+    speed: float = 0.0
+    done: bool = False
+    scope: "ProgressScope | None" = field(default=None, repr=False)
+
+    @property
+    def fraction(self) -> float:
+        if self.done:
+            return 1.0
+        if self.duration <= 0:
+            return 0.0
+        return min(1.0, self.out_time / self.duration)
+
+
+def _to_float(value: str, default: float = 0.0) -> float:
+    try:
+        return float(value.rstrip('x'))
+    except ValueError:
+        return default
+
+
+def parse_progress_block(progress_info: dict[str, str]) -> ProgressEvent:
+    """
+    :param progress_info: key=value pairs of one progress block
+    """
+    out_time_us = progress_info.get('out_time_us', progress_info.get('out_time_ms', ''))
+    if out_time_us.isdigit():
+        out_time = int(out_time_us) / 1_000_000
+    else:
+        try:
+            h, m, s = progress_info.get('out_time', '00:00:00').split(':')
+            out_time = int(h) * 3600 + int(m) * 60 + float(s)
+        except ValueError:
+            out_time = 0.0
+    total_size = progress_info.get('total_size', '0')
+
+    return ProgressEvent(
+        out_time=max(0.0, out_time),
+        fps=_to_float(progress_info.get('fps', '0')),
+        speed=_to_float(progress_info.get('speed', '0x')),
+        bitrate=progress_info.get('bitrate', ''),
+        total_size=int(total_size) if total_size.isdigit() else 0,
+        done=progress_info.get('progress') == 'end'
     )
-    sys.stdout.flush()
+
+
+def read_progress_events(stream):
+    """
+    Turn the '-progress pipe:1' output of ffmpeg into ProgressEvent, reading whole lines from the buffered pipe
+    :param stream: binary stdout of the ffmpeg process
+    """
+    progress_info = {}
+    for raw_line in stream:
+        line = raw_line.decode('utf-8', errors='replace').strip()
+        if '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        progress_info[key.strip()] = value.strip()
+
+        if key == 'progress':
+            event = parse_progress_block(progress_info)
+            progress_info = {}
+            yield event
+            if event.done:
+                return
+
+
+class TerminalSink:
+    """Single status line for all running jobs, redrawn at most every min_interval seconds"""
+
+    def __init__(self, stream=sys.stdout, min_interval: float = 0.5, bar_width: int = 30):
+        self.stream = stream
+        self.min_interval = min_interval
+        self.bar_width = bar_width
+        self._last_draw = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, hub: "ProgressHub", job: JobProgress) -> None:
+        now = time.time()
+        with self._lock:
+            if now - self._last_draw < self.min_interval:
+                return
+            self._last_draw = now
+            self._draw(hub)
+
+    def _draw(self, hub: "ProgressHub") -> None:
+        fraction = hub.batch_fraction()
+        running = hub.running_jobs()
+        filled = int(self.bar_width * fraction)
+        bar = '█' * filled + '-' * (self.bar_width - filled)
+        speed = sum(job.speed for job in running)
+        line = (f"[{bar}] {int(fraction * 100):3d}% | jobs {hub.done_count}/{hub.total_count()} | "
+                f"running {len(running)} | {speed:.2f}x | {format_time(hub.elapsed())}")
+        self.stream.write(f"\r{line:<100}")
+        self.stream.flush()
+
+    def job_finished(self, hub: "ProgressHub", job: JobProgress) -> None:
+        with self._lock:
+            self.stream.write(f"\r{'':<100}\r{job.name}: done in {format_time(time.time() - job.started_time)}\n")
+            if hub.running_jobs():
+                self._draw(hub)
+            self.stream.flush()
+
+
+class LogSink:
+    """Progress of each job in the logs, every interval seconds"""
+
+    def __init__(self, logger: logging.Logger = logging.getLogger("progress"), interval: float = 10.0):
+        self.logger = logger
+        self.interval = interval
+        self._last_log = {}
+        self._lock = threading.Lock()
+
+    def update(self, hub: "ProgressHub", job: JobProgress) -> None:
+        now = time.time()
+        with self._lock:
+            if now - self._last_log.get(job.name, 0.0) < self.interval:
+                return
+            self._last_log[job.name] = now
+        self.logger.info(f"{job.name}: {int(job.fraction * 100)}% | {format_time(job.out_time)} / "
+                         f"{format_time(job.duration)} | {job.fps:.1f} fps | {job.speed:.2f}x")
+
+    def job_finished(self, hub: "ProgressHub", job: JobProgress) -> None:
+        with self._lock:
+            self._last_log.pop(job.name, None)
+        self.logger.info(f"{job.name}: done in {format_time(time.time() - job.started_time)}")
+
+
+class GradioSink:
+    """Forward the batch progress to a gr.Progress object"""
+
+    def __init__(self, progress, min_interval: float = 0.5):
+        self.progress = progress
+        self.min_interval = min_interval
+        self._last_update = 0.0
+
+    def update(self, hub: "ProgressHub", job: JobProgress) -> None:
+        now = time.time()
+        if now - self._last_update < self.min_interval:
+            return
+        self._last_update = now
+        self.progress(hub.batch_fraction(), desc=f"{hub.done_count}/{hub.total_count()} jobs done")
+
+    def job_finished(self, hub: "ProgressHub", job: JobProgress) -> None:
+        self.progress(hub.batch_fraction(), desc=f"{hub.done_count}/{hub.total_count()} jobs done")
+
+
+class ProgressScope:
+    """
+    Jobs started in one context (a UI event, the batch jobs it submits) and the sinks following only them,
+    so that concurrent sessions don't see each other's progress
+    """
+
+    def __init__(self, sinks, batches: bool = False):
+        """
+        :param batches: the counts restart with the first job (or announced job) started while nothing runs
+        """
+        self.sinks = list(sinks)
+        self.batches = batches
+        self.jobs = []
+        self.done_count = 0
+        self.announced = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink) -> None:
+        with self._lock:
+            self.sinks.append(sink)
+
+    def remove_sink(self, sink) -> None:
+        with self._lock:
+            if sink in self.sinks:
+                self.sinks.remove(sink)
+
+    def get_sinks(self) -> list:
+        with self._lock:
+            return list(self.sinks)
+
+    def _new_batch(self) -> None:
+        if self.batches and not self.jobs and self.announced == 0:
+            self.done_count = 0
+            self.started = time.time()
+
+    def announce(self, n_jobs: int) -> None:
+        with self._lock:
+            if n_jobs > 0:
+                self._new_batch()
+            self.announced += n_jobs
+
+    def add(self, job: JobProgress) -> None:
+        with self._lock:
+            self._new_batch()
+            self.jobs.append(job)
+
+    def remove(self, job: JobProgress) -> None:
+        with self._lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+            self.done_count += 1
+
+    def running_jobs(self) -> list[JobProgress]:
+        with self._lock:
+            return list(self.jobs)
+
+    def total_count(self) -> int:
+        with self._lock:
+            return max(self.announced, self.done_count + len(self.jobs))
+
+    def batch_fraction(self) -> float:
+        with self._lock:
+            total = max(self.announced, self.done_count + len(self.jobs))
+            if total == 0:
+                return 1.0
+            return (self.done_count + sum(job.fraction for job in self.jobs)) / total
+
+    def elapsed(self) -> float:
+        return time.time() - self.started
+
+
+# scope of the jobs started in the current context, copied with it to the threads running them
+_scope: ContextVar[ProgressScope | None] = ContextVar("progress_scope", default=None)
+
+
+class ProgressHub(metaclass=SingletonMeta):
+    """
+    Aggregate the progress of every ffmpeg job of the process and dispatch it to the sinks.
+    Every job belongs to the root scope, where a batch starts with the first job and ends when no job is
+    running anymore, and to the scope of the context that started it, if any.
+    """
+
+    def __init__(self):
+        self.root = ProgressScope([TerminalSink(), LogSink()], batches=True)
+
+    @property
+    def sinks(self) -> list:
+        return self.root.sinks
+
+    @sinks.setter
+    def sinks(self, sinks: list) -> None:
+        self.root.sinks = sinks
+
+    @property
+    def done_count(self) -> int:
+        return self.root.done_count
+
+    def add_sink(self, sink) -> None:
+        self.root.add_sink(sink)
+
+    def remove_sink(self, sink) -> None:
+        self.root.remove_sink(sink)
+
+    @contextmanager
+    def batch(self, n_jobs: int):
+        """
+        announce the number of jobs of a batch, so that the batch fraction accounts for the queued ones
+        """
+        self.announce(n_jobs)
+        try:
+            yield self
+        finally:
+            self.announce(-n_jobs)
+
+    def announce(self, n_jobs: int) -> None:
+        """
+        add n_jobs queued jobs to the current batch, negative to withdraw them
+        """
+        self.root.announce(n_jobs)
+        scope = _scope.get()
+        if scope is not None:
+            scope.announce(n_jobs)
+
+    def scoped(self, fn, *sinks):
+        """
+        wrap fn so that the jobs it starts are also sent to sinks, and only to them
+        fn must run in a context of its own (asyncio.to_thread, run_operation, run_generator):
+        the scope is set in it and never reset
+        """
+        scope = ProgressScope(sinks)
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                _scope.set(scope)
+                return (yield from fn(*args, **kwargs))
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                _scope.set(scope)
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def start_job(self, name: str, duration: float) -> JobProgress:
+        job = JobProgress(name, duration, scope=_scope.get())
+        self.root.add(job)
+        if job.scope is not None:
+            job.scope.add(job)
+        return job
+
+    def update(self, job: JobProgress, event: ProgressEvent) -> None:
+        job.out_time = event.out_time
+        job.fps = event.fps
+        job.speed = event.speed
+        for sink in self.root.get_sinks():
+            sink.update(self, job)
+        if job.scope is not None:
+            for sink in job.scope.get_sinks():
+                sink.update(job.scope, job)
+
+    def finish_job(self, job: JobProgress) -> None:
+        job.done = True
+        self.root.remove(job)
+        for sink in self.root.get_sinks():
+            sink.job_finished(self, job)
+        if job.scope is not None:
+            job.scope.remove(job)
+            for sink in job.scope.get_sinks():
+                sink.job_finished(job.scope, job)
+
+    def running_jobs(self) -> list[JobProgress]:
+        return self.root.running_jobs()
+
+    def total_count(self) -> int:
+        return self.root.total_count()
+
+    def batch_fraction(self) -> float:
+        return self.root.batch_fraction()
+
+    def elapsed(self) -> float:
+        return self.root.elapsed()
+
+
+def progress_bar(duration: float, process, name: str = "") -> None:
+    """
+    Follow an ffmpeg process started with '-progress pipe:1' and pipe_stdout=True until it ends
+    :param duration: duration of the media in seconds
+    :param process: ffmpeg process
+    :param name: name of the job displayed by the sinks
+    """
+    hub = ProgressHub()
+    job = hub.start_job(name or f"ffmpeg {process.pid}", duration)
+    try:
+        for event in read_progress_events(process.stdout):
+            hub.update(job, event)
+    finally:
+        hub.finish_job(job)
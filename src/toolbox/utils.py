@@ -1,4 +1,8 @@
+import itertools
 import os
+import random
+import tempfile
+from collections.abc import Iterator
 
 
 def to_seconds(var) -> int | None:
@@ -43,3 +47,49 @@ def get_correct_files(files: list[str]) -> list[str]:
         if os.path.exists(f):
             res.append(f)
     return res
+
+
+def iter_audios(audios: list[str], randomize: bool) -> Iterator[str]:
+    """
+    endless supply of audios for videos discovered one by one, random or in round-robin order
+    """
+    if not audios:
+        raise Exception("No audio file")
+    if randomize:
+        return (random.choice(audios) for _ in itertools.count())
+    return itertools.cycle(audios)
+
+
+def pick_audios(audios: list[str], n: int, randomize: bool) -> list[str]:
+    """
+    audio to use for each of n videos, random or in round-robin order
+    """
+    return list(itertools.islice(iter_audios(audios, randomize), n))
+
+
+def to_quality(rate_mode: str, quality) -> int | None:
+    """
+    constant quality of a compression if rate_mode is "quality", None to target a bitrate
+    """
+    if rate_mode != "quality":
+        return None
+    return int(quality)
+
+
+def write_concat_list(entries: list[tuple]) -> str:
+    """
+    Write a script for the concat demuxer in a temporary file, to delete after use
+    :param entries: list of (file path, inpoint or None, outpoint or None[, duration])
+    :return: path to the script
+    """
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as list_file:
+        for path, inpoint, outpoint, *duration in entries:
+            escaped_path = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped_path}'\n")
+            if inpoint is not None:
+                list_file.write(f"inpoint {inpoint}\n")
+            if outpoint is not None:
+                list_file.write(f"outpoint {outpoint}\n")
+            if duration and duration[0] is not None:
+                list_file.write(f"duration {duration[0]}\n")
+        return list_file.name
@@ -0,0 +1,58 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from back_end import audio_effects
+from back_end.audio_effects import Effect, parse_effects, effect_filters
+from back_end.files_manip import files_apply_effects
+
+
+def fake_probe(path: str) -> dict:
+    return {"format": {"duration": "2.0"}, "streams": [{"codec_type": "audio", "sample_rate": "48000"}]}
+
+
+class TestEffectChain(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual([Effect("reverb"), Effect("pitch", (0.8,)), Effect("eq", (100.0, -3.0))],
+                         parse_effects("reverb, pitch=0.8, eq=100:-3"))
+        for chain in ("echo", "gain=1:2", "", "tempo=fast"):
+            with self.assertRaises(ValueError):
+                parse_effects(chain)
+
+    def test_probed_sample_rate(self):
+        filters, duration = effect_filters(parse_effects("deep_voice=0.5"), 48000, 10.0)
+        self.assertEqual([('asetrate', {'r': 24000}), ('aresample', {'osr': 48000})], filters)
+        self.assertEqual(20.0, duration)
+
+    def test_pitch_keeps_duration(self):
+        filters, duration = effect_filters(parse_effects("pitch=0.25"), 44100, 10.0)
+        self.assertEqual([('atempo', {'tempo': 2.0}), ('atempo', {'tempo': 2.0})], filters[2:])
+        self.assertEqual(10.0, duration)
+
+    def test_fade_out_after_tempo(self):
+        filters, duration = effect_filters(parse_effects("tempo=2, fade_out=1"), 44100, 10.0)
+        self.assertEqual(('afade', {'t': 'out', 'st': 4.0, 'd': 1.0}), filters[-1])
+        with self.assertRaises(ValueError):
+            effect_filters(parse_effects("fade_out"), 44100, None)
+
+    def test_invalid_chain_before_batch(self):
+        with self.assertRaises(ValueError):
+            files_apply_effects(["a.mp3"], "reverb, louder")
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not installed")
+    def test_apply_effects(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = os.path.join(tmp_dir, "sine.wav")
+            subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i",
+                            "sine=frequency=440:sample_rate=48000:duration=2", source], check=True)
+            with mock.patch.object(audio_effects, "probe", fake_probe):
+                output = audio_effects.apply_effects(source, "reverb, pitch=0.8, gain=-3, fade_in=0.5, fade_out=0.5")
+            self.assertEqual(os.path.join(tmp_dir, "sine__fx.wav"), output)
+            self.assertTrue(os.path.getsize(output) > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
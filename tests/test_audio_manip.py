@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import ffmpeg
+
+from back_end import audio_manip, media_info
+from back_end.pcm_analysis import Analysis
+from toolbox.Parameters import Params
+
+STATS = {'input_i': -20.0, 'input_lra': 5.0, 'input_tp': -1.0, 'input_thresh': -30.0, 'target_offset': 0.2}
+ANALYSIS = Analysis(integrated=-20.0, loudness_range=5.0, threshold=-30.0, true_peak=-1.0, rms=-23.0, duration=60.0,
+                    silences=[(0.0, 1.5)])
+
+
+class TestLoudness(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        Params().params_dict = {"cache_dir": self.tmp_dir.name}
+        media_info.close_index()
+        self.audio = os.path.join(self.tmp_dir.name, "music.mp3")
+        with open(self.audio, "wb") as f:
+            f.write(b"music")
+
+    def tearDown(self):
+        media_info.close_index()
+        Params().params_dict = {}
+        self.tmp_dir.cleanup()
+
+    def test_loudness_measured_once_per_content(self):
+        copy = os.path.join(self.tmp_dir.name, "copy.mp3")
+        shutil.copy(self.audio, copy)
+        with mock.patch.object(audio_manip, "measure_loudness", return_value=STATS) as measure:
+            self.assertEqual(STATS, audio_manip.get_loudness_stats(self.audio))
+            self.assertEqual(STATS, audio_manip.get_loudness_stats(copy))
+            self.assertEqual(1, measure.call_count)
+
+    def test_loudness_measured_with_second_pass_targets(self):
+        output = os.path.join(self.tmp_dir.name, "normalized.mp3")
+        with mock.patch.object(audio_manip, "measure_loudness", return_value=STATS) as measure, \
+                mock.patch.object(audio_manip.runner, "run"):
+            audio_manip.normalize_audio(self.audio, output, i=-23, tp=-2, lra=7)
+            audio_manip.normalize_audio(self.audio, output)
+        self.assertEqual([mock.call(self.audio, -23, -2, 7), mock.call(self.audio, -16, -1.5, 11)],
+                         measure.call_args_list)
+
+    def test_loudness_from_analysis_engine(self):
+        copy = os.path.join(self.tmp_dir.name, "copy.mp3")
+        shutil.copy(self.audio, copy)
+        with mock.patch.object(audio_manip, "analyze", return_value=ANALYSIS) as analyze:
+            self.assertEqual(-20.0, audio_manip.get_loudness(self.audio))
+            self.assertEqual(ANALYSIS, audio_manip.get_analysis(copy))
+            self.assertEqual(1, analyze.call_count)
+
+    def test_failed_analysis_not_cached(self):
+        error = ffmpeg.Error("ffmpeg", None, b"invalid data")
+        with mock.patch.object(audio_manip, "analyze", side_effect=error) as analyze:
+            self.assertIsNone(audio_manip.get_loudness(self.audio))
+            self.assertIsNone(audio_manip.get_loudness(self.audio))
+            self.assertEqual(2, analyze.call_count)
+
+    def test_loudnorm_linear(self):
+        args = audio_manip.loudnorm_linear(STATS, i=-16)
+        self.assertEqual(-16, args['i'])
+        self.assertEqual(-20.0, args['measured_i'])
+        self.assertEqual(0.2, args['offset'])
+        self.assertEqual('true', args['linear'])
+
+
+class TestMixAudio(unittest.TestCase):
+    def test_fused_mix_falls_back_to_temp_files(self):
+        with mock.patch.object(audio_manip, "get_video_duration", return_value=20.0), \
+                mock.patch.object(audio_manip, "get_audio_duration", return_value=5.0), \
+                mock.patch.object(audio_manip, "_mix_audio_fused", side_effect=ffmpeg.Error("ffmpeg", b"", b"")), \
+                mock.patch.object(audio_manip, "_mix_audio_with_temp_files", return_value="mix.mp3") as fallback:
+            self.assertEqual("mix.mp3", audio_manip.mix_audio_and_export("video.mp4", "music.mp3"))
+            fallback.assert_called_once_with("video.mp4", "music.mp3", "video__mix_sound.mp3", 20.0, 5.0)
+
+
+class TestAudioReplace(unittest.TestCase):
+    def replace_args(self, compress: bool) -> list[str]:
+        with mock.patch.object(audio_manip, "get_video_duration", return_value=20.0), \
+                mock.patch.object(audio_manip, "_get_audio_codec", return_value="aac"), \
+                mock.patch.object(audio_manip, "_video_args", return_value=({}, {'c:v': 'copy'})), \
+                mock.patch.object(audio_manip.runner, "run") as run:
+            audio_manip.audio_replace("video.mp4", "music.m4a", compress=compress)
+        return run.call_args.args[0].compile()
+
+    def test_audio_copied(self):
+        args = self.replace_args(compress=False)
+        self.assertEqual("copy", args[args.index("-c:a") + 1])
+        self.assertNotIn("-b:a", args)
+
+    def test_audio_reencoded_when_compressing(self):
+        args = self.replace_args(compress=True)
+        self.assertEqual("aac", args[args.index("-c:a") + 1])
+        self.assertEqual("192k", args[args.index("-b:a") + 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
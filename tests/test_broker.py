@@ -0,0 +1,156 @@
+import contextvars
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from back_end import scheduler, worker
+from back_end.broker import BrokerServer, BrokerClient, JobQueue, QUEUED, RUNNING, DONE, FAILED
+from back_end.journal import JobJournal
+from back_end.scheduler import BatchScheduler, Job
+from toolbox.Parameters import Params
+from toolbox.ProgressBar import JobProgress
+
+
+def video_compress(path: str, suffix: str = "__compressed") -> str:
+    """stand-in of the back end function, same name so that it is sent to the broker"""
+    time.sleep(0.2)
+    output = os.path.splitext(path)[0] + suffix + ".mp4"
+    with open(output, "w") as f:
+        f.write(threading.current_thread().name)
+    return output
+
+
+def rename_files(path: str) -> str:
+    """not a remote operation, runs locally"""
+    return path
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp_dir.name, "broker.sqlite")
+        self.queue = JobQueue(self.db)
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp_dir.cleanup()
+
+    def test_claim_in_order(self):
+        ids = self.queue.submit("b", [{"operation": "video_compress", "args": ["a.mp4"]},
+                                      {"operation": "convert_media", "args": ["b.mp4", "mkv"]}])
+        self.assertEqual(ids[1], self.queue.claim("w1", ["convert_media"])["id"])
+        job = self.queue.claim("w2", ["video_compress", "convert_media"])
+        self.assertEqual((ids[0], RUNNING, "w2", ["a.mp4"]), (job["id"], job["status"], job["worker"], job["args"]))
+        self.assertIsNone(self.queue.claim("w3", ["video_compress"]))
+
+    def test_finish_by_owner_only(self):
+        job_id, = self.queue.submit("b", [{"operation": "video_compress", "args": ["a.mp4"]}])
+        self.queue.claim("w1", ["video_compress"])
+        self.assertFalse(self.queue.finish(job_id, "w2", "a__compressed.mp4", DONE))
+        self.assertTrue(self.queue.finish(job_id, "w1", "a__compressed.mp4", DONE))
+        self.assertEqual([(DONE, "a__compressed.mp4")], [(job["status"], job["result"])
+                                                         for job in self.queue.batch("b")])
+
+    def test_expired_lease_requeued(self):
+        self.queue.lease_timeout = 0
+        job_id, = self.queue.submit("b", [{"operation": "video_compress", "args": ["a.mp4"]}])
+        self.queue.claim("w1", ["video_compress"])
+        time.sleep(0.01)
+        self.assertEqual("w2", self.queue.claim("w2", ["video_compress"])["worker"])
+        self.assertFalse(self.queue.progress(job_id, "w1", 0.5))
+
+    def test_persistent(self):
+        self.queue.submit("b", [{"operation": "video_compress", "args": ["a.mp4"]}])
+        self.queue.close()
+        self.queue = JobQueue(self.db)
+        self.assertEqual([QUEUED], [job["status"] for job in self.queue.batch("b")])
+
+
+class TestBrokerSink(unittest.TestCase):
+    def test_progress_from_threads_of_the_job(self):
+        sink = worker._BrokerSink()
+        token = sink.set_job(7)
+        try:
+            # a chunked encode reports the progress of its segments from threads started with its context
+            thread = threading.Thread(target=contextvars.copy_context().run,
+                                      args=(sink.update, None, JobProgress("v.mp4", 10.0, out_time=5.0)))
+            thread.start()
+            thread.join()
+        finally:
+            sink.reset_job(token)
+        self.assertEqual(0.5, sink.progress[7])
+        # outside of a job, the progress of the other ffmpeg processes is ignored
+        sink.update(None, JobProgress("other.mp4", 10.0, out_time=10.0))
+        self.assertEqual({7: 0.5}, sink.progress)
+
+
+class TestBrokerWorkers(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        Params().params_dict = {"cache_dir": self.tmp_dir.name, "resume_batches": False}
+        self.server = BrokerServer(os.path.join(self.tmp_dir.name, "broker.sqlite"), port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        Params().params_dict["broker_url"] = self.server.url
+        mock.patch.object(scheduler, "BROKER_POLL_INTERVAL", 0.05).start()
+        mock.patch.dict(worker.OPERATIONS, {"video_compress": video_compress}).start()
+        self.workers = [worker.Worker(self.server.url, slots=1, name=f"w{i}", poll_interval=0.05,
+                                      heartbeat_interval=0.05) for i in range(2)]
+        for w in self.workers:
+            threading.Thread(target=w.run, daemon=True).start()
+
+    def tearDown(self):
+        for w in self.workers:
+            w.stop()
+        mock.patch.stopall()
+        self.server.shutdown()
+        self.server.server_close()
+        JobJournal().close()
+        Params().params_dict = {}
+        self.tmp_dir.cleanup()
+
+    def test_batch_on_workers(self):
+        inputs = []
+        for i in range(4):
+            inputs.append(os.path.join(self.tmp_dir.name, f"v{i}.mp4"))
+            open(inputs[-1], "w").close()
+        jobs = [Job(video_compress, (path,), path=path, operation="compress") for path in inputs]
+        jobs.append(Job(rename_files, ("local",)))
+        results = BatchScheduler().run(jobs)
+        self.assertEqual([os.path.splitext(path)[0] + "__compressed.mp4" for path in inputs] + ["local"], results)
+        # both workers took jobs
+        self.assertTrue(all(w.done_count > 0 for w in self.workers))
+
+    def test_jobs_submitted_as_produced(self):
+        inputs = []
+        for i in range(2):
+            inputs.append(os.path.join(self.tmp_dir.name, f"v{i}.mp4"))
+            open(inputs[-1], "w").close()
+
+        def jobs():
+            yield Job(video_compress, (inputs[0],), path=inputs[0], operation="compress")
+            # the first job is on the broker before the next one is produced
+            self.assertIsNotNone(self.server.queue.get(1))
+            yield Job(rename_files, ("local",))
+            yield Job(video_compress, (inputs[1],), path=inputs[1], operation="compress")
+
+        results = BatchScheduler().run(jobs())
+        self.assertEqual([os.path.splitext(inputs[0])[0] + "__compressed.mp4", "local",
+                          os.path.splitext(inputs[1])[0] + "__compressed.mp4"], results)
+
+    def test_failed_job(self):
+        results = BatchScheduler().run([Job(video_compress, (os.path.join(self.tmp_dir.name, "missing", "v.mp4"),))])
+        self.assertTrue(results[0].startswith("Error"))
+        jobs = BrokerClient(self.server.url).batch(self.server.queue.get(1)["batch"])
+        self.assertEqual([FAILED], [job["status"] for job in jobs])
+
+    def test_unreachable_broker(self):
+        Params().params_dict["broker_url"] = "http://127.0.0.1:9"
+        with self.assertRaises(OSError):
+            BatchScheduler().run([Job(video_compress, ("a.mp4",))])
+
+
+if __name__ == "__main__":
+    unittest.main()
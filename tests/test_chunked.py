@@ -0,0 +1,75 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from back_end import chunked
+from back_end.encoders import Encoder
+from toolbox.Parameters import Params
+
+
+def count_frames(path: str) -> int:
+    stderr = subprocess.run(["ffmpeg", "-i", path, "-map", "0:v", "-f", "null", "-"],
+                            capture_output=True, text=True).stderr
+    return int(re.findall(r"frame=\s*(\d+)", stderr)[-1])
+
+
+class TestPlanSegments(unittest.TestCase):
+    def test_starts_on_keyframes(self):
+        keyframes = [float(t) for t in range(0, 600, 7)]
+        segments = chunked.plan_segments(keyframes, 600.0, 4)
+        self.assertEqual(4, len(segments))
+        self.assertEqual(0.0, segments[0][0])
+        self.assertEqual(600.0, segments[-1][1])
+        for (_, end), (start, _) in zip(segments, segments[1:]):
+            self.assertEqual(end, start)
+            self.assertIn(start, keyframes)
+
+    def test_min_duration(self):
+        self.assertEqual([(0.0, 50.0)], chunked.plan_segments([0.0, 10.0, 20.0, 30.0, 40.0], 50.0, 4))
+        # no keyframe far enough from the previous start
+        self.assertEqual([(0.0, 600.0)], chunked.plan_segments([0.0], 600.0, 4))
+
+    def test_chunked_segments(self):
+        encoder = Encoder("libx265", "hevc")
+        with mock.patch.object(chunked, "_available_cores", return_value=16), \
+                mock.patch.object(chunked, "get_keyframes", return_value=[float(t) for t in range(0, 3600, 2)]):
+            self.assertEqual(4, len(chunked.chunked_segments("video.mp4", 3600.0, encoder)))
+            self.assertIsNone(chunked.chunked_segments("video.mp4", 60.0, encoder))
+            self.assertIsNone(chunked.chunked_segments("video.mp4", 3600.0, Encoder("hevc_nvenc", "hevc")))
+            Params().params_dict = {"chunked_encoding": False}
+            try:
+                self.assertIsNone(chunked.chunked_segments("video.mp4", 3600.0, encoder))
+            finally:
+                Params().params_dict = {}
+
+
+@unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not installed")
+class TestEncodeInSegments(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.video = os.path.join(self.tmp_dir.name, "video.mp4")
+        subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=320x240:rate=25:duration=12",
+                        "-f", "lavfi", "-i", "sine=duration=12", "-c:v", "libx264", "-g", "50", "-c:a", "aac",
+                        self.video], check=True)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_frames_kept(self):
+        output = os.path.join(self.tmp_dir.name, "out.mp4")
+        audio_info = {"streams": [{"codec_type": "audio"}]}
+        with mock.patch.object(chunked, "probe", return_value=audio_info):
+            chunked.encode_in_segments(self.video, output, 12.0, [(0.0, 4.0), (4.0, 8.0), (8.0, 12.0)],
+                                       {'vcodec': 'libx264', 'preset': 'ultrafast'}, {'acodec': 'copy'},
+                                       filters=[('scale', 160, -2)])
+        self.assertEqual(300, count_frames(output))
+        # the segments are removed
+        self.assertEqual(["out.mp4", "video.mp4"], sorted(os.listdir(self.tmp_dir.name)))
+
+
+if __name__ == "__main__":
+    unittest.main()
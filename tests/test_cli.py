@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import cli
+from toolbox.Parameters import Params
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp_dir.name, "input.mkv")
+        open(self.input, "wb").close()
+
+    def tearDown(self):
+        Params().params_dict = {}
+        self.tmp_dir.cleanup()
+
+    def write_manifest(self, name: str, content: str) -> str:
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_load_manifest(self):
+        csv_path = self.write_manifest("jobs.csv", f"operation,input,ext,bitrate\nconvert,{self.input},mp4,\n"
+                                                   f"compress,{self.input},,4000\n")
+        json_path = self.write_manifest("jobs.json", json.dumps([{"operation": "convert", "input": self.input,
+                                                                  "ext": "mp4"}]))
+        self.assertEqual([{"operation": "convert", "input": self.input, "ext": "mp4"},
+                          {"operation": "compress", "input": self.input, "bitrate": "4000"}],
+                         cli.load_manifest(csv_path))
+        self.assertEqual(cli.load_manifest(csv_path)[:1], cli.load_manifest(json_path))
+
+    def test_batch_exit_code(self):
+        def convert_media(path: str, ext: str) -> str:
+            if ext == "avi":
+                return "ffmpeg error: boom"
+            output = os.path.splitext(path)[0] + "." + ext
+            open(output, "wb").close()
+            return output
+
+        manifest = self.write_manifest("jobs.csv", f"operation,input,ext\nconvert,{self.input},mp4\n")
+        failing = self.write_manifest("fail.csv", f"operation,input,ext\nconvert,{self.input},avi\n")
+        with mock.patch("back_end.media_converter.convert_media", convert_media):
+            self.assertEqual(cli.EXIT_OK, cli.main(["-q", "--no-resume", "--params", "none.json", "batch", manifest]))
+            code = cli.main(["-q", "--no-resume", "--params", "none.json", "batch", failing])
+            self.assertEqual(cli.EXIT_FAILED, code)
+        invalid = self.write_manifest("invalid.csv", f"operation,input\nexplode,{self.input}\n")
+        self.assertEqual(cli.EXIT_USAGE, cli.main(["-q", "--params", "none.json", "batch", invalid]))
+
+    def test_no_ui_import(self):
+        cli.build_parser().parse_args(["compress", self.input])
+        self.assertNotIn("front_end.GradioManager", sys.modules)
+        self.assertNotIn("tkinter", sys.modules)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from back_end.discovery import discover, mirror_path, parse_patterns, is_output
+from back_end.video_manip import is_video
+
+FILES = ["a.mp4", "notes.txt", "a__compressed.mp4", "my__holiday.mp4", "clips/b.mkv", "clips/deep/c.mp4",
+         "output/a.mp4"]
+
+
+class TestDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        for file in FILES:
+            path = os.path.join(self.root, file)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "wb").close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def found(self, **kwargs) -> list[str]:
+        return sorted(os.path.relpath(path, self.root).replace(os.sep, "/")
+                      for path in discover(self.root, is_video, **kwargs))
+
+    def test_depth(self):
+        self.assertEqual(["a.mp4", "my__holiday.mp4"], self.found(max_depth=0, exclude=["output"]))
+        self.assertEqual(["a.mp4", "clips/b.mkv", "my__holiday.mp4"], self.found(max_depth=1, exclude=["output"]))
+        self.assertEqual(["clips/b.mkv", "clips/deep/c.mp4"], self.found(min_depth=1, exclude=["output"]))
+
+    def test_patterns(self):
+        self.assertEqual(["a.mp4", "clips/deep/c.mp4", "my__holiday.mp4", "output/a.mp4"],
+                         self.found(include=["*.mp4"]))
+        self.assertEqual(["a.mp4", "my__holiday.mp4"], self.found(exclude=["clips", "output"]))
+        self.assertEqual(["clips/b.mkv"], self.found(exclude=["clips/deep", "a.mp4", "my*"]))
+
+    def test_outputs_skipped(self):
+        names = [os.path.basename(path) for path in discover(self.root, skip_outputs=False)]
+        self.assertIn("a__compressed.mp4", names)
+        self.assertTrue(is_output("a__deep0.8.mp3"))
+        self.assertFalse(is_output("my__holiday.mp4"))
+
+    def test_is_lazy(self):
+        files = discover(self.root)
+        self.assertTrue(os.path.isfile(next(files)))
+
+    def test_mirror_path(self):
+        output = mirror_path(os.path.join(self.root, "clips", "deep", "c.mp4"), self.root,
+                             os.path.join(self.root, "output"))
+        self.assertEqual(os.path.join(self.root, "output", "clips", "deep", "c.mp4"), output)
+        self.assertTrue(os.path.isdir(os.path.dirname(output)))
+
+    def test_parse_patterns(self):
+        self.assertEqual(["*.mp4", "clips/*"], parse_patterns(" *.mp4, clips/* ,"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import tempfile
+import unittest
+from unittest import mock
+
+from back_end import encoders, media_info
+from back_end.encoders import Encoder, EncoderRegistry
+from toolbox.Parameters import Params
+
+# hevc_nvenc is compiled in but there is no GPU
+COMPILED = ["hevc_nvenc", "h264_nvenc", "libx264", "libx265", "libvpx-vp9"]
+WORKING = ["libx264", "libx265"]
+
+
+class TestEncoderRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        Params().params_dict = {"cache_dir": self.tmp_dir.name}
+        media_info.close_index()
+        mock.patch.object(encoders.shutil, "which", return_value=__file__).start()
+        mock.patch.object(encoders, "list_encoders", return_value=COMPILED).start()
+        mock.patch.object(encoders, "list_hwaccels", return_value=["cuda"]).start()
+        self.test_encode = mock.patch.object(encoders, "test_encode",
+                                             side_effect=lambda path, name, options: name in WORKING).start()
+        EncoderRegistry()._capabilities = None
+
+    def tearDown(self):
+        mock.patch.stopall()
+        EncoderRegistry()._capabilities = None
+        media_info.close_index()
+        Params().params_dict = {}
+        self.tmp_dir.cleanup()
+
+    def test_resolve_family(self):
+        self.assertEqual("libx265", EncoderRegistry().resolve("hevc").name)
+        self.assertEqual({}, EncoderRegistry().resolve("hevc").input_args())
+        self.assertEqual("libx264", EncoderRegistry().resolve("h264_nvenc").name)
+
+    def test_requested_encoder_first(self):
+        WORKING.append("hevc_nvenc")
+        try:
+            encoder = EncoderRegistry().resolve("hevc")
+            self.assertEqual("hevc_nvenc", encoder.name)
+            self.assertEqual({"hwaccel": "cuda"}, encoder.input_args())
+            self.assertEqual({"vcodec": "hevc_nvenc", "preset": "p4"}, encoder.output_args())
+            self.assertEqual("libx265", EncoderRegistry().resolve("libx265").name)
+        finally:
+            WORKING.remove("hevc_nvenc")
+
+    def test_fallback_family(self):
+        WORKING.remove("libx265")
+        try:
+            self.assertEqual("libx264", EncoderRegistry().resolve("hevc").name)
+        finally:
+            WORKING.append("libx265")
+        # no h264 in a webm
+        with self.assertRaises(Exception):
+            EncoderRegistry().resolve("vp9")
+        self.assertEqual("mpeg4", EncoderRegistry().resolve("mpeg4").name)
+
+    def test_unlisted_hwaccel_dropped(self):
+        WORKING.append("hevc_nvenc")
+        encoders.list_hwaccels.return_value = []
+        try:
+            self.assertEqual({}, EncoderRegistry().resolve("hevc").input_args())
+        finally:
+            WORKING.remove("hevc_nvenc")
+
+    def test_detected_once(self):
+        EncoderRegistry().resolve("hevc")
+        calls = self.test_encode.call_count
+        # only the compiled encoders are tested, nvenc with its two presets
+        self.assertEqual(7, calls)
+        EncoderRegistry()._capabilities = None
+        EncoderRegistry().resolve("hevc")
+        self.assertEqual(calls, self.test_encode.call_count)
+        EncoderRegistry().capabilities(refresh=True)
+        self.assertEqual(2 * calls, self.test_encode.call_count)
+
+
+class TestEncoderOptions(unittest.TestCase):
+    def test_speed_tiers(self):
+        x264 = Encoder("libx264", "h264", {"preset": "veryfast"})
+        self.assertEqual({"vcodec": "libx264", "preset": "slower"}, x264.output_args("archive"))
+        self.assertEqual({"vcodec": "libx264", "preset": "veryfast"}, x264.output_args())
+        self.assertEqual("p1", Encoder("hevc_nvenc", "hevc", {"preset": "p4"}).output_args("fast")["preset"])
+        self.assertEqual("slow", Encoder("hevc_nvenc", "hevc", {"preset": "fast"}).output_args("archive")["preset"])
+        self.assertEqual(8, Encoder("libvpx-vp9", "vp9").output_args("fast")["cpu-used"])
+
+    def test_constant_quality(self):
+        self.assertEqual({"crf": 28}, Encoder("libx265", "hevc").quality_args(28))
+        self.assertEqual({"rc": "vbr", "cq": 28, "b:v": 0}, Encoder("h264_nvenc", "h264").quality_args(28))
+        self.assertEqual({"crf": 63, "b:v": 0}, Encoder("libvpx-vp9", "vp9").quality_args(51))
+
+
+if __name__ == "__main__":
+    unittest.main()
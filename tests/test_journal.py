@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from back_end import media_info
+from back_end.journal import JobJournal
+from back_end.scheduler import BatchScheduler, Job, audio_jobs, journal_key
+from toolbox.Parameters import Params
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        Params().params_dict = {"cache_dir": self.tmp_dir.name}
+        JobJournal().close()
+        media_info.close_index()
+        self.input = os.path.join(self.tmp_dir.name, "input.mp4")
+        with open(self.input, "wb") as f:
+            f.write(b"input")
+        self.output = os.path.join(self.tmp_dir.name, "output.mp4")
+        self.calls = 0
+        self.probe = mock.patch("back_end.journal.probe", return_value={}).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        JobJournal().close()
+        media_info.close_index()
+        Params().params_dict = {}
+        self.tmp_dir.cleanup()
+
+    def process(self, path: str, bitrate: int) -> str:
+        self.calls += 1
+        with open(self.output, "wb") as f:
+            f.write(b"output")
+        return self.output
+
+    def run_batch(self, bitrate: int = 8000) -> str:
+        return BatchScheduler().run([Job(self.process, (self.input, bitrate), path=self.input,
+                                         operation="compress")])[0]
+
+    def test_skip_done_job(self):
+        self.assertEqual(self.output, self.run_batch())
+        self.assertEqual(f"{self.output} (already done)", self.run_batch())
+        self.assertEqual(1, self.calls)
+
+    def test_skipped_job_not_done(self):
+        def skip(path: str) -> str:
+            self.calls += 1
+            return path
+
+        job = Job(skip, (self.input,), path=self.input, operation="compress", describe=lambda path: "skipped: hevc")
+        self.assertEqual([(self.input, "skipped: hevc")], BatchScheduler().run_results([job]))
+        self.assertEqual([f"{self.input} (skipped: hevc)"], BatchScheduler().run([job]))
+        self.assertEqual(2, self.calls)
+        self.assertEqual("skipped", JobJournal().get(journal_key(job))["status"])
+
+    def test_rerun_with_other_parameters(self):
+        self.run_batch(8000)
+        self.run_batch(4000)
+        self.assertEqual(2, self.calls)
+
+    def test_rerun_if_output_changed(self):
+        self.run_batch()
+        os.remove(self.output)
+        self.assertEqual(self.output, self.run_batch())
+        with open(self.output, "ab") as f:
+            f.write(b"partial")
+        self.assertEqual(self.output, self.run_batch())
+        self.assertEqual(3, self.calls)
+
+    def test_rerun_if_input_changed(self):
+        self.run_batch()
+        with open(self.input, "ab") as f:
+            f.write(b"new")
+        self.run_batch()
+        self.assertEqual(2, self.calls)
+
+    def replace(self, path: str, audio: str) -> str:
+        self.audios_used.append(os.path.basename(audio))
+        return self.process(path, 0)
+
+    def test_resume_keeps_drawn_audio(self):
+        audios = []
+        for name in ("a.mp3", "b.mp3"):
+            audios.append(os.path.join(self.tmp_dir.name, name))
+            with open(audios[-1], "wb") as f:
+                f.write(name.encode())
+        self.audios_used = []
+        BatchScheduler().run(audio_jobs(self.replace, "replace", [self.input], audios, False))
+        # another draw on the resumed run: the journal gives the video its first audio
+        res = BatchScheduler().run(audio_jobs(self.replace, "replace", [self.input], audios[::-1], False))
+        self.assertEqual([f"{self.output} (already done)"], res)
+        # the audio is keyed by its identity
+        with open(audios[0], "ab") as f:
+            f.write(b"new")
+        BatchScheduler().run(audio_jobs(self.replace, "replace", [self.input], audios[::-1], False))
+        self.assertEqual(["a.mp3", "a.mp3"], self.audios_used)
+
+    def test_disabled(self):
+        Params().params_dict["resume_batches"] = False
+        self.run_batch()
+        self.run_batch()
+        self.assertEqual(2, self.calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from back_end import media_info
+from toolbox.Parameters import Params
+
+FAKE_PROBE = {
+    "format": {"duration": "12.5", "bit_rate": "2000000"},
+    "streams": [
+        {"codec_type": "video", "codec_name": "h264", "width": 1280, "height": 720},
+        {"codec_type": "audio", "codec_name": "aac"}
+    ]
+}
+
+
+class TestMediaInfo(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        Params().params_dict = {"cache_dir": self.tmp_dir.name}
+        media_info.close_index()
+        media_info.clear_memory_cache()
+        self.media = os.path.join(self.tmp_dir.name, "media.mp4")
+        with open(self.media, "wb") as f:
+            f.write(b"0" * 16)
+
+    def tearDown(self):
+        media_info.close_index()
+        Params().params_dict = {}
+        self.tmp_dir.cleanup()
+
+    def test_probe_once(self):
+        with mock.patch("ffmpeg.probe", return_value=FAKE_PROBE) as fake:
+            self.assertEqual(FAKE_PROBE, media_info.probe(self.media))
+            self.assertEqual(FAKE_PROBE, media_info.probe(self.media))
+            self.assertEqual(1, fake.call_count)
+
+    def test_probe_returns_copy(self):
+        with mock.patch("ffmpeg.probe", return_value=FAKE_PROBE):
+            media_info.probe(self.media)["streams"].clear()
+            self.assertEqual(FAKE_PROBE, media_info.probe(self.media))
+
+    def test_probe_from_disk_index(self):
+        with mock.patch("ffmpeg.probe", return_value=FAKE_PROBE):
+            media_info.probe(self.media)
+        media_info.clear_memory_cache()
+        with mock.patch("ffmpeg.probe", side_effect=AssertionError("probed twice")):
+            self.assertEqual(FAKE_PROBE, media_info.probe(self.media))
+
+    def test_probe_after_modification(self):
+        with mock.patch("ffmpeg.probe", return_value=FAKE_PROBE) as fake:
+            media_info.probe(self.media)
+            with open(self.media, "ab") as f:
+                f.write(b"1")
+            media_info.probe(self.media)
+            self.assertEqual(2, fake.call_count)
+
+    def test_content_key(self):
+        copy = os.path.join(self.tmp_dir.name, "copy.mp4")
+        with open(copy, "wb") as f:
+            f.write(b"0" * 16)
+        self.assertEqual(media_info.content_key(self.media), media_info.content_key(copy))
+        with open(copy, "ab") as f:
+            f.write(b"1")
+        self.assertNotEqual(media_info.content_key(self.media), media_info.content_key(copy))
+
+    def test_content_key_whole_file(self):
+        # same size, first and last MiB: only the middle differs
+        size = 3 * media_info.CONTENT_CHUNK_SIZE
+        first, second = (os.path.join(self.tmp_dir.name, name) for name in ("first.mp3", "second.mp3"))
+        for path, middle in ((first, b"1"), (second, b"2")):
+            with open(path, "wb") as f:
+                f.write(b"0" * (size // 2) + middle + b"0" * (size // 2))
+        self.assertNotEqual(media_info.content_key(first), media_info.content_key(second))
+
+    def test_get_stream(self):
+        self.assertEqual("aac", media_info.get_stream(FAKE_PROBE, "audio")["codec_name"])
+        self.assertIsNone(media_info.get_stream({"streams": []}, "video"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from back_end import pcm_analysis
+from back_end.pcm_analysis import ANALYSIS_RATE, CHUNK_FRAMES, _Accumulator, silence_regions
+
+
+def sine(seconds: float, amplitude: float = 0.1, frequency: float = 1000.0) -> np.ndarray:
+    t = np.arange(int(seconds * ANALYSIS_RATE)) / ANALYSIS_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)[:, None]
+
+
+def accumulate(samples: np.ndarray) -> pcm_analysis.Analysis:
+    accumulator = _Accumulator(samples.shape[1])
+    for start in range(0, len(samples), CHUNK_FRAMES):
+        accumulator.add(samples[start:start + CHUNK_FRAMES])
+    return accumulator.result()
+
+
+class TestPcmAnalysis(unittest.TestCase):
+    def test_reference_sine(self):
+        # 1 kHz at -20 dBFS peak in mono: -23 LUFS (K-weighting gain of 1 kHz is about 0.7 dB)
+        analysis = accumulate(sine(10))
+        self.assertAlmostEqual(-23.0, analysis.integrated, delta=0.2)
+        self.assertAlmostEqual(-20.0, analysis.true_peak, delta=0.1)
+        self.assertAlmostEqual(-23.01, analysis.rms, delta=0.05)
+        self.assertEqual(10.0, analysis.duration)
+
+    def test_stereo_sums_channels(self):
+        mono = accumulate(sine(5))
+        stereo = accumulate(np.repeat(sine(5), 2, axis=1))
+        self.assertAlmostEqual(mono.integrated + 3.01, stereo.integrated, delta=0.05)
+
+    def test_gating_ignores_silence(self):
+        samples = np.concatenate((sine(5), np.zeros((5 * ANALYSIS_RATE, 1), dtype=np.float32), sine(5)))
+        analysis = accumulate(samples)
+        # only the blocks overlapping the edges of the silence pass the gates
+        self.assertAlmostEqual(accumulate(sine(10)).integrated, analysis.integrated, delta=0.3)
+        self.assertEqual([(5.0, 10.0)], analysis.silences)
+
+    def test_inter_sample_peak(self):
+        # fs/4 sine sampled at +-45 degrees: samples at 0.707, true peak at 1.0
+        samples = np.sin(np.pi / 2 * np.arange(ANALYSIS_RATE) + np.pi / 4).astype(np.float32)[:, None]
+        analysis = accumulate(samples)
+        self.assertAlmostEqual(0.0, analysis.true_peak, delta=0.3)
+
+    def test_silence_regions(self):
+        levels = np.array([-20, -60, -60, -60, -60, -60, -20, -60, -20], dtype=float)
+        self.assertEqual([(0.1, 0.6)], silence_regions(levels))
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not installed")
+    def test_analyze_pipe(self):
+        fake_probe = {"format": {}, "streams": [{"codec_type": "audio", "channels": 1}]}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "sine.wav")
+            subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i",
+                            "sine=frequency=1000:sample_rate=44100:duration=3,volume=0.2", path], check=True)
+            with mock.patch.object(pcm_analysis, "probe", return_value=fake_probe):
+                results = pcm_analysis.analyze_many([path, os.path.join(tmp_dir, "missing.wav")])
+        self.assertAlmostEqual(3.0, results[path].duration, delta=0.01)
+        self.assertTrue(results[os.path.join(tmp_dir, "missing.wav")].startswith("ffmpeg error"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from back_end import audio_manip, pcm_mix
+from back_end.pcm_mix import Limiter, LIMITER_BLOCK, MIX_RATE, CEILING
+from toolbox.Parameters import Params
+
+
+def limit(limiter: Limiter, *chunks: np.ndarray) -> np.ndarray:
+    return np.concatenate([limiter.process(chunk).copy() for chunk in chunks] + [limiter.flush()])
+
+
+class TestLimiter(unittest.TestCase):
+    def test_ceiling(self):
+        samples = np.full((MIX_RATE, 2), 2.0, dtype=np.float32)
+        out = limit(Limiter(), samples)
+        self.assertEqual(samples.shape, out.shape)
+        self.assertLessEqual(float(np.abs(out).max()), 10 ** (CEILING / 20) + 1e-6)
+
+    def test_quiet_untouched(self):
+        samples = np.full((MIX_RATE, 2), 0.1, dtype=np.float32)
+        np.testing.assert_array_equal(samples, limit(Limiter(), samples[:1000], samples[1000:]))
+
+    def test_release_across_chunks(self):
+        limiter = Limiter(release=20.0)
+        loud = np.ones((LIMITER_BLOCK, 2), dtype=np.float32)
+        # one second later, the gain rose back by 20 dB at most: 0 dB
+        quiet = np.full((MIX_RATE, 2), 0.01, dtype=np.float32)
+        out = limit(limiter, loud, quiet)
+        self.assertAlmostEqual(10 ** (CEILING / 20), float(out[:LIMITER_BLOCK].max()), places=5)
+        self.assertEqual(0.0, limiter.gain)
+        self.assertLess(out[LIMITER_BLOCK, 0], 0.01)
+        self.assertAlmostEqual(0.01, float(out[-1, 0]), places=6)
+
+    def test_gain_without_steps(self):
+        # a burst in the middle of quiet chunks: the gain ramps down before it and back up after it
+        samples = np.full((MIX_RATE, 2), 0.5, dtype=np.float32)
+        samples[MIX_RATE // 2:MIX_RATE // 2 + LIMITER_BLOCK] = 4.0
+        out = limit(Limiter(), samples[:MIX_RATE // 3], samples[MIX_RATE // 3:])
+        self.assertLessEqual(float(np.abs(out).max()), 10 ** (CEILING / 20) + 1e-6)
+        gain = out[:, 0] / samples[:, 0]
+        # largest change of the gain between two samples, outside of the burst: about 0.1 dB
+        jumps = np.abs(np.diff(20 * np.log10(gain)))
+        jumps[MIX_RATE // 2 - 1:MIX_RATE // 2 + LIMITER_BLOCK] = 0
+        self.assertLess(float(jumps.max()), 0.2)
+
+    def test_mix_gain(self):
+        self.assertEqual(1.0, pcm_mix.mix_gain(None))
+        self.assertEqual(1.0, pcm_mix.mix_gain(float("-inf")))
+        self.assertAlmostEqual(1.0, pcm_mix.mix_gain(pcm_mix.MIX_TARGET - 3))
+        self.assertAlmostEqual(10.0, pcm_mix.mix_gain(-100))
+
+
+class TestMusicLoop(unittest.TestCase):
+    def test_looped_views(self):
+        music = pcm_mix._Music.__new__(pcm_mix._Music)
+        music.pipe = None
+        music.position = 0
+        music.samples = np.arange(10, dtype=np.float32).repeat(2).reshape(10, 2)
+        out = np.zeros((25, 2), dtype=np.float32)
+        music.add_to(out, 2.0, np.empty_like(out))
+        expected = 2 * np.concatenate((np.arange(10), np.arange(10), np.arange(5)))
+        np.testing.assert_array_equal(expected, out[:, 0])
+        self.assertEqual(5, music.position)
+
+
+@unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not installed")
+class TestCombinePcm(unittest.TestCase):
+    def test_combine_without_intermediate_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            video = os.path.join(tmp_dir, "video.mp4")
+            music = os.path.join(tmp_dir, "music.mp3")
+            subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=64x64:rate=10:d=3",
+                            "-f", "lavfi", "-i", "sine=frequency=300:d=3", "-c:v", "libx264", "-shortest", video],
+                           check=True)
+            subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=500:d=1", music],
+                           check=True)
+
+            def fake_probe(path: str) -> dict:
+                duration = "3.0" if path == video else "1.0"
+                return {"format": {"duration": duration}, "streams": [{"codec_type": "audio"}]}
+
+            with mock.patch.dict(Params().params_dict, {"mix_backend": "numpy"}), \
+                    mock.patch.object(audio_manip, "probe", fake_probe), \
+                    mock.patch("back_end.video_manip.probe", fake_probe), \
+                    mock.patch.object(audio_manip, "get_loudness", return_value=-20.0):
+                output = audio_manip.audio_combine(video, music, compress=False)
+
+            self.assertEqual(os.path.join(tmp_dir, "video__combine.mp4"), output)
+            self.assertEqual(["music.mp3", "video.mp4", "video__combine.mp4"], sorted(os.listdir(tmp_dir)))
+            pcm = subprocess.run(["ffmpeg", "-loglevel", "error", "-i", output, "-f", "f32le", "-ac", "2",
+                                  "-ar", str(MIX_RATE), "-"], check=True, capture_output=True).stdout
+            samples = np.frombuffer(pcm, dtype=np.float32)
+            self.assertAlmostEqual(3.0, len(samples) / 2 / MIX_RATE, delta=0.1)
+            self.assertLessEqual(float(np.abs(samples).max()), 10 ** (CEILING / 20) * 1.1)
+            # the music is looped until the end: no silent last second
+            self.assertGreater(float(np.abs(samples[-MIX_RATE:]).mean()), 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import ffmpeg
+
+from back_end import preview
+
+
+class TestPreview(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        mock.patch.object(preview, "PREVIEW_DIR", os.path.join(self.tmp_dir.name, "previews")).start()
+        self.encode = mock.patch.object(preview, "_encode_preview", side_effect=self.fake_encode).start()
+        self.video = os.path.join(self.tmp_dir.name, "video.mp4")
+        with open(self.video, "wb") as f:
+            f.write(b"video")
+
+    def tearDown(self):
+        mock.patch.stopall()
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def fake_encode(path: str, output: str):
+        time.sleep(0.05)
+        with open(output, "wb") as f:
+            f.write(b"preview")
+
+    def test_cached_by_identity(self):
+        first = preview.make_preview(self.video)
+        self.assertTrue(os.path.isfile(first))
+        self.assertEqual(first, preview.make_preview(self.video))
+        self.assertEqual(1, self.encode.call_count)
+        with open(self.video, "ab") as f:
+            f.write(b"modified")
+        self.assertNotEqual(first, preview.make_preview(self.video))
+        self.assertEqual(2, self.encode.call_count)
+
+    def test_concurrent_requests(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            previews = set(executor.map(preview.make_preview, [self.video] * 4))
+        self.assertEqual(1, len(previews))
+        self.assertEqual(1, self.encode.call_count)
+        # the lock of a preview is dropped once no request waits for it
+        self.assertEqual({}, preview._locks)
+
+    def test_not_a_media(self):
+        self.assertIsNone(preview.make_preview(os.path.join(self.tmp_dir.name, "notes.txt")))
+        self.assertIsNone(preview.make_preview(os.path.join(self.tmp_dir.name, "missing.mp4")))
+
+    def test_failed_encoding(self):
+        self.encode.side_effect = ffmpeg.Error("ffmpeg", b"", b"")
+        self.assertIsNone(preview.make_preview(self.video))
+        self.assertEqual([], os.listdir(preview.PREVIEW_DIR))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import contextvars
+import io
+import unittest
+
+from toolbox.ProgressBar import ProgressHub, read_progress_events
+
+PROGRESS_OUTPUT = b"""frame=120
+fps=59.94
+bitrate=1500.2kbits/s
+total_size=1048576
+out_time_us=4000000
+out_time=00:00:04.000000
+speed=2.5x
+progress=continue
+frame=300
+fps=60.00
+bitrate=1500.0kbits/s
+total_size=2097152
+out_time_us=N/A
+out_time=00:00:10.000000
+speed=2.51x
+progress=end
+"""
+
+
+class RecordingSink:
+    def __init__(self):
+        self.fractions = []
+        self.finished = []
+
+    def update(self, hub, job):
+        self.fractions.append(hub.batch_fraction())
+
+    def job_finished(self, hub, job):
+        self.finished.append(job.name)
+
+
+class TestProgress(unittest.TestCase):
+    def test_read_progress_events(self):
+        events = list(read_progress_events(io.BytesIO(PROGRESS_OUTPUT)))
+        self.assertEqual(2, len(events))
+        self.assertEqual(4.0, events[0].out_time)
+        self.assertEqual(2.5, events[0].speed)
+        self.assertEqual(1048576, events[0].total_size)
+        self.assertFalse(events[0].done)
+        self.assertEqual(10.0, events[1].out_time)
+        self.assertTrue(events[1].done)
+
+    def test_batch_fraction(self):
+        hub = ProgressHub()
+        sink = RecordingSink()
+        sinks = hub.sinks
+        hub.sinks = [sink]
+        try:
+            with hub.batch(2):
+                job = hub.start_job("first", 10.0)
+                for event in read_progress_events(io.BytesIO(PROGRESS_OUTPUT)):
+                    hub.update(job, event)
+                hub.finish_job(job)
+                self.assertEqual([0.2, 0.5], sink.fractions)
+                self.assertEqual(["first"], sink.finished)
+                self.assertEqual(2, hub.total_count())
+                self.assertEqual(0.5, hub.batch_fraction())
+            self.assertEqual(1.0, hub.batch_fraction())
+        finally:
+            hub.sinks = sinks
+
+    def test_new_batch_after_idle(self):
+        hub = ProgressHub()
+        sinks = hub.sinks
+        hub.sinks = []
+        try:
+            hub.finish_job(hub.start_job("first", 10.0))
+            self.assertEqual(1, hub.done_count)
+            # nothing ran in between: the counts of the root scope restart
+            job = hub.start_job("second", 10.0)
+            self.assertEqual(0, hub.done_count)
+            self.assertEqual([job], hub.running_jobs())
+            hub.finish_job(job)
+        finally:
+            hub.sinks = sinks
+
+    def test_scoped_sinks(self):
+        hub = ProgressHub()
+        mine, other = RecordingSink(), RecordingSink()
+
+        def session(name):
+            with hub.batch(2):
+                job = hub.start_job(name, 10.0)
+                for event in read_progress_events(io.BytesIO(PROGRESS_OUTPUT)):
+                    hub.update(job, event)
+                hub.finish_job(job)
+
+        # each session runs in a context of its own, as run_operation does
+        contextvars.copy_context().run(hub.scoped(session, mine), "mine")
+        contextvars.copy_context().run(hub.scoped(session, other), "other")
+        session("unscoped")
+        self.assertEqual(["mine"], mine.finished)
+        self.assertEqual(["other"], other.finished)
+        # the fraction is the one of the session's batch only
+        self.assertEqual([0.2, 0.5], mine.fractions)
+        self.assertNotIn(mine, hub.sinks)
+
+
+if __name__ == "__main__":
+    unittest.main()
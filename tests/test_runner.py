@@ -0,0 +1,132 @@
+import asyncio
+import os
+import shutil
+import sys
+import time
+import unittest
+
+import ffmpeg
+
+from back_end import runner
+
+SLEEP = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+def process_state(pid: int) -> str:
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().rsplit(")", 1)[1].split()[0]
+
+
+class TestRunner(unittest.TestCase):
+    def test_run_error(self):
+        with self.assertRaises(ffmpeg.Error):
+            runner.run([sys.executable, "-c", "import sys; sys.exit(3)"], capture_stderr=True)
+
+    def test_run_capture(self):
+        out, err = runner.run([sys.executable, "-c", "print('ok')"], capture_stdout=True)
+        self.assertEqual(b"ok", out.strip())
+        self.assertIsNone(err)
+
+    def test_kill_all(self):
+        process = runner.run_async(SLEEP)
+        runner.kill_all()
+        self.assertNotEqual(0, process.wait(timeout=5))
+
+    def _cancel_after(self, operation, delay: float = 0.5) -> float:
+        """
+        :return: seconds until the cancelled operation returned
+        """
+        async def scenario():
+            task = asyncio.create_task(runner.run_operation(operation))
+            await asyncio.sleep(delay)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.time()
+        asyncio.run(scenario())
+        return time.time() - start
+
+    def test_cancel_run(self):
+        outcome = []
+
+        def operation():
+            try:
+                runner.run(SLEEP)
+            except runner.JobCancelled:
+                outcome.append("cancelled")
+            # no new process once cancelled
+            try:
+                runner.run(SLEEP)
+            except runner.JobCancelled:
+                outcome.append("refused")
+
+        self.assertLess(self._cancel_after(operation), 10)
+        self.assertEqual(["cancelled", "refused"], outcome)
+
+    def test_cancel_run_async(self):
+        return_codes = []
+
+        def operation():
+            return_codes.append(runner.run_async(SLEEP).wait())
+
+        self.assertLess(self._cancel_after(operation), 10)
+        self.assertNotEqual(0, return_codes[0])
+
+    def test_cancel_generator(self):
+        events = []
+
+        def operation():
+            try:
+                yield "first"
+                runner.run(SLEEP)
+                yield "never"
+            except runner.JobCancelled:
+                events.append("cancelled")
+            finally:
+                events.append("closed")
+
+        async def scenario():
+            async def consume():
+                async for res in runner.run_generator(operation):
+                    events.append(res)
+
+            task = asyncio.create_task(consume())
+            await asyncio.sleep(0.5)
+            task.cancel()
+            # not ValueError: generator already executing
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.time()
+        asyncio.run(scenario())
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(["first", "cancelled", "closed"], events)
+
+    @unittest.skipUnless(os.path.isdir("/proc"), "needs /proc to read the process state")
+    def test_pause_batch_lane(self):
+        interactive = runner.run_async(SLEEP)
+        with runner.lane(runner.BATCH):
+            batch = runner.run_async(SLEEP)
+            try:
+                runner.pause_batch()
+                late = runner.run_async(SLEEP)
+                time.sleep(0.2)
+                self.assertEqual(["T", "T"], [process_state(batch.pid), process_state(late.pid)])
+                self.assertNotEqual("T", process_state(interactive.pid))
+                runner.resume_batch()
+                time.sleep(0.2)
+                self.assertNotEqual("T", process_state(batch.pid))
+            finally:
+                runner.resume_batch()
+                runner.kill_all()
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not installed")
+    def test_run_ffmpeg_async(self):
+        stream = ffmpeg.input("anullsrc", f="lavfi", t=1).output("-", f="null")
+        out, err = asyncio.run(runner.run_ffmpeg_async(stream, capture_stdout=True, capture_stderr=True))
+        self.assertIsNotNone(err)
+
+
+if __name__ == "__main__":
+    unittest.main()
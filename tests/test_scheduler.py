@@ -0,0 +1,147 @@
+import contextvars
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from back_end import scheduler
+from back_end import runner
+from back_end.scheduler import BatchScheduler, Job, ffmpeg_threads, percentile
+from toolbox.Parameters import Params
+
+COSTS = {"small.mp4": 1.0, "big.mp4": 100.0, "medium.mp4": 10.0}
+
+
+def failing_job():
+    raise Exception("boom")
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        Params().params_dict = {"max_workers": "2"}
+
+    def tearDown(self):
+        Params().params_dict = {}
+
+    def test_order_by_cost(self):
+        jobs = [Job(str, path=path) for path in COSTS]
+        with mock.patch.object(scheduler, "estimate_cost", side_effect=lambda path, op: COSTS[path]):
+            self.assertEqual(["big.mp4", "medium.mp4", "small.mp4"],
+                             [job.path for job in BatchScheduler().order(jobs)])
+            Params().params_dict["schedule_order"] = "shortest"
+            self.assertEqual(["small.mp4", "medium.mp4", "big.mp4"],
+                             [job.path for job in BatchScheduler().order(jobs)])
+
+    def test_results_in_submission_order(self):
+        jobs = [Job(str.upper, (path,), path=path) for path in COSTS]
+        with mock.patch.object(scheduler, "estimate_cost", side_effect=lambda path, op: COSTS[path]):
+            self.assertEqual(["SMALL.MP4", "BIG.MP4", "MEDIUM.MP4"], BatchScheduler().run(jobs))
+
+    def test_threads_budget(self):
+        batch = BatchScheduler()
+        batch._get_executor()
+        batch._queued = 4
+        try:
+            self.assertEqual(max(1, batch.cores // 2), batch.threads_per_job())
+        finally:
+            batch._queued = 0
+        self.assertIn('threads', batch.run([Job(ffmpeg_threads)])[0])
+        self.assertEqual({}, ffmpeg_threads())
+
+    def test_threads_budget_in_threads_of_a_job(self):
+        def segments():
+            # like chunked.encode_in_segments: the threads of a job run in a copy of its context
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                return [executor.submit(contextvars.copy_context().run, ffmpeg_threads).result() for _ in range(2)]
+
+        result = BatchScheduler().run_results([Job(segments)])[0][0]
+        self.assertEqual(2, len(result))
+        self.assertTrue(all('threads' in threads for threads in result))
+
+    def test_generator_of_jobs(self):
+        jobs = (Job(str.upper, (path,), path=path) for path in COSTS)
+        self.assertEqual(["SMALL.MP4", "BIG.MP4", "MEDIUM.MP4"], BatchScheduler().run(jobs))
+        self.assertEqual(0, BatchScheduler()._queued)
+
+    def test_stream_ordered_in_window(self):
+        Params().params_dict["max_workers"] = "1"
+        costs = {"first.mp4": 1.0, "small.mp4": 1.0, **COSTS}
+        started = []
+
+        def job(path):
+            started.append(path)
+            if path == "first.mp4":
+                time.sleep(0.2)
+            return path
+
+        jobs = (Job(job, (path,), path=path) for path in costs)
+        with mock.patch.object(scheduler, "estimate_cost", side_effect=lambda path, op: costs[path]):
+            self.assertEqual(list(costs), BatchScheduler().run(jobs))
+        # the jobs produced while the worker was busy ran longest first
+        self.assertEqual(["first.mp4", "big.mp4", "medium.mp4", "small.mp4"], started)
+
+    def test_stream_threads_budget(self):
+        batch = BatchScheduler()
+        jobs = (Job(batch.threads_per_job) for _ in range(1))
+        self.assertEqual([max(1, batch.cores // min(2, batch.cores))], batch.run(jobs))
+
+    def test_error_in_job(self):
+        self.assertEqual(["Error: boom"], BatchScheduler().run([Job(failing_job)]))
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual([50.0, 90.0, 99.0, 100.0], [percentile(values, p) for p in (50, 90, 99, 100)])
+        self.assertEqual(3.0, percentile([3.0], 99))
+
+    def test_lanes(self):
+        batch = BatchScheduler()
+        before = batch.latency_percentiles()
+        with mock.patch.object(runner, "pause_batch") as pause, mock.patch.object(runner, "resume_batch") as resume, \
+                mock.patch.object(runner, "CAN_PAUSE", True):
+            with batch.interactive():
+                with batch.interactive():
+                    pass
+                resume.assert_not_called()
+            pause.assert_called_once()
+            resume.assert_called_once()
+        self.assertEqual([runner.BATCH], batch.run([Job(lambda: runner._lane.get())]))
+        stats = batch.latency_percentiles()
+        self.assertEqual(before[runner.INTERACTIVE]["count"] + 2, stats[runner.INTERACTIVE]["count"])
+        self.assertEqual(before[runner.BATCH]["count"] + 1, stats[runner.BATCH]["count"])
+        self.assertIn("p99", stats[runner.BATCH])
+
+    def test_pause_capped(self):
+        batch = BatchScheduler()
+        with mock.patch.object(runner, "pause_batch") as pause, mock.patch.object(runner, "resume_batch") as resume, \
+                mock.patch.object(runner, "CAN_PAUSE", True), mock.patch.object(scheduler, "MAX_BATCH_PAUSE", 0.05):
+            with batch.interactive():
+                time.sleep(0.3)
+                pause.assert_called_once()
+                # the batch runs again while the interactive operation goes on
+                resume.assert_called_once()
+            resume.assert_called_once()
+
+    def test_reserved_slot(self):
+        batch = BatchScheduler()
+        running = []
+        peak = []
+
+        def job():
+            running.append(1)
+            peak.append(len(running))
+            time.sleep(0.05)
+            running.pop()
+
+        # without SIGSTOP, the batch jobs keep running on the workers left by the interactive operation
+        with mock.patch.object(runner, "CAN_PAUSE", False), mock.patch.object(runner, "pause_batch") as pause:
+            with batch.interactive():
+                batch.run([Job(job) for _ in range(4)])
+            pause.assert_not_called()
+        self.assertEqual(1, max(peak))
+        peak.clear()
+        batch.run([Job(job) for _ in range(4)])
+        self.assertEqual(2, max(peak))
+
+
+if __name__ == "__main__":
+    unittest.main()
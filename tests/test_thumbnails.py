@@ -0,0 +1,47 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from back_end import media_info, thumbnails
+from toolbox.Parameters import Params
+
+
+@unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not installed")
+class TestContactSheet(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        Params().params_dict = {"cache_dir": self.tmp_dir.name}
+        media_info.close_index()
+        self.video = os.path.join(self.tmp_dir.name, "video.mp4")
+        subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=640x360:rate=25:duration=8",
+                        "-c:v", "libx264", "-g", "25", self.video], check=True)
+        mock.patch.object(thumbnails, "probe", return_value={"format": {"duration": "8"}}).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        media_info.close_index()
+        Params().params_dict = {}
+        self.tmp_dir.cleanup()
+
+    def test_sheet(self):
+        sheet = thumbnails.contact_sheet(self.video, columns=2, rows=2, width=160)
+        self.assertEqual(os.path.join(self.tmp_dir.name, "video__sheet.jpg"), sheet)
+        self.assertTrue(os.path.isfile(sheet))
+
+    def test_cached(self):
+        sheet = thumbnails.contact_sheet(self.video)
+        mtime = os.stat(sheet).st_mtime_ns
+        with mock.patch.object(thumbnails.ffmpeg, "output") as output:
+            self.assertEqual(sheet, thumbnails.contact_sheet(self.video))
+            output.assert_not_called()
+        self.assertEqual(mtime, os.stat(sheet).st_mtime_ns)
+
+    def test_missing_video(self):
+        self.assertTrue(thumbnails.contact_sheet("missing.mp4").startswith("Error"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,12 @@
 import os
 import unittest
+from unittest import mock
+
+import ffmpeg
 
 from back_end.video_manip import get_video_duration, get_resolution, get_video_bitrate, get_original_codecs, \
-    is_video
+    is_video, parse_segments, is_on_keyframe, stream_signature, compression_decision, _encode_args, \
+    _splice_windows, CompressionDecision, _conform
 
 
 class TestVideoProcessing(unittest.TestCase):
@@ -37,5 +41,123 @@ class TestVideoProcessing(unittest.TestCase):
         self.assertFalse(is_video(v_path))
 
 
+class TestSegments(unittest.TestCase):
+
+    def test_parse_segments(self):
+        times = [["00:00:10", "20"], ["", ""], ["30", ""]]
+        self.assertEqual([(10.0, 20.0), (30.0, 60.0)], parse_segments(times, 60.0))
+
+    def test_parse_segments_errors(self):
+        self.assertTrue(parse_segments([["20", "10"]], 60.0).startswith("Error"))
+        self.assertTrue(parse_segments([["aa", "10"]], 60.0).startswith("Syntax error"))
+        self.assertTrue(parse_segments([["", ""]], 60.0).startswith("Error"))
+
+    def test_is_on_keyframe(self):
+        keyframes = [0.0, 2.0, 4.0]
+        self.assertTrue(is_on_keyframe(2.0, keyframes))
+        self.assertTrue(is_on_keyframe(4.0005, keyframes))
+        self.assertFalse(is_on_keyframe(3.0, keyframes))
+        self.assertFalse(is_on_keyframe(5.0, keyframes))
+
+
+class TestCodecs(unittest.TestCase):
+    def test_codecs_without_video_stream(self):
+        info = {"streams": [{"codec_type": "audio", "codec_name": "aac"}]}
+        with mock.patch("back_end.video_manip.probe", return_value=info):
+            video_codec, audio_codec = get_original_codecs("a.mp4")
+        self.assertTrue(video_codec.startswith("Error"))
+        self.assertEqual("", audio_codec)
+
+
+class TestConcat(unittest.TestCase):
+
+    def test_stream_signature(self):
+        info = {
+            "format": {"duration": "10"},
+            "streams": [
+                {"codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080, "pix_fmt": "yuv420p",
+                 "time_base": "1/15360", "r_frame_rate": "30/1"},
+                {"codec_type": "audio", "codec_name": "aac", "sample_rate": "48000", "channels": 2,
+                 "channel_layout": "stereo"}
+            ]
+        }
+        with mock.patch("back_end.video_manip.probe", return_value=info):
+            signature = stream_signature("a.mp4")
+        self.assertEqual("h264", signature["vcodec"])
+        self.assertEqual("1/15360", signature["time_base"])
+        self.assertEqual("stereo", signature["channel_layout"])
+
+    def test_encode_args_match_source(self):
+        reference = {"vcodec": "hevc", "profile": "Main 10", "level": 123, "pix_fmt": "yuv420p10le",
+                     "time_base": "1/15360"}
+        with mock.patch("back_end.video_manip.get_video_bitrate", return_value=4000):
+            args = _encode_args("a.mp4", reference)
+        self.assertEqual("main10", args["profile:v"])
+        self.assertEqual("repeat-headers=1:level-idc=4.1", args["x265-params"])
+        self.assertEqual("yuv420p10le", args["pix_fmt"])
+        self.assertEqual("passthrough", args["fps_mode"])
+
+    def test_splice_windows(self):
+        keyframes = [0.0, 2.0, 4.0, 6.0, 8.0, 10.0, 12.0]
+        # copied from 2 to 10: the head and the two GOPs after it, the GOP before the tail and the tail
+        self.assertEqual([(1.0, 6.0), (8.0, 11.0)], _splice_windows(keyframes, 1, 5, 1.0, 11.0))
+        self.assertEqual([(1.0, 9.0)], _splice_windows(keyframes, 1, 4, 1.0, 9.0))
+        # nothing re-encoded after the copied part
+        self.assertEqual([(2.0, 6.0)], _splice_windows(keyframes, 1, 6, 2.0, 12.0))
+
+    def test_conform_mismatched_streams_only(self):
+        reference = {"vcodec": "h264", "profile": "High", "level": 40, "width": 1920, "height": 1080,
+                     "pix_fmt": "yuv420p", "time_base": "1/15360", "r_frame_rate": "30/1", "acodec": "aac",
+                     "sample_rate": "48000", "channels": 2, "channel_layout": "stereo"}
+        silent = {**reference, "acodec": None, "sample_rate": None, "channels": None, "channel_layout": None}
+        other_size = {**reference, "width": 1280, "height": 1024}
+        commands = []
+        with mock.patch("back_end.video_manip.runner.run", side_effect=lambda spec: commands.append(
+                " ".join(ffmpeg.compile(spec)))), \
+                mock.patch("back_end.video_manip.get_video_bitrate", return_value=4000):
+            _conform("a.mp4", silent, reference, False, "out.mp4")
+            _conform("b.mp4", other_size, reference, False, "out.mp4")
+        # silence added, the video copied
+        self.assertIn("anullsrc=r=48000:cl=stereo", commands[0])
+        self.assertIn("-vcodec copy", commands[0])
+        # letterboxed into the frame of the reference, the audio copied
+        self.assertIn("force_original_aspect_ratio=decrease", commands[1])
+        self.assertIn("pad=1920:1080", commands[1])
+        self.assertIn("repeat-headers=1", commands[1])
+        self.assertIn("-acodec copy", commands[1])
+
+
+def _info(codec="hevc", width=1280, height=720, bit_rate="2000000", format_name="mov,mp4,m4a,3gp,3g2,mj2"):
+    video = {"codec_type": "video", "codec_name": codec, "width": width, "height": height}
+    if bit_rate is not None:
+        video["bit_rate"] = bit_rate
+    return {"streams": [video], "format": {"format_name": format_name}}
+
+
+class TestCompressionDecision(unittest.TestCase):
+    def test_skip_compliant(self):
+        decision = compression_decision(_info(), ".mp4", 3000, 720, "hevc")
+        self.assertEqual("skip", decision.action)
+        self.assertIn("2000 kb/s <= 3000 kb/s", decision.reason)
+        self.assertTrue(str(decision).startswith("skipped: already hevc"))
+
+    def test_remux_other_container(self):
+        decision = compression_decision(_info(format_name="matroska,webm"), ".mp4", 3000, 720, "hevc")
+        self.assertEqual("remux", decision.action)
+
+    def test_encode_reasons(self):
+        self.assertEqual(CompressionDecision("encode", "1920x1080 > 720p"),
+                         compression_decision(_info(width=1920, height=1080), ".mp4", 3000, 720, "hevc"))
+        self.assertEqual(CompressionDecision("encode", "h264 -> hevc"),
+                         compression_decision(_info(codec="h264"), ".mp4", 3000, 720, "hevc"))
+        self.assertEqual("encode", compression_decision(_info(bit_rate="5000000"), ".mp4", 3000, 720, "hevc").action)
+        self.assertEqual(CompressionDecision("encode", "bitrate unknown"),
+                         compression_decision(_info(bit_rate=None), ".mp4", 3000, 720, "hevc"))
+
+    def test_quality_ignores_bitrate(self):
+        decision = compression_decision(_info(bit_rate="9000000"), ".mp4", 3000, 720, "hevc", quality=23)
+        self.assertEqual("skip", decision.action)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from back_end.watcher import FolderWatcher, RESULTS_KEPT
+
+
+class TestFolderWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.video = os.path.join(self.tmp_dir.name, "capture.mp4")
+        self.write(self.video, b"frames")
+        self.write(os.path.join(self.tmp_dir.name, "capture__cut.mp4"), b"output")
+        self.write(os.path.join(self.tmp_dir.name, "notes.txt"), b"text")
+        self.watcher = FolderWatcher([self.tmp_dir.name], "compress", settle_time=10)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def write(path: str, data: bytes):
+        with open(path, "ab") as f:
+            f.write(data)
+
+    def test_wait_until_file_stops_growing(self):
+        self.assertEqual([], self.watcher.scan(now=100))
+        self.assertEqual([], self.watcher.scan(now=105))
+        self.write(self.video, b"more frames")
+        self.assertEqual([], self.watcher.scan(now=112))
+        self.assertEqual([], self.watcher.scan(now=120))
+        self.assertEqual([self.video], self.watcher.scan(now=122))
+
+    def test_process_once(self):
+        with mock.patch("back_end.watcher.BatchScheduler") as scheduler, mock.patch("time.time", return_value=100):
+            scheduler.return_value.run_results.return_value = [("done", "encoded: h264 -> hevc")]
+            self.watcher.poll_once()
+        with mock.patch("back_end.watcher.BatchScheduler") as scheduler, mock.patch("time.time", return_value=200):
+            scheduler.return_value.run_results.return_value = [("done", "encoded: h264 -> hevc")]
+            self.assertEqual([self.video], self.watcher.poll_once())
+            self.watcher.wait()
+            self.assertEqual(["done (encoded: h264 -> hevc)"], list(self.watcher.results))
+            jobs = scheduler.return_value.run_results.call_args[0][0]
+            self.assertEqual([self.video], [job.path for job in jobs])
+            self.assertEqual([], self.watcher.poll_once())
+
+    def test_scan_while_batch_runs(self):
+        running = threading.Event()
+        release = threading.Event()
+
+        def run_results(jobs):
+            running.set()
+            release.wait(5)
+            return [("done", None)]
+
+        with mock.patch("back_end.watcher.BatchScheduler") as scheduler, mock.patch("time.time", return_value=100):
+            scheduler.return_value.run_results.side_effect = run_results
+            self.watcher.scan()
+        with mock.patch("back_end.watcher.BatchScheduler") as scheduler, mock.patch("time.time", return_value=200):
+            scheduler.return_value.run_results.side_effect = run_results
+            # the poll returns while the batch is running
+            self.assertEqual([self.video], self.watcher.poll_once())
+            self.assertTrue(running.wait(5))
+            self.assertEqual([], list(self.watcher.results))
+            release.set()
+            self.watcher.wait()
+        self.assertEqual(["done"], list(self.watcher.results))
+
+    def test_results_bounded(self):
+        self.watcher.results.extend(str(i) for i in range(RESULTS_KEPT + 10))
+        self.assertEqual(RESULTS_KEPT, len(self.watcher.results))
+        self.assertEqual("10", self.watcher.results[0])
+
+if __name__ == "__main__":
+    unittest.main()